@@ -3,8 +3,8 @@ _sendscript_completion() {
 	cur=${COMP_WORDS[COMP_CWORD]}
 
 	COMPREPLY=()
-	local JOBSCRIPTOPT='-h --help --qsys-args --workdir --scratchdir --mail --wt --mem --vmem --np --name --priority --queue --merge_stdout_stderr --send_email_end --send_email_begin --send_email_error -q -d -m'
-	local BUILDERMAINOPT='--cfg --send'
+	local JOBSCRIPTOPT='-h --help --qsys-args --workdir --scratchdir --mail --wt --mem --vmem --np --name --priority --queue --merge_stdout_stderr --send_email_end --send_email_begin --send_email_error --stagein-mode --stageout-compression --sync-interval --input-cache-size --stagein-all-nodes --no-stagein-all-nodes -q -d -m'
+	local BUILDERMAINOPT='--cfg --send --dumpcfg --manifest --workers --no-array --no-script-file'
 
 	COMPREPLY+=( $( compgen -W "${JOBSCRIPTOPT} ${BUILDERMAINOPT} $@ " -- "$cur" ) )
 
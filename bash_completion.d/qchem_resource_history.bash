@@ -0,0 +1,14 @@
+_qchem_resource_history() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	if [[ "$prev" == "--history" ]]; then
+		COMPREPLY=( $( compgen -f -- "$cur" ) )
+		return
+	fi
+
+	COMPREPLY=( $( compgen -W '-h --help --history --records --forget-pending' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qchem_resource_history qchem_resource_history
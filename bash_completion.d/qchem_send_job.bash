@@ -1,7 +1,7 @@
 . ${DREUWBIN_BASH_COMPLETION_DIR}/general_send_job.bash
 
 _qchem_send_job() {
-	local QCHEMOPT='--out --save --savedir --np-to-qchem --nt-to-qchem --version --perf'
+	local QCHEMOPT='--out --save --savedir --np-to-qchem --nt-to-qchem --version --perf --pack --pack-np --pack-mem --no-predict --predict-margin'
 	_sendscript_completion "$QCHEMOPT"
 }
 
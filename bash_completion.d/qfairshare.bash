@@ -0,0 +1,12 @@
+_qfairshare() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--user|--group|--days|--horizon) ]] && return
+
+	COMPREPLY=( $( compgen -W '-h --help --user --group --days --horizon --brief' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qfairshare qfairshare
@@ -0,0 +1,16 @@
+_qfanout() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--parallel|--timeout) ]] && return
+	if [[ "$prev" == "--sort" ]]; then
+		COMPREPLY=( $( compgen -W 'node status time output' -- "$cur" ) )
+		return
+	fi
+
+	COMPREPLY=( $( compgen -W '-h --help --parallel --timeout --sort --quiet --no-summary' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qfanout qfanout
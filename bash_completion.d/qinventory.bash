@@ -0,0 +1,12 @@
+_qinventory() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--property|--fit) ]] && return
+
+	COMPREPLY=( $( compgen -W '-h --help --nodes --property --fit --refresh' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qinventory qinventory
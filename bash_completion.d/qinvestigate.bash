@@ -1,8 +1,8 @@
 _qinvestigate() {
 	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
 	local cur=${COMP_WORDS[COMP_CWORD]}
-	local commands='alias help joblist summary login top scratch delete diskspace cleanup'
-	local options='-h --help --add-sshkey --no-add-sshkey'
+	local commands='alias fairshare help joblist nodes refresh summary watch login top scratch delete diskspace cleanup'
+	local options='-h --help --add-sshkey --no-add-sshkey --refresh'
 	local aliases='' #TODO implement
 
 	case "$prev" in
@@ -18,7 +18,7 @@ _qinvestigate() {
 			;;
 		*)
 			#already in command block => complete job ids or names
-			COMPREPLY=( $( compgen -W "$(qstat -u $USER | awk -v "user=$USER" '$2 == user { printf "%s %s ", $1, $4 }')" -- "$cur") )
+			COMPREPLY=( $( compgen -W "$(qsnapshot qstat --user "$USER" 2> /dev/null | awk -v "user=$USER" '$2 == user { printf "%s %s ", $1, $4 }')" -- "$cur") )
 			return
 			;;
 	esac
@@ -0,0 +1,12 @@
+_qsnapshot() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--ttl|--user) ]] && return
+
+	COMPREPLY=( $( compgen -W '-h --help --ttl --refresh --user --invalidate --list qstat qstat_full qnodes diagnose' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qsnapshot qsnapshot
@@ -0,0 +1,12 @@
+_qstate() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--user|--state|--node|--node-of|--estimates|--resolve|--last) ]] && return
+
+	COMPREPLY=( $( compgen -W '-h --help --user --state --node --ids --node-of --estimates --resolve --last --refresh' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qstate qstate
@@ -0,0 +1,12 @@
+_qwatch() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--user|--interval|--estimates-interval|--fairshare-interval|--count) ]] && return
+
+	COMPREPLY=( $( compgen -W '-h --help --user --all --interval --estimates-interval --fairshare-interval --count' -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _qwatch qwatch
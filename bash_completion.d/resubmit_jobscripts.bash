@@ -0,0 +1,18 @@
+_resubmit_jobscripts() {
+	local cur=${COMP_WORDS[COMP_CWORD]}
+	local prev=${COMP_WORDS[$((COMP_CWORD-1))]}
+
+	#if prev is option that reqires an arg: return
+	[[ "$prev" == @(--pattern|--name|--queue|--min-wt|--max-wt|--min-mem|--max-mem|--min-np|--max-np|--workers) ]] && return
+
+	if [[ "$prev" == "--index" ]]; then
+		COMPREPLY=( $( compgen -f -- "$cur" ) )
+		return
+	fi
+
+	COMPREPLY=( $( compgen -W '-h --help --pattern --name --queue --min-wt --max-wt --min-mem --max-mem --min-np --max-np --index --send --workers' -- "$cur" ) )
+	COMPREPLY+=( $( compgen -d -- "$cur" ) )
+
+	unset cur prev
+}
+complete -F _resubmit_jobscripts resubmit_jobscripts
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import re
-import scipy.constants
+
+# Hartree energy in eV (CODATA 2018, the value of scipy.constants)
+EH_in_eV = 27.211386245988
 
 
 def find_next_match(fiter, regex, max_advance=None):
@@ -58,9 +60,6 @@ def parse_state_amplitudes(fiter):
 
 
 def parse_excited_state(fiter):
-    EH_in_eV = scipy.constants.value("atomic unit of energy") \
-            / scipy.constants.value("electron volt")
-
     ret = {}
 
     # Search beginning
@@ -176,11 +176,23 @@ def deleteScratchFilesAndDirs(opts):
 		deleteFileOrDir(fileOrDir, opts)
 
 
+def sshOptions():
+	"""returns the options to share the ssh connections of a
+	qinvestigate session (see QFANOUT_CONTROL_DIR)."""
+	controlDir = os.getenv("QFANOUT_CONTROL_DIR")
+	if not controlDir:
+		return []
+	return [
+		"-o", "ControlMaster=auto",
+		"-o", "ControlPath=" + os.path.join(controlDir, "%C"),
+		"-o", "ControlPersist=" + os.getenv("QFANOUT_PERSIST", "60"),
+	]
+
+
 def processHost(hostname, opts):
 	sys.stdout.write("Processing host: {:s}\n".format(hostname))
 	sys.stdout.flush()
-	cmd = [
-		"/usr/bin/ssh",
+	cmd = ["/usr/bin/ssh"] + sshOptions() + [
 		hostname,
 		absPathOfThisScript(),
 		"--delete-scratch-files-here"
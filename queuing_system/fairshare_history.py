@@ -0,0 +1,294 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to keep a history of the fairshare reported by the scheduler
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+import shared_config_lib as conf
+import fcntl
+import os
+import time
+
+def default_historyfile():
+    """
+    Return the default file in which the fairshare history is kept
+    """
+    return os.path.join(conf.default_configdir(), "fairshare_history.tsv")
+
+def _float_or_none(string):
+    try:
+        return float(string)
+    except ValueError:
+        return None
+
+def parse_diagnose(output):
+    """
+    Parse the USER and GROUP blocks of the output of diagnose -f and
+    return a dict from "user" and "group" to dicts from each name
+    to the tuple (percent, target) of floats (None if not set).
+    """
+    ret = { "user": {}, "group": {} }
+    kind = None
+    for line in output.splitlines():
+        fields = line.split()
+        if kind is None:
+            if len(fields) == 1 and fields[0].lower() in ret:
+                kind = fields[0].lower()
+            continue
+        if not fields:
+            kind = None
+        elif len(fields) >= 3 and not fields[0].startswith("---"):
+            percent = _float_or_none(fields[1])
+            if percent is not None:
+                ret[kind][fields[0].rstrip("*")] = (percent, _float_or_none(fields[2]))
+    return ret
+
+def place_of(name, entries):
+    """
+    Return the place of name among the entries (a dict from names
+    to (percent, target)) ordered by descending percentage, where
+    entries with the same percentage share the last of their places.
+    """
+    percent = entries[name][0]
+    return sum(1 for p, t in entries.values() if p >= percent)
+
+class fairshare_record:
+    """
+    The fairshare of a user or a group at one point in time
+    """
+    def __init__(self, time, kind, name, percent, target, place, n_entries):
+        self.time = time              #type: float  epoch of the query of diagnose
+        self.kind = kind              #type: str    "user" or "group"
+        self.name = name              #type: str    name of the user or the group
+        self.percent = percent        #type: float  fairshare usage in percent
+        self.target = target          #type: float  fairshare target in percent or None
+        self.place = place            #type: int    place by descending usage
+        self.n_entries = n_entries    #type: int    number of users or groups
+
+    def to_line(self):
+        return "\t".join([ "{0:.0f}".format(self.time), self.kind, self.name,
+                           "{0:g}".format(self.percent),
+                           "-" if self.target is None else "{0:g}".format(self.target),
+                           str(self.place), str(self.n_entries) ]) + "\n"
+
+    @staticmethod
+    def from_line(line):
+        """Parse a line written by to_line, returns None if it is invalid"""
+        fields = line.rstrip("\n").split("\t")
+        if len(fields) != 7:
+            return None
+        try:
+            return fairshare_record(float(fields[0]), fields[1], fields[2], float(fields[3]),
+                                    None if fields[4] == "-" else float(fields[4]),
+                                    int(fields[5]), int(fields[6]))
+        except ValueError:
+            return None
+
+def records_from_diagnose(output, user=None, group=None, now=None):
+    """
+    Return the fairshare_records of the user and the group in the output
+    of diagnose -f (those not found are skipped).
+    """
+    if now is None:
+        now = time.time()
+    parsed = parse_diagnose(output)
+    ret = []
+    for kind, name in [ ("user", user), ("group", group) ]:
+        entries = parsed[kind]
+        if name is not None and name in entries:
+            percent, target = entries[name]
+            ret.append(fairshare_record(now, kind, name, percent, target,
+                                        place_of(name, entries), len(entries)))
+    return ret
+
+class fairshare_history:
+    """
+    Append-only history of fairshare_records kept in a file with one
+    tab-separated line per record.
+
+    Records are appended at most every min_interval seconds, since the
+    fairshare only changes slowly. Once the file grows beyond max_bytes,
+    the older half of the records is dropped.
+    """
+
+    def __init__(self, historyfile=None, max_bytes=512*1024, min_interval=300):
+        self.__historyfile = historyfile if historyfile is not None \
+                else default_historyfile()
+        self.__max_bytes = max_bytes
+        self.__min_interval = min_interval
+
+    def append(self, records):
+        """
+        Append the records to the history unless the last records
+        were appended less than min_interval seconds ago.
+        Returns whether the records were appended.
+        """
+        if not records:
+            return False
+        try:
+            if time.time() - os.path.getmtime(self.__historyfile) < self.__min_interval:
+                return False
+        except OSError:
+            directory = os.path.dirname(self.__historyfile)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+        # A single write of a few lines with O_APPEND is not
+        # interleaved with the writes of other processes
+        fd = os.open(self.__historyfile, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, "".join(r.to_line() for r in records).encode())
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.__max_bytes:
+            self.__truncate()
+        return True
+
+    def __truncate(self):
+        with open(self.__historyfile + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(self.__historyfile) as f:
+                    lines = f.readlines()
+                if sum(len(l) for l in lines) <= self.__max_bytes:
+                    return  # Another process was faster
+                tmpfile = self.__historyfile + "." + str(os.getpid()) + ".tmp"
+                with open(tmpfile, "w") as f:
+                    f.writelines(lines[len(lines) // 2:])
+                os.replace(tmpfile, self.__historyfile)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def records(self, kind=None, name=None, since=None):
+        """
+        Return the list of fairshare_records in the history, optionally
+        only those of the given kind, name and not older than since.
+        """
+        try:
+            with open(self.__historyfile) as f:
+                lines = f.readlines()
+        except OSError:
+            return []
+        ret = []
+        for line in lines:
+            record = fairshare_record.from_line(line)
+            if record is None:
+                continue
+            if (kind is None or record.kind == kind) and (name is None or record.name == name) \
+                    and (since is None or record.time >= since):
+                ret.append(record)
+        return ret
+
+class fairshare_trend:
+    """
+    Trend of the fairshare usage of a user or group from its records
+    """
+    def __init__(self, records, horizon=86400):
+        """
+        records:  the fairshare_records of one user or group in time order
+        horizon:  number of seconds after the last record to project to
+        """
+        self.records = records          #type: list   the fairshare_records
+        self.slope = None               #type: float  change of the usage in percent per day
+        self.projected_percent = None   #type: float  usage in percent after the horizon
+        self.horizon = horizon          #type: int    seconds to project to
+
+        if len(records) >= 2 and records[-1].time > records[0].time:
+            ts = [ (r.time - records[0].time) / 86400. for r in records ]
+            ps = [ r.percent for r in records ]
+            tmean = sum(ts) / len(ts)
+            pmean = sum(ps) / len(ps)
+            var = sum((t - tmean)**2 for t in ts)
+            self.slope = sum((t - tmean) * (p - pmean) for t, p in zip(ts, ps)) / var
+
+            last = records[-1]
+            self.projected_percent = min(100., max(0., last.percent
+                                         + self.slope * horizon / 86400.))
+
+    @property
+    def current(self):
+        """The latest record"""
+        return self.records[-1] if self.records else None
+
+    def priority(self, percent=None):
+        """
+        Return the fairshare component of the priority as used by
+        Maui, i.e. the target minus the usage (in percent), for the
+        given usage (Default: the current one) or None without target.
+        """
+        if not self.records or self.current.target is None:
+            return None
+        if percent is None:
+            percent = self.current.percent
+        return self.current.target - percent
+
+def record_diagnose(output, user=None, group=None, historyfile=None):
+    """
+    Record the fairshare of the user (Default: $USER) and the group
+    (Default: the primary group of the process) from the output of
+    diagnose -f in the history.
+    """
+    if user is None:
+        user = os.environ.get("USER")
+    if group is None:
+        import grp
+        try:
+            group = grp.getgrgid(os.getgid()).gr_name
+        except KeyError:
+            pass
+    return fairshare_history(historyfile).append(records_from_diagnose(output, user, group))
+
+if __name__ == "__main__":
+    import tempfile
+
+    output = ("FSInterval        %     Target       0       1\n"
+              "\n"
+              "USER\n"
+              "-------------\n"
+              "alice*          12.34  -------   10.00   11.00\n"
+              "bob             40.00    20.00   41.00   42.00\n"
+              "carol            5.00  -------    5.00    5.00\n"
+              "\n"
+              "GROUP\n"
+              "-------------\n"
+              "chem            52.34    50.00   51.00   52.00\n"
+              "\n")
+    records = records_from_diagnose(output, "alice", "chem", now=1000)
+    if [ (r.kind, r.name, r.percent, r.target, r.place, r.n_entries) for r in records ] \
+            != [ ("user", "alice", 12.34, None, 2, 3), ("group", "chem", 52.34, 50., 1, 1) ]:
+        raise SystemExit("records_from_diagnose failed")
+    if fairshare_record.from_line(records[1].to_line()).__dict__ != records[1].__dict__:
+        raise SystemExit("fairshare_record did not survive a round trip")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        historyfile = os.path.join(tmpdir, "history.tsv")
+        history = fairshare_history(historyfile, max_bytes=1000, min_interval=0)
+        for day in range(40):
+            history.append([ fairshare_record(day * 86400, "user", "alice", 10. + day, None,
+                                              2, 3) ])
+        records = history.records("user", "alice")
+        if os.path.getsize(historyfile) > 1000 or records[-1].percent != 49. \
+                or len(records) >= 40:
+            raise SystemExit("fairshare_history did not bound its size")
+
+        trend = fairshare_trend(records, horizon=86400)
+        if abs(trend.slope - 1.) > 1e-9 or abs(trend.projected_percent - 50.) > 1e-9:
+            raise SystemExit("fairshare_trend did not find the linear trend")
+
+        if fairshare_history(historyfile, min_interval=300).append(records[:1]):
+            raise SystemExit("fairshare_history appended more often than min_interval")
+
+    print("Unit Test passed")
@@ -1,13 +1,23 @@
-from queuing_system.pbs import pbs
 from shared_utils_lib import which
 
-def guess_queuing_system(fallback=pbs, silent=False):
-    if (which("qsub") is not None):
+def guess_queuing_system(fallback=None, silent=False):
+    # Only import the module of the queuing system actually used,
+    # the fallback is pbs.
+    #
+    # Check for slurm first, since it often comes
+    # with a qsub wrapper for compatibility with PBS
+    if (which("sbatch") is not None):
+        from queuing_system.slurm import slurm
+        return slurm()
+    elif (which("qsub") is not None):
+        from queuing_system.pbs import pbs
         return pbs()
     else:
+        if fallback is None:
+            from queuing_system.pbs import pbs
+            fallback = pbs
         fb=fallback()
         if not silent:
             print("Warning: Could not autodetermine the queing system on your machine. "
                 +"Using fallback \"" + fb.name() + "\".")
         return fb
-
@@ -0,0 +1,235 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to watch the jobs of the PBS server for changes
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system import pbs_state
+from queuing_system import queue_snapshot as qs
+from queuing_system.start_estimates import start_estimates, format_time
+import time
+
+# Default number of seconds between two polls of the job states
+default_interval = qs.default_ttl
+
+# Default number of seconds between two queries of showstart
+default_estimates_interval = 300
+
+# Default number of seconds between two queries of diagnose -f
+default_fairshare_interval = 900
+
+def parse_fairshare(output, user):
+    """
+    Return the line of the user in the USER block of the output
+    of diagnose -f (whitespace normalised) or None if not found.
+    """
+    in_block = False
+    for line in output.splitlines():
+        if not in_block:
+            in_block = line.strip() == "USER"
+            continue
+        if not line.strip():
+            break
+        fields = line.split()
+        if fields[0].rstrip("*") == user:
+            return " ".join(fields)
+    return None
+
+class transition:
+    """
+    The change of the state of a job between two polls
+    """
+    def __init__(self, job_id, old, new):
+        self.job_id = job_id        #type: str      id of the job
+        self.old = old              #type: pbs_job  the job before (None if it is new)
+        self.new = new              #type: pbs_job  the job now (None if it is gone)
+
+    @property
+    def old_state(self):
+        return self.old.state if self.old is not None else None
+
+    @property
+    def new_state(self):
+        return self.new.state if self.new is not None else None
+
+    def __str__(self):
+        job = self.new if self.new is not None else self.old
+        ret = "{0:20s} {1:20s} {2:>4s} -> {3}".format(self.job_id, job.name or "--",
+                self.old_state or "new", self.new_state or "gone")
+        if self.new_state == "R":
+            if self.new.nodes:
+                ret += "  on " + "+".join(self.new.nodes)
+            if self.new.start_time is not None and self.new.walltime is not None:
+                ret += "  until " + format_time(self.new.start_time + self.new.walltime)
+        return ret
+
+def diff_jobs(old, new):
+    """
+    Return the list of transitions between the dicts old and new,
+    which map job ids to pbs_jobs, in the order of the job ids.
+    """
+    ret = []
+    for job_id in sorted(set(old) | set(new), key=lambda i: (len(i), i)):
+        before = old.get(job_id)
+        after = new.get(job_id)
+        if before is None or after is None or before.state != after.state:
+            ret.append(transition(job_id, before, after))
+    return ret
+
+class job_watch:
+    """
+    Watches the jobs of a user for changes of their state, their
+    estimated start and the fairshare of the user.
+
+    Each poll only takes the state of the jobs from the snapshot shared
+    on this host if it is older than interval seconds. The estimates of
+    the queued jobs (showstart, one call per job) and the fairshare
+    (diagnose -f) are expensive for the scheduler, so they are only
+    queried every estimates_interval and fairshare_interval seconds.
+    """
+
+    def __init__(self, user=None, patterns=[], interval=default_interval,
+                 estimates_interval=default_estimates_interval,
+                 fairshare_interval=default_fairshare_interval, snapshot=None):
+        self.__user = user
+        self.__patterns = patterns
+        self.__interval = interval
+        self.__estimates_interval = estimates_interval
+        self.__fairshare_interval = fairshare_interval
+        self.__snapshot = snapshot if snapshot is not None else qs.queue_snapshot()
+        self.__estimator = start_estimates(self.__snapshot.cachefile("showstart.json"),
+                                           ttl=estimates_interval)
+
+        self.__jobs = None            # Jobs of the last poll by id
+        self.__estimates = {}         # Last estimated start of the queued jobs
+        self.__last_estimates = None  # Time of the last query of the estimates
+        self.__fairshare = None       # Last fairshare line of the user
+        self.__last_fairshare = None  # Time of the last query of the fairshare
+
+    def __fetch_jobs(self):
+        state = pbs_state.from_snapshot(self.__snapshot, nodes=False,
+                                        max_age=self.__interval)
+        jobs = {}
+        for pattern in (self.__patterns or [ None ]):
+            for job in state.find_jobs(pattern, user=self.__user):
+                jobs[job.id] = job
+        return state, jobs
+
+    def __due(self, last, interval, now):
+        return last is None or now - last >= interval
+
+    def poll(self, now=None):
+        """
+        Query the state and return a tuple of three lists: the
+        transitions of the jobs since the last poll, the changed
+        estimates as tuples (job_id, old start, new start) and the
+        changed fairshare lines as tuples (old, new). In the first poll
+        all jobs are reported as new.
+
+        Raises a queue_snapshot.SnapshotError if a command fails.
+        """
+        if now is None:
+            now = time.time()
+        state, jobs = self.__fetch_jobs()
+        transitions = diff_jobs(self.__jobs or {}, jobs)
+        self.__jobs = jobs
+
+        estimates = []
+        queued = [ i for i in jobs if jobs[i].state == "Q" ]
+        if self.__due(self.__last_estimates, self.__estimates_interval, now):
+            self.__last_estimates = now
+            current = { i: e[0] for i, e in self.__estimator.get(queued, state).items() }
+            for job_id in queued:
+                if current[job_id] != self.__estimates.get(job_id):
+                    estimates.append((job_id, self.__estimates.get(job_id), current[job_id]))
+            self.__estimates = current
+        else:
+            # Forget the jobs no longer queued, the others are kept until
+            # the next query of the estimates
+            self.__estimates = { i: e for i, e in self.__estimates.items() if i in queued }
+
+        fairshare = []
+        if self.__user is not None and \
+                self.__due(self.__last_fairshare, self.__fairshare_interval, now):
+            self.__last_fairshare = now
+            try:
+                line = parse_fairshare(self.__snapshot.get("diagnose",
+                                       self.__fairshare_interval), self.__user)
+            except qs.SnapshotError:
+                # The fairshare is only an add-on, keep the old one
+                line = self.__fairshare
+            if line != self.__fairshare:
+                fairshare.append((self.__fairshare, line))
+            self.__fairshare = line
+
+        return transitions, estimates, fairshare
+
+if __name__ == "__main__":
+    import os
+    import stat
+    import tempfile
+
+    def job(job_id, state, name="job"):
+        return "Job Id: {0}\n    Job_Name = {2}\n    Job_Owner = alice@login\n" \
+               "    job_state = {1}\n\n".format(job_id, state, name)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, "qstat.txt")
+        counter = os.path.join(tmpdir, "counter")
+        for name, script in [ ("qstat", "cat " + output),
+                              ("showstart", "echo $1 >> " + counter + "\n"
+                               + "echo 'Estimated Rsv based start in 1:00 on Fri Oct 16 12:00:00'"),
+                              ("diagnose", "printf 'USER\\n-------------\\nalice*  1.0  2.0\\n\\n'") ]:
+            with open(os.path.join(tmpdir, name), "w") as f:
+                f.write("#!/bin/sh\n" + script + "\n")
+            os.chmod(os.path.join(tmpdir, name), stat.S_IRWXU)
+        os.environ["PATH"] = tmpdir + os.pathsep + os.environ["PATH"]
+
+        def n_calls():
+            if not os.path.exists(counter):
+                return 0
+            with open(counter) as f:
+                return len(f.readlines())
+
+        with open(output, "w") as f:
+            f.write(job("11.srv", "R") + job("12.srv", "Q") + job("13.srv", "Q"))
+        watch = job_watch("alice", interval=0, estimates_interval=100, fairshare_interval=100,
+                          snapshot=qs.queue_snapshot(os.path.join(tmpdir, "cache")))
+        transitions, estimates, fairshare = watch.poll(now=0)
+        if [ (t.job_id, t.old_state, t.new_state) for t in transitions ] != \
+                [ ("11.srv", None, "R"), ("12.srv", None, "Q"), ("13.srv", None, "Q") ]:
+            raise SystemExit("job_watch did not report the initial jobs")
+        if len(estimates) != 2 or fairshare != [ (None, "alice* 1.0 2.0") ] or n_calls() != 2:
+            raise SystemExit("job_watch did not report the initial estimates and fairshare")
+
+        with open(output, "w") as f:
+            f.write(job("12.srv", "R") + job("13.srv", "Q") + job("14.srv", "Q"))
+        transitions, estimates, fairshare = watch.poll(now=10)
+        if [ (t.job_id, t.old_state, t.new_state) for t in transitions ] != \
+                [ ("11.srv", "R", None), ("12.srv", "Q", "R"), ("14.srv", None, "Q") ]:
+            raise SystemExit("job_watch did not report the transitions")
+        if estimates or fairshare or n_calls() != 2:
+            raise SystemExit("job_watch queried showstart or diagnose too often")
+
+        transitions, estimates, fairshare = watch.poll(now=200)
+        if transitions or estimates != [ ("14.srv", None, "Fri Oct 16 12:00:00") ] \
+                or fairshare or n_calls() != 3:
+            raise SystemExit("job_watch did not only estimate the new job")
+
+        if parse_fairshare("USER\n-----\nbob  1\nalice 2\n\nGROUP\nalice 3\n", "alice") \
+                != "alice 2":
+            raise SystemExit("parse_fairshare failed")
+
+    print("Unit Test passed")
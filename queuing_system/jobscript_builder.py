@@ -19,13 +19,18 @@
 from abc import ABCMeta, abstractmethod
 from queuing_system import queuing_system_data as qd
 from queuing_system import queuing_system_environment as qe
+from queuing_system.queuing_system_base import SubmissionError, UnknownDataFieldException
+from queuing_system.jobscript_template import hook_pipeline, compiled_template
 import shared_config_lib as conf
 import os
 import pwd
-import queue
 import argparse
+import copy
+import glob
+import time
+import functools
+import heapq
 import shared_utils_lib as utils
-import objectmerge
 
 ######################################################################
 #--  Main function of build scripts  --#
@@ -42,6 +47,14 @@ def builder_main(script_builder, qsys):
 
     This is the function orca_send_job and qchem_send_job use to do
     their work.
+
+    If more than one input is given (on the commandline or via a
+    manifest file) the config is only parsed once, one jobscript
+    is written per input and all of them are submitted together
+    as a single job array.
+
+    With --no-script-file no jobscripts are written at all, instead
+    they are piped to the submit command directly.
     """
 
     # setup parser:
@@ -51,8 +64,34 @@ def builder_main(script_builder, qsys):
     )
     parser.add_argument("--cfg", metavar="configfile", default=None,type=str,help="Use this alternatve config file as sendscript config")
     parser.add_argument("--send",default=False, action='store_true', help="Send the job once the jobscript has been written.")
-    parser.add_argument("--dumpcfg", default=False, action='store_true', 
+    parser.add_argument("--dumpcfg", default=False, action='store_true',
             help="Dump a default config file under the path specified by --cfg if this file does not exist.")
+    parser.add_argument("--manifest", metavar="file", default=None, type=str,
+            help="Read further inputs from this file (one per line, empty lines and "
+            "lines starting with # are ignored). If more than one input is given in total, "
+            "all of them are submitted together as a single job array.")
+    parser.add_argument("--workers", metavar="#", default=None, type=int,
+            help="Maximal number of processes used to analyse the inputs if more than one "
+            "input is given (Default: number of CPUs).")
+    parser.add_argument("--no-array", default=False, action='store_true',
+            help="If more than one input is given, submit each of them as an individual "
+            "job instead of submitting all of them as a single job array.")
+    parser.add_argument("--no-script-file", default=False, action='store_true',
+            help="Do not write the jobscripts to disk, but pipe them to the submit command "
+            "on stdin, passing the resources as commandline arguments. Implies --send and, "
+            "if more than one input is given, --no-array.")
+    if script_builder.supports_packing:
+        parser.add_argument("--pack", metavar="#", default=None, type=int,
+                help="If more than one input is given, run this many of them concurrently "
+                "within a single job on one node, such that short jobs share the queue wait "
+                "and the stage-in and stage-out overhead. Implies --no-array.")
+        parser.add_argument("--pack-np", metavar="#", default=None, type=int,
+                help="Number of processors of the node requested for each packed job "
+                "(Default: enough to run all inputs of the pack at once).")
+        parser.add_argument("--pack-mem", metavar="size", default=None,
+                type=utils.interpret_string_as_file_size,
+                help="Physical memory requested for each packed job in the format "
+                "integer[suffix] (Default: enough for the inputs which may run at once).")
 
     # setup script builder:
     script_builder.add_entries_to_argparse(parser)
@@ -60,6 +99,20 @@ def builder_main(script_builder, qsys):
     # parse args and config:
     args = parser.parse_args()
 
+    try:
+        inputs = collect_inputs(getattr(args, script_builder.input_argument),
+                                manifest=args.manifest,
+                                expand_globs=script_builder.expand_input_globs)
+    except OSError as e:
+        raise SystemExit("Could not read manifest file " + args.manifest + ": " + str(e))
+    if len(inputs) == 0:
+        parser.error("No input provided, neither on the commandline nor via --manifest.")
+    if len(inputs) > 1:
+        for name in script_builder.single_input_arguments:
+            if getattr(args, name) is not None:
+                parser.error("--" + name.replace("_", "-") + " cannot be used with more "
+                             "than one input, since all jobs would use the same value.")
+
     try:
         if args.cfg is not None:
             script_builder.parse_config(cfg=args.cfg,autocreate=args.dumpcfg)
@@ -68,21 +121,459 @@ def builder_main(script_builder, qsys):
     except ParseConfigError as pe:
         raise SystemExit("When parsing the config: " + pe.args[0])
 
-    script_builder.examine_args(args)
+    write = not args.no_script_file
+    if script_builder.supports_packing and args.pack is not None and args.pack < 1:
+        parser.error("The argument to --pack needs to be a positive integer.")
+    # The packed jobs are few and each of them runs several inputs,
+    # so they are submitted individually and not as a job array.
+    packed = script_builder.supports_packing and args.pack is not None and args.pack > 1
+    if len(inputs) > 1:
+        scripts = build_batch(script_builder, qsys, args, inputs,
+                              array=write and not args.no_array and not packed,
+                              write=write)
+    else:
+        setattr(args, script_builder.input_argument, inputs[0])
+        script_builder.examine_args(args)
+
+        # build script
+        scriptname="jobscript.sh"
+        if script_builder.queuing_system_data.job_name is not None:
+            scriptname=script_builder.queuing_system_data.job_name + ".sh"
+
+        try:
+            script = script_builder.build_script()
+        except DataNotReady as dnr:
+            raise SystemExit("Missing data: " + dnr.args[0])
+        if write:
+            with open(scriptname,"w") as f:
+                f.write(script)
+        scripts = { scriptname: (script, script_builder.queuing_system_data) }
+        record_resource_features([ script_builder ])
+
+    if not args.send and write:
+        return
+
+    if len(scripts) == 1:
+        scriptname = next(iter(scripts))
+        try:
+            if write:
+                print(qsys.submit_script(scriptname))
+            else:
+                print(qsys.submit_script_stdin(*scripts[scriptname]))
+        except SubmissionError as e:
+            raise SystemExit("Could not submit " + scriptname + ": " + e.args[0])
+    else:
+        if write:
+            summary = qsys.submit_scripts(list(scripts))
+        else:
+            summary = qsys.submit_scripts_stdin(scripts)
+        for scriptname in scripts:
+            if scriptname in summary.job_ids:
+                print(scriptname + ": " + summary.job_ids[scriptname])
+        print(summary)
+        if summary.errors:
+            raise SystemExit(1)
+
+def collect_inputs(inputs, manifest=None, expand_globs=True):
+    """
+    Return the list of inputs given on the commandline
+    amended by the inputs listed in the manifest file.
+
+    If expand_globs is True, commandline inputs which contain glob
+    patterns and which are no existing files themselves are expanded
+    (this allows to pass quoted patterns in case the list of files
+    would become too long for the shell). Each input is only returned once.
+    """
+    ret = []
+    if inputs is None:
+        inputs = []
+    elif isinstance(inputs, str):
+        inputs = [ inputs ]
+
+    for inp in inputs:
+        if expand_globs and glob.has_magic(inp) and not os.path.exists(inp):
+            matches = sorted(glob.glob(inp))
+            if len(matches) == 0:
+                raise SystemExit("The pattern " + inp + " matches no file.")
+            ret.extend(matches)
+        else:
+            ret.append(inp)
+
+    if manifest is not None:
+        with open(manifest, "r") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0 or line.startswith("#"):
+                    continue
+                ret.append(line)
+
+    # Remove duplicates, but keep the order
+    seen = set()
+    return [ inp for inp in ret if not (inp in seen or seen.add(inp)) ]
+
+def build_batch(script_builder, qsys, args, inputs, array=True, write=True):
+    """
+    Build one jobscript per input and (if array is True) a driver script,
+    which runs them as a single job array. The script_builder should already
+    have parsed the config, it serves as a template for the builders
+    of the individual inputs.
 
-    # write script
-    scriptname="jobscript.sh"
-    if script_builder.queuing_system_data.job_name is not None:
-        scriptname=script_builder.queuing_system_data.job_name + ".sh"
+    The scripts are only written to disk if write is True, which is
+    required for job arrays, since the driver runs the jobscript files.
 
+    Returns a dict from the names of the scripts to submit, i.e. either
+    the driver script only or all jobscripts, to a tuple of the script
+    content and its queuing_system_data.
+    """
+    if array and not write:
+        raise ValueError("The jobscripts of a job array need to be written.")
+
+    array_name = args.name
+    if array_name is None:
+        array_name = script_builder.queuing_system_data.job_name
+
+    # Each input gets its name from the input file
+    # and not from the commandline or the config.
+    args.name = None
+    script_builder.queuing_system_data.job_name = None
+
+    builders, summary = analyse_inputs(script_builder, args, inputs,
+                                       max_workers=args.workers)
+    print(summary)
+
+    members = builders
+    packed = script_builder.supports_packing and args.pack is not None and args.pack > 1
+    if packed:
+        builders = pack_builders(builders, args.pack, no_procs=args.pack_np,
+                                 physical_memory=args.pack_mem)
+        print("Packed the " + str(len(inputs)) + " inputs into " + str(len(builders))
+              + " jobs.")
+
+    if array_name is None:
+        array_name = (builders[0].queuing_system_data.job_name or "jobscript") + "_array"
+
+    # Write the jobscripts, making sure no two of them
+    # (and not the array driver) share the same name.
+    scripts = {}
+    used = { array_name }
+    for builder in builders:
+        data = builder.queuing_system_data
+        name = data.job_name or "jobscript"
+        if name in used:
+            count = 1
+            while name + "_" + str(count) in used:
+                count += 1
+            name = name + "_" + str(count)
+            data.job_name = name
+        used.add(name)
+
+        scriptname = name + ".sh"
+        try:
+            script = builder.build_script()
+        except DataNotReady as dnr:
+            raise SystemExit("Missing data for job " + name + ": " + dnr.args[0])
+        if write:
+            with open(scriptname,"w") as f:
+                f.write(script)
+        scripts[scriptname] = (script, data)
+
+    # The resources are reported under the name of the job the scheduler runs
+    if packed:
+        record_resource_features(members, [ (builders[i // args.pack].queuing_system_data.job_name,
+                                             None, i % args.pack) for i in range(len(members)) ])
+    elif array:
+        record_resource_features(members, [ (array_name, i, None) for i in range(len(members)) ])
+    else:
+        record_resource_features(members)
+
+    if not write:
+        return scripts
+    if not array:
+        print("Wrote " + str(len(scripts)) + " jobscripts.")
+        return scripts
+
+    # Build the driver
+    data = array_queuing_system_data([ b.queuing_system_data for b in builders ])
+    data.job_name = array_name
+    data.array = "0-" + str(len(scripts)-1)
+
+    arrayscript = array_name + ".sh"
     try:
-        with open(scriptname,"w") as f:
-            f.write(script_builder.build_script())
+        script = build_array_script(qsys, data, list(scripts))
     except DataNotReady as dnr:
-        raise SystemExit("Missing data: " + dnr.args[0])
+        raise SystemExit("Missing data for the job array: " + dnr.args[0])
+    with open(arrayscript,"w") as f:
+        f.write(script)
 
-    if args.send:
-        qsys.submit_script(scriptname)
+    print("Wrote " + str(len(scripts)) + " jobscripts and the job array driver "
+            + arrayscript + ".")
+    return { arrayscript: (script, data) }
+
+class analysis_summary:
+    """
+    Timings of the analysis of a batch of inputs by analyse_inputs
+    """
+    def __init__(self):
+        self.n_workers=None #int: number of processes used for the analysis
+        self.wall_time=None #float: seconds the whole analysis took
+        self.input_times=[] #list of (input, seconds) pairs for each input
+
+    def __str__(self):
+        n_inputs = len(self.input_times)
+        if n_inputs == 0:
+            return "Analysed no inputs."
+
+        cpu_time = sum(t for inp, t in self.input_times)
+        slowest = max(self.input_times, key=lambda it: it[1])
+        return ("Analysed " + str(n_inputs) + " inputs in {0:.2f}s using "
+                + str(self.n_workers) + " process(es): {1:.1f}ms per input on average, "
+                + "slowest was " + slowest[0] + " with {2:.1f}ms.").format(
+                    self.wall_time, 1000*cpu_time/n_inputs, 1000*slowest[1])
+
+def _examine_input(builder, args):
+    """
+    Run examine_args of the builder and return the builder
+    together with the time this took. Runs in the worker
+    processes of analyse_inputs.
+    """
+    start = time.perf_counter()
+    builder.examine_args(args)
+    return builder, time.perf_counter() - start
+
+def analyse_inputs(script_builder, args, inputs, max_workers=None,
+                   min_inputs_per_worker=4):
+    """
+    Analyse a batch of inputs, i.e. run examine_args on a copy of the
+    script_builder for each input. The script_builder should already have
+    parsed the config, args are the parsed commandline arguments. The
+    input is placed in the attribute script_builder.input_argument of a
+    copy of args for each input.
+
+    The analysis is fanned out over a pool of max_workers processes
+    (Default: the number of CPUs), but only if each worker gets at least
+    min_inputs_per_worker inputs, since otherwise starting the pool
+    takes longer than the analysis itself.
+
+    The first input is always analysed in this process, such that
+    interactive questions (like for the Q-Chem version) are only
+    asked once and cached results are inherited by the workers.
+
+    Returns the list of the builders (one per input, in the order of the
+    inputs), from which the queuing_system_data can be obtained, and an
+    analysis_summary object.
+    """
+    summary = analysis_summary()
+    start = time.perf_counter()
+
+    jobs = []
+    for inp in inputs:
+        builder_args = copy.copy(args)
+        setattr(builder_args, script_builder.input_argument, inp)
+        jobs.append((copy.deepcopy(script_builder), builder_args))
+
+    results = [ _examine_input(*jobs[0]) ]
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    n_workers = max(1, min(max_workers, (len(jobs)-1) // min_inputs_per_worker))
+
+    if n_workers > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            results.extend(executor.map(_examine_input,
+                                        [ j[0] for j in jobs[1:] ],
+                                        [ j[1] for j in jobs[1:] ],
+                                        chunksize=max(1, (len(jobs)-1) // (4*n_workers))))
+    else:
+        results.extend(_examine_input(*job) for job in jobs[1:])
+
+    summary.n_workers = n_workers
+    summary.wall_time = time.perf_counter() - start
+    summary.input_times = [ (inp, res[1]) for inp, res in zip(inputs, results) ]
+    return [ res[0] for res in results ], summary
+
+def record_resource_features(builders, jobs=None):
+    """
+    Remember the resource features of the jobs of the builders (see
+    jobscript_builder.resource_features) in the resource history, such
+    that the resources they use can be collected once they are done.
+    The jobs are assumed to be submitted from the current directory.
+
+    jobs is a list of a tuple (job_name, array_index, member) for each
+    builder, which describes the job the scheduler runs it in (see
+    resource_history.add_pending). By default the builders are assumed
+    to be submitted as individual jobs under their job name.
+    """
+    history = builders[0].resource_history()
+    if history is None:
+        return
+
+    if jobs is None:
+        jobs = [ (b.queuing_system_data.job_name, None, None) for b in builders ]
+    for builder, (job_name, array_index, member) in zip(builders, jobs):
+        features = builder.resource_features()
+        if features is not None and job_name is not None:
+            history.add_pending(os.getcwd(), job_name, features,
+                                array_index=array_index, member=member)
+
+    try:
+        history.save()
+    except OSError as e:
+        print("Warning: Could not save the resource history: " + str(e))
+
+def array_queuing_system_data(datas):
+    """
+    Return a queuing_system_data object for a job array, which
+    runs jobs described by the list of queuing_system_data objects
+    passed. Since all array elements share the same resource request,
+    the maximum of all walltimes, memories and processor counts is used.
+    """
+    ret = copy.deepcopy(datas[0])
+
+    def max_or_none(values):
+        values = [ v for v in values if v is not None ]
+        if len(values) == 0:
+            return None
+        return max(values)
+
+    ret.walltime = max_or_none([ d.walltime for d in datas ])
+    ret.physical_memory = max_or_none([ d.physical_memory for d in datas ])
+    ret.virtual_memory = max_or_none([ d.virtual_memory for d in datas ])
+
+    largest = max(datas, key=lambda d: (d.no_nodes(), d.no_procs()))
+    ret.nodes = copy.deepcopy(largest.nodes)
+
+    def resources(d):
+        return (d.walltime, d.physical_memory, d.virtual_memory,
+                d.no_nodes(), d.no_procs())
+    if any(resources(d) != resources(datas[0]) for d in datas):
+        print("Warning: The resources required by the individual inputs differ. "
+                "The job array requests the maximum of all of them for each element.")
+    return ret
+
+def _pack_makespan(jobs, no_procs, memory):
+    """
+    Return the time it takes to run the jobs, a list of (processors,
+    memory, walltime) tuples, on no_procs processors and memory
+    bytes of memory (None for no limit) if each job is started in
+    order as soon as enough processors and memory are free.
+    """
+    now = 0
+    free_procs = no_procs
+    free_mem = memory or 0
+    running = [] # heap of (end time, processors, memory)
+    for procs, mem, walltime in jobs:
+        while free_procs < procs or (memory is not None and free_mem < mem):
+            now, p, m = heapq.heappop(running)
+            free_procs += p
+            free_mem += m
+        free_procs -= procs
+        free_mem -= mem
+        heapq.heappush(running, (now + walltime, procs, mem))
+    return max(end for end, p, m in running)
+
+def pack_queuing_system_data(datas, no_procs=None, physical_memory=None):
+    """
+    Return a queuing_system_data object for a job, which runs the jobs
+    described by the list of queuing_system_data objects concurrently
+    on a single node with no_procs processors and physical_memory bytes
+    of memory, starting each job in order once enough are free.
+
+    By default enough processors to run all jobs at once are requested
+    and enough memory for the jobs, which may run at the same time.
+    The walltime is the time the jobs take if each of them runs for its
+    full walltime.
+
+    Raises a ValueError if the jobs cannot be run this way.
+    """
+    for d in datas:
+        if d.no_nodes() != 1:
+            raise ValueError("Only jobs on a single node can be packed, but "
+                    + str(d.job_name) + " requests " + str(d.no_nodes()) + " nodes.")
+
+    procs = [ d.no_procs() for d in datas ]
+    if no_procs is None:
+        no_procs = sum(procs)
+    if max(procs) > no_procs:
+        raise ValueError("A job requests " + str(max(procs)) + " processors, but a packed "
+                         "job only has " + str(no_procs) + ".")
+
+    mems = [ d.physical_memory or 0 for d in datas ]
+    if physical_memory is None and any(mems):
+        # At most as many jobs as the smallest ones fitting
+        # on the processors of the node run at the same time
+        n_concurrent = 0
+        used = 0
+        for p in sorted(procs):
+            used += p
+            if used > no_procs:
+                break
+            n_concurrent += 1
+        physical_memory = sum(sorted(mems, reverse=True)[:n_concurrent])
+    if physical_memory is not None and max(mems) > physical_memory:
+        raise ValueError("A job requests " + str(max(mems)) + " bytes of memory, but a "
+                         "packed job only has " + str(physical_memory) + ".")
+
+    ret = copy.deepcopy(datas[0])
+    node = copy.deepcopy(datas[0].nodes[0])
+    node.count = 1
+    node.no_procs = no_procs
+    ret.nodes = [ node ]
+    ret.physical_memory = physical_memory
+    ret.virtual_memory = physical_memory
+
+    ret.walltime = None
+    if all(d.walltime is not None for d in datas):
+        ret.walltime = _pack_makespan(zip(procs, mems, [ d.walltime for d in datas ]),
+                                      no_procs, physical_memory)
+    return ret
+
+def pack_builders(builders, size, no_procs=None, physical_memory=None):
+    """
+    Return a list of builders, each of which runs up to size of the
+    builders passed (on which examine_args has been called already)
+    concurrently within a single job (see jobscript_builder.pack).
+    """
+    ret = []
+    for i in range(0, len(builders), size):
+        group = builders[i:i+size]
+        packed = copy.deepcopy(group[0])
+        try:
+            packed.pack(group, no_procs=no_procs, physical_memory=physical_memory)
+        except ValueError as e:
+            raise SystemExit("Could not pack the jobs " + ", ".join(
+                str(b.queuing_system_data.job_name) for b in group) + ": " + str(e))
+        ret.append(packed)
+    return ret
+
+def build_array_script(qsys, data, scriptnames):
+    """
+    Build a driver script for a job array, which runs
+    the jobscript scriptnames[i] as the i-th element of the array.
+
+    Raises DataNotReady exception if the data is not ready
+    for the script to be written.
+    """
+    if not qsys.is_ready_for_submission(data):
+        raise DataNotReady(qsys.why_not_ready_for_submission(data))
+
+    params = qsys.get_environment()
+    if params.array_index is None:
+        raise DataNotReady("The queuing system " + qsys.name() + " does not support job arrays.")
+
+    string = "#!/bin/bash\n#\n"
+    string += qsys.build_script_header(data)
+    string += "\n"
+    string += "#\n###################################\n#\n"
+    string += "# Job array driver: The array element with index i\n"
+    string += "# runs the i-th of the following jobscripts.\n"
+    string += "SCRIPTS=(\n"
+    for scriptname in scriptnames:
+        string += '    "' + scriptname + '"\n'
+    string += ")\n\n"
+    string += 'cd "$' + params.submit_workdir + '" || exit 1\n'
+    string += 'exec /bin/bash "${SCRIPTS[$' + params.array_index + ']}"\n'
+    return string
 
 ######################################################################
 #--  Helpful hooks  --#
@@ -106,13 +597,40 @@ class copy_from_to_hook(hook_base):
     The relative paths are mainained, ie blubber/blub is copied from
     A/blubber/blub to B/blubber/blub and the 
     target dir is created if neccessary
+
+    Valid values for mode are
+        "copy"      Copy the files one by one using cp
+        "auto"      Select a transfer strategy for each file from its
+                    size measured in local_dir, the directory which
+                    corresponds to fromdir on the machine where the
+                    script is built. Small files are streamed through
+                    a single tar pipe, large files are copied using
+                    up to workers parallel cp processes and directories
+                    are synced using rsync. Files which cannot be found
+                    in local_dir are copied one by one.
     """
-    def __init__(self,fromdir,todir,files):
+
+    # Files of at least this size (in bytes) are considered to be large
+    large_file_size = 64*1024*1024
+
+    # Minimal number of files for a tar pipe or parallel copy
+    # to be used in "auto" mode
+    min_files_per_group = 2
+
+    def __init__(self,fromdir,todir,files,mode="copy",local_dir=None,workers=4):
         super().__init__()
         self.__files = files
         self.__fromdir=fromdir
         self.__todir=todir
 
+        if not mode in [ "copy", "auto" ]:
+            raise ValueError("Invalid mode: " + str(mode))
+        if mode == "auto" and local_dir is None:
+            raise ValueError("mode auto requires a local_dir")
+        self.__mode=mode
+        self.__local_dir=local_dir
+        self.__workers=workers
+
     def __generate_code_for_file(self,filename):
         return 'if [ -r "$' + self.__fromdir+ "/" + filename + '" ]; then \n' \
                 + '    CPARGS="--dereference" \n' \
@@ -122,6 +640,57 @@ class copy_from_to_hook(hook_base):
                 + '    cp $CPARGS "$'+ self.__fromdir+ "/" + filename + '" "$' +self.__todir+'/$DIR"\n' \
                 + 'fi\n'
 
+    def __generate_code_tar(self,files):
+        filelist = " ".join('"' + f + '"' for f in files)
+        return "# Stream " + str(len(files)) + " small files through a single tar pipe\n" \
+                + '( cd "$' + self.__fromdir + '" && tar --dereference --ignore-failed-read -cf - -- ' \
+                + filelist + ' ) | tar -C "$' + self.__todir + '" -xf -\n'
+
+    def __generate_code_parallel(self,files):
+        filelist = " ".join('"' + f + '"' for f in files)
+        return "# Copy " + str(len(files)) + " large files using " + str(self.__workers) \
+                + " parallel processes\n" \
+                + "printf '%s\\0' " + filelist + " | xargs -0 -n 1 -P " + str(self.__workers) \
+                + " sh -c 'mkdir -p \"$2/$(dirname \"$3\")\" && " \
+                + "cp --dereference \"$1/$3\" \"$2/$(dirname \"$3\")\"' copy " \
+                + '"$' + self.__fromdir + '" "$' + self.__todir + '"\n'
+
+    def __generate_code_rsync(self,dirname):
+        return 'if which rsync &> /dev/null; then\n' \
+                + '    DIR=$(dirname "' + dirname + '")\n' \
+                + '    mkdir -p "$' + self.__todir + '/$DIR"\n' \
+                + '    rsync --recursive --copy-links "$' + self.__fromdir + "/" + dirname + '" "$' \
+                + self.__todir + '/$DIR/"\n' \
+                + 'else\n' \
+                + "    " + self.__generate_code_for_file(dirname).replace("\n", "\n    ").rstrip(" ") \
+                + 'fi\n'
+
+    def __plan(self):
+        """
+        Sort the files into the groups "tar", "parallel", "rsync"
+        and "copy" according to the sizes found in the local_dir.
+        """
+        plan = { "tar": [], "parallel": [], "rsync": [], "copy": [] }
+        for filename in self.__files:
+            path = os.path.join(self.__local_dir, filename)
+            try:
+                if os.path.isdir(path):
+                    plan["rsync"].append(filename)
+                elif os.stat(path).st_size >= self.large_file_size:
+                    plan["parallel"].append(filename)
+                else:
+                    plan["tar"].append(filename)
+            except OSError:
+                # Not available at build time,
+                # check again at runtime.
+                plan["copy"].append(filename)
+
+        for group in [ "tar", "parallel" ]:
+            if len(plan[group]) < self.min_files_per_group:
+                plan["copy"].extend(plan[group])
+                plan[group] = []
+        return plan
+
     def generate(self,data,params,calc_env):
         """
         Generate shell script code from the queuing_system_data,
@@ -129,8 +698,20 @@ class copy_from_to_hook(hook_base):
         provided
         """
         string=""
-        for filename in self.__files:
-            string+=self.__generate_code_for_file(filename)
+        if self.__mode == "copy":
+            for filename in self.__files:
+                string+=self.__generate_code_for_file(filename)
+            return string
+
+        plan = self.__plan()
+        if plan["tar"]:
+            string += self.__generate_code_tar(plan["tar"])
+        if plan["parallel"]:
+            string += self.__generate_code_parallel(plan["parallel"])
+        for dirname in plan["rsync"]:
+            string += self.__generate_code_rsync(dirname)
+        for filename in plan["copy"]:
+            string += self.__generate_code_for_file(filename)
         return string
 
 class copy_in_hook(hook_base):
@@ -142,10 +723,15 @@ class copy_in_hook(hook_base):
     The relative paths are mainained, ie blubber/blub is copied from
     SUBMIT_WORKDIR/blubber/blub to SERVER_WORKDIR/blubber/blub and the 
     target dir is created if neccessary
+
+    The mode and workers are passed to copy_from_to_hook, where the
+    current working directory is taken to be the submit workdir.
     """
-    def __init__(self, files):
+    def __init__(self, files, mode="copy", workers=4):
         super().__init__()
         self.__files = files
+        self.__mode = mode
+        self.__workers = workers
 
     def generate(self,data,params,calc_env):
         """
@@ -162,9 +748,136 @@ class copy_in_hook(hook_base):
         if not isinstance(calc_env,calculation_environment):
             raise TypeError("calc_env not of type calculation_environment")
 
-        return copy_from_to_hook(params.submit_workdir,calc_env.node_work_dir,self.__files)\
+        return copy_from_to_hook(params.submit_workdir,calc_env.node_work_dir,self.__files,
+                                 mode=self.__mode,local_dir=os.getcwd(),workers=self.__workers)\
                 .generate(data,params,calc_env)
 
+@functools.lru_cache(maxsize=None)
+def _file_sha256(path,size,mtime):
+    """
+    Return the sha256 hex digest of the file at path. size and mtime
+    are only part of the key into the cache of already computed digests.
+    """
+    import hashlib
+    h = hashlib.sha256()
+    with open(path,"rb") as f:
+        for chunk in iter(lambda: f.read(1024*1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+class cached_copy_in_hook(hook_base):
+    """
+    Hook to copy a list of files/dirs to the server working directory
+    like copy_in_hook, but large read-only inputs, the cached_files,
+    are staged via a node-local cache.
+
+    The cache in cache_dir on the node is keyed by the sha256 of the
+    file content, which is computed when the script is built. On a
+    cache hit the file is hardlinked (or reflinked, or copied if neither
+    is possible) from the cache, such that it does not need to be
+    read over the network again. On a miss it is copied into the cache
+    first, unless it has changed since the script was built.
+
+    Concurrent jobs hold a shared lock on the cache while they use it,
+    the eviction of the least recently used files, which keeps the
+    cache below max_size bytes, happens under an exclusive lock and is
+    skipped if the cache is busy.
+
+    Cached files which are not regular files on the machine where
+    the script is built are copied normally.
+    """
+    def __init__(self, files, cached_files, cache_dir, max_size, mode="copy", workers=4):
+        super().__init__()
+        self.__files = files
+        self.__cached_files = cached_files
+        self.__cache_dir = cache_dir
+        self.__max_size = max_size
+        self.__mode = mode
+        self.__workers = workers
+
+    def __hashes(self):
+        """
+        Return a list of (hash, file) for the cached files, which are
+        regular files, as well as the list of files, which are not.
+        """
+        hashes = []
+        others = []
+        for filename in self.__cached_files:
+            try:
+                st = os.stat(filename)
+                if not os.path.isfile(filename):
+                    raise OSError("Not a regular file")
+                hashes.append((_file_sha256(os.path.abspath(filename),st.st_size,st.st_mtime),filename))
+            except OSError:
+                others.append(filename)
+        return hashes, others
+
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(params,qe.queuing_system_environment):
+            raise TypeError("params not of type qe.queuing_system_environment")
+
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        hashes, others = self.__hashes()
+        files = [ f for f in self.__files if not f in self.__cached_files ] + others
+        string = copy_from_to_hook(params.submit_workdir,calc_env.node_work_dir,files,
+                                   mode=self.__mode,local_dir=os.getcwd(),workers=self.__workers)\
+                .generate(data,params,calc_env)
+        if len(hashes) == 0:
+            return string
+
+        fromdir = "$" + params.submit_workdir
+        todir = "$" + calc_env.node_work_dir
+
+        string += "# Stage in read-only inputs via the node-local input cache\n"
+        string += 'INPUT_CACHE="' + self.__cache_dir + '"\n'
+        string += 'mkdir -p "$INPUT_CACHE"\n'
+        string += 'exec 8> "$INPUT_CACHE/.lock"\n'
+        string += "flock -s 8\n"
+        string += "while read HASH FILE; do\n"
+        string += '    CACHED="$INPUT_CACHE/$HASH"\n'
+        string += '    DIR=$(dirname "$FILE")\n'
+        string += '    mkdir -p "' + todir + '/$DIR"\n'
+        string += '    if [ ! -f "$CACHED" ]; then\n'
+        string += '        if ! cp --dereference "' + fromdir + '/$FILE" "$CACHED.$$.tmp"; then\n'
+        string += '            rm -f "$CACHED.$$.tmp"\n'
+        string += "            continue\n"
+        string += "        fi\n"
+        string += '        if [ "$(sha256sum < "$CACHED.$$.tmp" | cut -d " " -f 1)" != "$HASH" ]; then\n'
+        string += "            # File changed since the job script was built: Do not cache it\n"
+        string += '            mv "$CACHED.$$.tmp" "' + todir + '/$FILE"\n'
+        string += "            continue\n"
+        string += "        fi\n"
+        string += '        chmod a-w "$CACHED.$$.tmp"\n'
+        string += '        mv "$CACHED.$$.tmp" "$CACHED"\n'
+        string += "    fi\n"
+        string += '    touch "$CACHED"\n'
+        string += '    ln -f "$CACHED" "' + todir + '/$FILE" 2> /dev/null || \\\n'
+        string += '        cp --reflink=auto "$CACHED" "' + todir + '/$FILE"\n'
+        string += "done << EOF\n"
+        for (h, filename) in hashes:
+            string += h + " " + filename + "\n"
+        string += "EOF\n"
+        string += "# Evict the least recently used files if the cache is too large\n"
+        string += "if flock -x -n 8; then\n"
+        string += '    SIZE=$(find "$INPUT_CACHE" -maxdepth 1 -type f -regex ".*/[0-9a-f]*" -printf "%s\\n" \\\n'
+        string += "           | awk '{ s += $1 } END { print s+0 }')\n"
+        string += '    find "$INPUT_CACHE" -maxdepth 1 -type f -regex ".*/[0-9a-f]*" -printf "%T@ %s %p\\n" \\\n'
+        string += "           | sort -n | while read TIME FSIZE CFILE; do\n"
+        string += "        [ $SIZE -le " + str(self.__max_size) + " ] && break\n"
+        string += '        rm -f "$CFILE"\n'
+        string += "        SIZE=$((SIZE - FSIZE))\n"
+        string += "    done\n"
+        string += "fi\n"
+        string += "exec 8>&-\n"
+        return string
+
 class copy_out_hook(hook_base):
     """
     Hook to copy a list of files/subdirs from one directory of the
@@ -217,6 +930,395 @@ class copy_out_hook(hook_base):
         return copy_from_to_hook(fromdir_actual,params.submit_workdir,self.__files)\
                 .generate(data,params,calc_env)
 
+class compressed_copy_out_hook(hook_base):
+    """
+    Hook to copy files/subdirs from the node's working and scratch
+    directories to the submit workdir as a single compressed archive.
+
+    The files are looked up at runtime. If their total size is
+    below threshold bytes, they are copied plainly like
+    copy_out_hook does, else they are streamed through tar and the
+    compressor into the archive "archive_name.stageout.tar.zst"
+    (or ".tar.gz") in the submit workdir. Unpacking this archive
+    in the submit workdir (e.g. using unpack_stageout) yields the
+    same files as a plain copy.
+
+    files is a dict from the directory to copy from ("WORK" or "SCRATCH",
+    see copy_out_hook) to the list of files to copy from there.
+
+    Valid values for compression are "zstd" and "gzip". If zstd is not
+    available on the node, gzip is used instead. If level is None
+    the default level of the compressor is used, for gzip it is
+    clamped to the range 1 to 9.
+    """
+    def __init__(self, files, archive_name, compression="zstd", level=None,
+                 threshold=100*1024*1024):
+        super().__init__()
+        if not compression in [ "zstd", "gzip" ]:
+            raise ValueError("Invalid compression: " + str(compression))
+        for fromdir in files:
+            if not fromdir in [ "WORK", "SCRATCH" ]:
+                raise ValueError("Invalid directory to copy from: " + str(fromdir))
+
+        self.__files = files
+        self.__archive_name = archive_name
+        self.__compression = compression
+        self.__level = level
+        self.__threshold = threshold
+
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(params,qe.queuing_system_environment):
+            raise TypeError("params not of type qe.queuing_system_environment")
+
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        dirvars = { "WORK": calc_env.node_work_dir, "SCRATCH": calc_env.node_scratch_dir }
+        fromdirs = [ d for d in [ "WORK", "SCRATCH" ] if self.__files.get(d) ]
+        if len(fromdirs) == 0:
+            return ""
+
+        level = ""
+        gzip_level = ""
+        if self.__level is not None:
+            level = " -" + str(self.__level)
+            # zstd knows more levels than gzip
+            gzip_level = " -" + str(min(9, max(1, self.__level)))
+        archive = '"$' + params.submit_workdir + "/" + self.__archive_name + '.stageout.tar'
+
+        # Collect the existing files and their size
+        string = "# Copy results back, compressed into a single archive if large\n"
+        string += "STAGEOUT_SIZE=0\n"
+        string += "STAGEOUT_TARARGS=()\n"
+        for d in fromdirs:
+            string += "STAGEOUT_FILES=()\n"
+            string += "for FILE in " + " ".join('"' + f + '"' for f in self.__files[d]) + "; do\n"
+            string += '    [ -r "$' + dirvars[d] + '/$FILE" ] && STAGEOUT_FILES+=("$FILE")\n'
+            string += "done\n"
+            string += "if [ ${#STAGEOUT_FILES[@]} -gt 0 ]; then\n"
+            string += '    STAGEOUT_TARARGS+=(-C "$' + dirvars[d] + '" "${STAGEOUT_FILES[@]}")\n'
+            string += "    STAGEOUT_SIZE=$((STAGEOUT_SIZE + $(cd \"$" + dirvars[d] \
+                    + "\" && du -scbL -- \"${STAGEOUT_FILES[@]}\" | tail -n 1 | cut -f 1)))\n"
+            string += "fi\n"
+
+        string += "if [ $STAGEOUT_SIZE -ge " + str(self.__threshold) + " ]; then\n"
+        if self.__compression == "zstd":
+            string += "    if which zstd &> /dev/null; then\n"
+            string += "        tar --dereference -cf - \"${STAGEOUT_TARARGS[@]}\" | zstd -q -T0" \
+                    + level + " > " + archive + '.zst"\n'
+            string += "    else\n"
+            string += "        tar --dereference -cf - \"${STAGEOUT_TARARGS[@]}\" | gzip" \
+                    + gzip_level + " > " + archive + '.gz"\n'
+            string += "    fi\n"
+        else:
+            string += "    tar --dereference -cf - \"${STAGEOUT_TARARGS[@]}\" | gzip" \
+                    + gzip_level + " > " + archive + '.gz"\n'
+        string += "else\n"
+        for d in fromdirs:
+            code = copy_from_to_hook(dirvars[d],params.submit_workdir,self.__files[d])\
+                    .generate(data,params,calc_env)
+            string += "    " + code.replace("\n", "\n    ").rstrip(" ")
+        string += "fi\n"
+        return string
+
+class start_sync_hook(hook_base):
+    """
+    Hook to start a loop in the background, which copies the files/subdirs
+    from the node's working directory to the submit workdir every interval
+    seconds. Only files, which changed since the previous pass, are copied.
+
+    Should be run just after the input files have been staged in.
+    The loop needs to be stopped with the stop_sync_hook before the
+    final results are copied back.
+    """
+    def __init__(self, files, interval):
+        super().__init__()
+        self.__files = files
+        self.__interval = interval
+
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(params,qe.queuing_system_environment):
+            raise TypeError("params not of type qe.queuing_system_environment")
+
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        if len(self.__files) == 0:
+            return ""
+
+        fromdir = "$" + calc_env.node_work_dir
+        todir = "$" + params.submit_workdir
+        stamp = "$" + calc_env.node_scratch_dir + "/.sync_stamp"
+
+        string  = "# Sync intermediate results back every " + str(self.__interval) + " seconds\n"
+        string += "sync_outputs() {\n"
+        string += '    touch "' + stamp + '.new"\n'
+        string += "    for FILE in " + " ".join('"' + f + '"' for f in self.__files) + "; do\n"
+        string += '        [ -r "' + fromdir + '/$FILE" ] || continue\n'
+        string += '        if [ -e "' + stamp + '" ] && [ -z "$(find -L "' + fromdir \
+                + '/$FILE" -newer "' + stamp + '" -print -quit)" ]; then\n'
+        string += "            continue\n"
+        string += "        fi\n"
+        string += '        DIR=$(dirname "$FILE")\n'
+        string += '        mkdir -p "' + todir + '/$DIR"\n'
+        string += '        if [ -d "' + fromdir + '/$FILE" ]; then\n'
+        string += '            cp --recursive --dereference "' + fromdir + '/$FILE" "' + todir + '/$DIR"\n'
+        string += "        else\n"
+        string += "            # copy and rename, such that the copy in the submit workdir\n"
+        string += "            # is never incomplete\n"
+        string += '            cp --dereference "' + fromdir + '/$FILE" "' + todir + '/$FILE.sync_tmp" && \\\n'
+        string += '                mv "' + todir + '/$FILE.sync_tmp" "' + todir + '/$FILE"\n'
+        string += "        fi\n"
+        string += "    done\n"
+        string += '    mv "' + stamp + '.new" "' + stamp + '"\n'
+        string += "}\n"
+        string += "(\n"
+        string += "    # On TERM the current pass is finished before the loop exits.\n"
+        string += "    # The sleep runs in the background, such that it can be killed\n"
+        string += "    # and the trap is not deferred until it is over.\n"
+        string += '    SYNC_STOP=""\n'
+        string += "    trap 'SYNC_STOP=y; kill $SYNC_SLEEP 2> /dev/null' TERM\n"
+        string += '    while [ -z "$SYNC_STOP" ]; do\n'
+        string += "        sleep " + str(self.__interval) + " &\n"
+        string += "        SYNC_SLEEP=$!\n"
+        string += "        wait $SYNC_SLEEP\n"
+        string += '        [ -z "$SYNC_STOP" ] && sync_outputs\n'
+        string += "    done\n"
+        string += ") &\n"
+        string += "SYNC_PID=$!\n"
+        return string
+
+class stop_sync_hook(hook_base):
+    """
+    Hook to stop the background loop started by start_sync_hook.
+    Does nothing if no such loop is running.
+
+    Temporary copies of the files left behind in the submit workdir,
+    e.g. since the node ran out of space during a pass, are removed.
+    """
+    def __init__(self, files=[]):
+        super().__init__()
+        self.__files = files
+
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(params,qe.queuing_system_environment):
+            raise TypeError("params not of type qe.queuing_system_environment")
+
+        todir = "$" + params.submit_workdir
+
+        string  = "# Stop syncing intermediate results\n"
+        string += 'if [ -n "$SYNC_PID" ]; then\n'
+        string += "    kill $SYNC_PID 2> /dev/null\n"
+        string += "    wait $SYNC_PID 2> /dev/null\n"
+        string += '    SYNC_PID=""\n'
+        if len(self.__files) > 0:
+            string += "    for FILE in " + " ".join('"' + f + '"' for f in self.__files) + "; do\n"
+            string += '        rm -f "' + todir + '/$FILE.sync_tmp"\n'
+            string += "    done\n"
+        string += "fi\n"
+        return string
+
+class multinode_stage_in_hook(hook_base):
+    """
+    Hook to create the node's working and scratch directories on all
+    nodes of the job and to distribute the content of the working
+    directory of the first node (where the job script runs) to them.
+
+    The transfer is done using a tree fan-out via ssh: Once a node has
+    received the data, it serves half of the nodes left, while the
+    sending node serves the other half. So the data is distributed
+    in log2(number of nodes) rounds.
+
+    Should be run after the inputs have been copied to the first node.
+    """
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        workdir = calc_env.node_work_dir
+        scratchdir = calc_env.node_scratch_dir
+
+        string  = "# Distribute the working directory to all nodes\n"
+        string += "stage_to_nodes() {\n"
+        string += "    [ $# -eq 0 ] && return 0\n"
+        string += "    local HEAD=$1\n"
+        string += "    shift\n"
+        string += "    local NODELIST=(\"$@\")\n"
+        string += "    local HALF=$(( ($# + 1) / 2 ))\n"
+        string += '    local DIRS=$(printf "' + workdir + '=%q ' + scratchdir + '=%q; " "$' \
+                + workdir + '" "$' + scratchdir + '")\n'
+        string += '    ssh -o BatchMode=yes $HEAD "mkdir -m700 -p \\"$' + scratchdir \
+                + '\\" \\"$' + workdir + '\\"" || return 1\n'
+        string += '    tar -C "$' + workdir + '" -cf - . | ssh -o BatchMode=yes $HEAD "tar -C \\"$' \
+                + workdir + '\\" -xf -" || return 1\n'
+        string += "    local RET=0\n"
+        string += "    if [ $HALF -gt 0 ]; then\n"
+        string += '        ssh -o BatchMode=yes $HEAD "$DIRS $(declare -f stage_to_nodes); ' \
+                + 'stage_to_nodes ${NODELIST[*]:0:$HALF}" &\n'
+        string += "        local PID=$!\n"
+        string += '        stage_to_nodes "${NODELIST[@]:$HALF}" || RET=1\n'
+        string += "        wait $PID || RET=1\n"
+        string += "    fi\n"
+        string += "    return $RET\n"
+        string += "}\n"
+        string += 'FIRST_NODE=$(echo "$NODES" | head -n 1)\n'
+        string += 'OTHER_NODES=$(echo "$NODES_UNIQUE" | grep -vxF "$FIRST_NODE")\n'
+        string += "if ! stage_to_nodes $OTHER_NODES; then\n"
+        string += '    echo "Could not distribute the working directory to all nodes" >&2\n'
+        string += "fi\n"
+        return string
+
+class multinode_cleanup_hook(hook_base):
+    """
+    Hook to remove the node's working and scratch directories on all
+    nodes apart from the first one, i.e. the copies created by the
+    multinode_stage_in_hook.
+    """
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        string  = "# Remove working directories on the other nodes\n"
+        string += 'for node in $(echo "$NODES_UNIQUE" | grep -vxF "$(echo "$NODES" | head -n 1)"); do\n'
+        string += '    ssh -o BatchMode=yes $node "rm -rf \\"$' + calc_env.node_work_dir \
+                + '\\" \\"$' + calc_env.node_scratch_dir + '\\"" &\n'
+        string += "done\n"
+        string += "wait\n"
+        return string
+
+class packed_payload_hook(hook_base):
+    """
+    Hook running the payloads of several packed jobs concurrently on
+    the node. Each job is started in order as soon as enough of the
+    processors and memory of the packed job are free and runs in a
+    scratch directory of its own. The return value is non-zero if
+    any of the jobs failed.
+    """
+
+    # Variable holding the scratch directory of each packed job
+    scratch_dir = "PACK_SCRATCHDIR"
+
+    def __init__(self, jobs):
+        """
+        jobs is a list of (hook, data) pairs of the payload hook of
+        each job and the queuing_system_data of the job.
+        """
+        self.__jobs = jobs
+
+    def generate(self,data,params,calc_env):
+        """
+        Generate shell script code from the queuing_system_data,
+        the queuing_system_params and the calculation_environment
+        provided
+        """
+        if not isinstance(data,qd.queuing_system_data):
+            raise TypeError("data not of type qd.queuing_system_data")
+
+        if not isinstance(calc_env,calculation_environment):
+            raise TypeError("calc_env not of type calculation_environment")
+
+        ret = calc_env.return_value
+
+        # Memory is accounted in kB, 0 disables the accounting
+        def kb(mem):
+            if data.physical_memory is None or mem is None:
+                return 0
+            return -(-mem // 1024)
+
+        string  = "# Slot scheduler for the packed jobs\n"
+        string += "PACK_FREE_PROCS=" + str(data.no_procs()) + "\n"
+        string += "PACK_FREE_MEM=" + str((data.physical_memory or 0) // 1024) + "\n"
+        string += "declare -A PACK_PROCS PACK_MEM PACK_NAMES\n"
+        string += "pack_reap() {\n"
+        string += "    # Wait until at least one packed job has finished\n"
+        string += "    # and release its processors and memory\n"
+        string += "    local PID PACK_RET FINISHED=0\n"
+        string += "    while true; do\n"
+        string += '        for PID in "${!PACK_PROCS[@]}"; do\n'
+        string += "            kill -0 $PID 2> /dev/null && continue\n"
+        string += "            wait $PID\n"
+        string += "            PACK_RET=$?\n"
+        string += "            if [ $PACK_RET -ne 0 ]; then\n"
+        string += '                echo "Packed job ${PACK_NAMES[$PID]} failed with return code $PACK_RET" >&2\n'
+        string += "                " + ret + "=1\n"
+        string += "            else\n"
+        string += '                echo "Packed job ${PACK_NAMES[$PID]} finished"\n'
+        string += "            fi\n"
+        string += "            PACK_FREE_PROCS=$((PACK_FREE_PROCS + PACK_PROCS[$PID]))\n"
+        string += "            PACK_FREE_MEM=$((PACK_FREE_MEM + PACK_MEM[$PID]))\n"
+        string += '            unset "PACK_PROCS[$PID]" "PACK_MEM[$PID]" "PACK_NAMES[$PID]"\n'
+        string += "            FINISHED=1\n"
+        string += "        done\n"
+        string += "        [ $FINISHED -eq 1 -o ${#PACK_PROCS[@]} -eq 0 ] && return\n"
+        string += "        # Poll if wait -n is not supported by this bash\n"
+        string += "        wait -n 2> /dev/null\n"
+        string += "        [ $? -eq 2 ] && sleep 1\n"
+        string += "    done\n"
+        string += "}\n"
+        string += "pack_start() {\n"
+        string += "    # pack_start name procs mem function\n"
+        string += "    # Run function in the background once procs processors\n"
+        string += "    # and mem kB of memory are free\n"
+        string += "    while [ $PACK_FREE_PROCS -lt $2 -o $PACK_FREE_MEM -lt $3 ]; do\n"
+        string += "        [ ${#PACK_PROCS[@]} -eq 0 ] && break\n"
+        string += "        pack_reap\n"
+        string += "    done\n"
+        string += "    PACK_FREE_PROCS=$((PACK_FREE_PROCS - $2))\n"
+        string += "    PACK_FREE_MEM=$((PACK_FREE_MEM - $3))\n"
+        string += '    echo "Starting packed job $1"\n'
+        string += "    $4 &\n"
+        string += "    PACK_PROCS[$!]=$2\n"
+        string += "    PACK_MEM[$!]=$3\n"
+        string += "    PACK_NAMES[$!]=$1\n"
+        string += "}\n\n"
+
+        job_env = copy.copy(calc_env)
+        job_env.node_scratch_dir = self.scratch_dir
+        for i, (hook, job_data) in enumerate(self.__jobs):
+            code = hook.generate(job_data,params,job_env)
+            string += "pack_job_" + str(i) + "() {\n"
+            string += "    local " + ret + "=0\n"
+            string += '    ' + self.scratch_dir + '="$' + calc_env.node_scratch_dir \
+                    + '/pack_' + str(i) + '"\n'
+            string += '    mkdir -p "$' + self.scratch_dir + '" || return 1\n'
+            string += "".join("    " + line if line.strip() else line
+                              for line in code.splitlines(True))
+            string += "    return $" + ret + "\n"
+            string += "}\n"
+            string += 'pack_start "' + str(job_data.job_name) + '" ' + str(job_data.no_procs()) \
+                    + " " + str(kb(job_data.physical_memory)) + " pack_job_" + str(i) + "\n\n"
+
+        string += "# Wait for all packed jobs to finish\n"
+        string += "while [ ${#PACK_PROCS[@]} -gt 0 ]; do\n"
+        string += "    pack_reap\n"
+        string += "done\n"
+        return string
+
 #######################################################################
 #--  Helper classes  --#
 ########################
@@ -268,11 +1370,10 @@ class jobscript_builder:
     """
     def __init__(self,qsys):
         self.__qsys = qsys
-        # Priority Queue
-        # https://docs.python.org/3/library/queue.html#queue.PriorityQueue
+        # Hooks sorted by priority, see hook_pipeline
         # The smaller the int, the higher the priority
-        self.__payload_hooks = queue.PriorityQueue() # hooks that generate payload code
-        self.__error_hooks = queue.PriorityQueue() # hooks that generate code executed when the job crashes
+        self.__payload_hooks = hook_pipeline() # hooks that generate payload code
+        self.__error_hooks = hook_pipeline() # hooks that generate code executed when the job crashes
         self.__qsys_data = qd.queuing_system_data()
         self.__node_workdir_base = None # get from e.g. Config: The base directory to use for the calculations.
                                     # if not otherwise specified, add jobname to get work_dir
@@ -280,6 +1381,39 @@ class jobscript_builder:
                                     # if not otherwise specified, add jobname to get node_scratch_dir
         self.__force_node_workdir = None # this workdir has been enforced on the server via a commandline flag
         self.__force_node_scratchdir = None # this scratchdir has been enforced via a commandline flag
+        self.__stagein_mode = "copy" # how files are copied to the node, see copy_from_to_hook
+        self.__stagein_workers = 4 # number of parallel copy processes in stagein_mode auto
+        self.__stageout_compression = None # compressor for large results ("zstd", "gzip") or None
+        self.__stageout_compression_level = None # level passed to the compressor, None for its default
+        self.__stageout_compression_threshold = 100*1024*1024 # bytes below which results are copied plainly
+        self.__input_cache_size = None # maximal size of the node-local input cache in bytes, None to disable it
+        self.__stagein_all_nodes = False # distribute the working directory to all nodes of multi-node jobs
+        self.__sync_interval = None # seconds between background syncs of intermediate results, None to disable
+        self.__config_walltime = None # default walltime from the config in seconds, None if not set
+
+    # Does the builder implement pack, i.e. can many jobs
+    # be run concurrently within a single job?
+    supports_packing = False
+
+    # Are the inputs files, i.e. should glob patterns
+    # given on the commandline be expanded?
+    expand_input_globs = True
+
+    # Names of the commandline arguments, which only make sense
+    # for a single input, e.g. the name of the output file
+    single_input_arguments = []
+
+    def __getstate__(self):
+        # A copy of a builder starts without any hooks.
+        state = self.__dict__.copy()
+        del state["_jobscript_builder__payload_hooks"]
+        del state["_jobscript_builder__error_hooks"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__payload_hooks = hook_pipeline()
+        self.__error_hooks = hook_pipeline()
 
     @property
     def qsys(self):
@@ -301,6 +1435,13 @@ class jobscript_builder:
             raise TypeError("queuing_system_data object expected")
         self.__qsys_data = val
 
+    @property
+    def config_walltime(self):
+        """
+        The default walltime from the config in seconds or None
+        """
+        return self.__config_walltime
+
     @property
     def default_configfile(self):
         """
@@ -309,6 +1450,108 @@ class jobscript_builder:
         return conf.default_configfile(fileroot="sendscripts")
 
 
+    def pack(self,builders,no_procs=None,physical_memory=None):
+        """
+        Setup this builder to run the jobs of the builders, on which
+        examine_args has been called already, concurrently within a
+        single job on one node with no_procs processors and physical_memory
+        bytes of memory (see pack_queuing_system_data for the defaults).
+
+        Builders which support packing override this method to setup
+        their payload, calling this implementation for the
+        queuing_system_data. Raises a ValueError if the jobs cannot
+        be packed.
+        """
+        if not self.supports_packing:
+            raise ValueError(self.program_name + " jobs cannot be packed.")
+
+        data = pack_queuing_system_data([ b.queuing_system_data for b in builders ],
+                                        no_procs=no_procs, physical_memory=physical_memory)
+        data.job_name = (builders[0].queuing_system_data.job_name or "jobscript") + "_pack"
+        self.queuing_system_data = data
+
+    def resource_history(self):
+        """
+        Return the resource_history of the program, which is used to predict
+        the resources of its jobs, or None if the builder does not keep one.
+        """
+        return None
+
+    def resource_features(self):
+        """
+        Return the features of the job, which the resources it needs depend
+        on, as a dict (see resource_history.add_pending) or None if they
+        are not known.
+        """
+        return None
+
+    def _copy_in_hook(self,files,cached_files=[]):
+        """
+        Return a copy_in_hook for the files, which uses the
+        configured stage-in mode.
+
+        The cached_files are large read-only inputs, which may
+        be shared between jobs. If the input cache is enabled,
+        these are staged via the node-local input cache.
+        """
+        cached_files = [ f for f in cached_files if f in files ]
+        if self.__input_cache_size is None or len(cached_files) == 0 \
+                or self.__node_scratchdir_base is None:
+            return copy_in_hook(files, mode=self.__stagein_mode, workers=self.__stagein_workers)
+
+        return cached_copy_in_hook(files, cached_files,
+                                   self.__node_scratchdir_base + "/.input_cache",
+                                   self.__input_cache_size, mode=self.__stagein_mode,
+                                   workers=self.__stagein_workers)
+
+    def _add_stage_out_hooks(self,work_files,scratch_files=None,plain_files=[]):
+        """
+        Add payload hooks, which copy the work_files from the node's working
+        directory and the scratch_files from the node's scratch directory
+        to the submit directory once the payload is done.
+
+        If stage-out compression is configured, all these files apart from
+        the plain_files (e.g. the program output) are transferred together
+        in a single compressed archive if they are large.
+        """
+        if self.__stageout_compression is None:
+            self.add_payload_hook(copy_out_hook(work_files, fromdir="WORK"),900)
+            if scratch_files is not None:
+                self.add_payload_hook(copy_out_hook(scratch_files, fromdir="SCRATCH"),1000)
+            return
+
+        plain = [ f for f in work_files if f in plain_files ]
+        if plain:
+            self.add_payload_hook(copy_out_hook(plain, fromdir="WORK"),900)
+
+        files = { "WORK": [ f for f in work_files if not f in plain_files ] }
+        if scratch_files is not None:
+            files["SCRATCH"] = scratch_files
+
+        archive_name = self.__qsys_data.job_name or "jobscript"
+        self.add_payload_hook(compressed_copy_out_hook(files, archive_name,
+            compression=self.__stageout_compression,
+            level=self.__stageout_compression_level,
+            threshold=self.__stageout_compression_threshold), 1000)
+
+    def _add_sync_hooks(self,files):
+        """
+        Add hooks, which periodically copy the files from the node's
+        working directory to the submit directory while the payload
+        runs, such that at most one sync interval of progress is lost
+        if the job is killed or the node dies.
+
+        Does nothing unless a sync interval has been configured.
+        """
+        if self.__sync_interval is None:
+            return
+
+        # Start after stage-in, stop before the results are copied back
+        # or the error hooks copy their files.
+        self.add_payload_hook(start_sync_hook(files,self.__sync_interval),-900)
+        self.add_payload_hook(stop_sync_hook(files),800)
+        self.add_error_hook(stop_sync_hook(files),-2000)
+
     def add_payload_hook(self,hook,priority=0):
         """
         Add a hook for code generation for the next call of build_script, which 
@@ -326,7 +1569,7 @@ class jobscript_builder:
         if not isinstance(hook,hook_base):
             raise TypeError("The hook provided is not of type hook_base")
 
-        self.__payload_hooks.put_nowait( (priority,hook) )
+        self.__payload_hooks.add(hook,priority)
 
     def add_error_hook(self,hook,priority=0):
         """
@@ -345,7 +1588,14 @@ class jobscript_builder:
         if not isinstance(hook,hook_base):
             raise TypeError("The hook provided is not of type hook_base")
 
-        self.__error_hooks.put_nowait( (priority,hook) )
+        self.__error_hooks.add(hook,priority)
+
+    def has_hooks(self):
+        """
+        Are any error or payload hooks present, e.g. since they
+        were kept by build_script(consume_hooks=False)?
+        """
+        return not (self.__error_hooks.empty() and self.__payload_hooks.empty())
 
     def clear_hooks(self):
         """
@@ -382,6 +1632,14 @@ class jobscript_builder:
         k.add_keyword("memory", default="", comment="Default physical memory in the format integer[suffix]")
         k.add_keyword("virtual_memory", default="", comment="Default virtual memory in the format integer[suffix] (Default: what was set for memory)")
         k.add_keyword("walltime", default="", comment="Default walltime in the format integer[suffix] or [[[days:]hours:]minutes:]seconds")
+        k.add_keyword("stagein_mode", default="copy", comment="How input files are copied to the node, valid are \"copy\" (one by one) and \"auto\" (tar pipe, parallel copies or rsync depending on the file sizes)")
+        k.add_keyword("stagein_workers", default="4", comment="Number of parallel copy processes for large files in stagein_mode auto")
+        k.add_keyword("stageout_compression", default="", comment="Compress large results into a single archive when copying them back, valid are \"zstd\", \"gzip\" and \"\" (no compression)")
+        k.add_keyword("stageout_compression_level", default="", comment="Compression level passed to the compressor (Default: the default of the compressor)")
+        k.add_keyword("input_cache_size", default="", comment="Stage large read-only inputs via a cache of at most this size in the format integer[suffix] in the scratchdir_base of each node (Default: no cache)")
+        k.add_keyword("stagein_all_nodes", default="false", comment="For jobs on more than one node, distribute the staged-in working directory to all nodes and remove the copies at the end, valid are \"true\" and \"false\"")
+        k.add_keyword("sync_interval", default="", comment="Copy output files back to the submit directory at this interval while the job runs, format: [[[days:]hours:]minutes:]seconds or integer[suffix] (Default: no syncing)")
+        k.add_keyword("stageout_compression_threshold", default="100mb", comment="Results smaller than this size in the format integer[suffix] are copied without compression")
 
         # see if file exists and create if not
         if not os.path.isfile(cfg):
@@ -465,9 +1723,62 @@ class jobscript_builder:
         if len(k.get_value("walltime")) > 0:
             try:
                 data.walltime = utils.interpret_string_as_time_interval(k.get_value("walltime"))
+                self.__config_walltime = data.walltime
             except argparse.ArgumentTypeError:
                 raise ParseConfigError("Cannot interpret config value of walltime: " + k.get_value("walltime") + ". Should be of the form integer[suffix] or [[[days:]hours:]minutes:]seconds")
 
+        if len(k.get_value("stagein_mode")) > 0:
+            if not k.get_value("stagein_mode") in [ "copy", "auto" ]:
+                raise ParseConfigError("Cannot interpret config value of stagein_mode: " + k.get_value("stagein_mode") + ". Should be copy or auto")
+            self.__stagein_mode = k.get_value("stagein_mode")
+
+        if len(k.get_value("stagein_workers")) > 0:
+            try:
+                self.__stagein_workers = int(k.get_value("stagein_workers"))
+            except ValueError:
+                raise ParseConfigError("Cannot interpret config value of stagein_workers: " + k.get_value("stagein_workers") + ". Should be a positive integer")
+            if self.__stagein_workers < 1:
+                raise ParseConfigError("Cannot interpret config value of stagein_workers: " + k.get_value("stagein_workers") + ". Should be a positive integer")
+
+        if len(k.get_value("input_cache_size")) > 0:
+            try:
+                self.__input_cache_size = utils.interpret_string_as_file_size(k.get_value("input_cache_size"))
+            except argparse.ArgumentTypeError:
+                raise ParseConfigError("Cannot interpret config value of input_cache_size: " + k.get_value("input_cache_size") + ". Should be of the form integer[suffix] like 10gb")
+            if self.__input_cache_size <= 0:
+                self.__input_cache_size = None
+
+        if len(k.get_value("stagein_all_nodes")) > 0:
+            try:
+                self.__stagein_all_nodes = utils.interpret_string_as_bool(k.get_value("stagein_all_nodes"))
+            except argparse.ArgumentTypeError:
+                raise ParseConfigError("Cannot interpret config value of stagein_all_nodes: " + k.get_value("stagein_all_nodes") + ". Should be true or false")
+
+        if len(k.get_value("sync_interval")) > 0:
+            try:
+                self.__sync_interval = utils.interpret_string_as_time_interval(k.get_value("sync_interval"))
+            except argparse.ArgumentTypeError:
+                raise ParseConfigError("Cannot interpret config value of sync_interval: " + k.get_value("sync_interval") + ". Should be a time interval like 15m")
+            if self.__sync_interval <= 0:
+                self.__sync_interval = None
+
+        if len(k.get_value("stageout_compression")) > 0:
+            if not k.get_value("stageout_compression") in [ "zstd", "gzip" ]:
+                raise ParseConfigError("Cannot interpret config value of stageout_compression: " + k.get_value("stageout_compression") + ". Should be zstd, gzip or empty")
+            self.__stageout_compression = k.get_value("stageout_compression")
+
+        if len(k.get_value("stageout_compression_level")) > 0:
+            try:
+                self.__stageout_compression_level = int(k.get_value("stageout_compression_level"))
+            except ValueError:
+                raise ParseConfigError("Cannot interpret config value of stageout_compression_level: " + k.get_value("stageout_compression_level") + ". Should be an integer")
+
+        if len(k.get_value("stageout_compression_threshold")) > 0:
+            try:
+                self.__stageout_compression_threshold = utils.interpret_string_as_file_size(k.get_value("stageout_compression_threshold"))
+            except argparse.ArgumentTypeError:
+                raise ParseConfigError("Cannot interpret config value of stageout_compression_threshold: " + k.get_value("stageout_compression_threshold") + ". Should be of the form integer[suffix] like 100mb")
+
     def add_entries_to_argparse(self,argparse):
         """
         Adds required entries to an argparse Object supplied
@@ -502,6 +1813,31 @@ class jobscript_builder:
                 type=str, nargs='+', help="When to send an email about the job",
                 choices=["begin", "end", "error"]
         )
+        argparse.add_argument("--stagein-all-nodes", action='store_const', default=None,
+                const=True, help="For jobs on more than one node, distribute the working "
+                "directory to all nodes after stage-in and remove the copies at the end.")
+        argparse.add_argument("--no-stagein-all-nodes", action='store_const', default=None,
+                const=False, help="Only stage in to the first node of the job.",
+                dest="stagein_all_nodes")
+        argparse.add_argument("--input-cache-size", metavar="size", default=None,
+                type=utils.interpret_string_as_file_size, help="Stage large read-only inputs "
+                "via a node-local cache of at most this size, such that jobs on the same node "
+                "share them. 0 disables the cache. Format: integer[suffix]")
+        argparse.add_argument("--sync-interval", metavar="time", default=None,
+                type=utils.interpret_string_as_time_interval, help="Copy the output "
+                "files back to the submit directory at this interval while the job runs, "
+                "such that little is lost if the job is killed. 0 disables syncing. "
+                "Format: [[[days:]hours:]minutes:]seconds or integer[suffix]")
+        argparse.add_argument("--stageout-compression", default=None, type=str,
+                choices=["none", "zstd", "gzip"], help="Compress large results into a single "
+                "archive when copying them back to the submit directory. Use the "
+                "unpack_stageout script to unpack it."
+        )
+        argparse.add_argument("--stagein-mode", default=None, type=str,
+                choices=["copy", "auto"], help="How input files are copied to the node: "
+                "\"copy\" copies them one by one, \"auto\" selects between a tar pipe, "
+                "parallel copies and rsync depending on the file sizes."
+        )
 
     def examine_args(self,args):
         """
@@ -551,6 +1887,23 @@ class jobscript_builder:
         if args.merge_error is not None:
             data.merge_stdout_stderr = args.merge_error
 
+        if args.stagein_mode is not None:
+            self.__stagein_mode = args.stagein_mode
+
+        if args.stagein_all_nodes is not None:
+            self.__stagein_all_nodes = args.stagein_all_nodes
+
+        if args.input_cache_size is not None:
+            self.__input_cache_size = args.input_cache_size if args.input_cache_size > 0 else None
+
+        if args.sync_interval is not None:
+            self.__sync_interval = args.sync_interval if args.sync_interval > 0 else None
+
+        if args.stageout_compression == "none":
+            self.__stageout_compression = None
+        elif args.stageout_compression is not None:
+            self.__stageout_compression = args.stageout_compression
+
         if args.email is not None:
             data.send_email_on.end = "end" in args.email
             data.send_email_on.begin = "begin" in args.email
@@ -560,17 +1913,18 @@ class jobscript_builder:
             qsys = self.__qsys
             try:
                 cmd_qd = qsys.parse_commandline_args(args.qsys_args)
-            except ValueError as e:
+            except (ValueError, UnknownDataFieldException) as e:
                 raise SystemExit("The explicitly provided --qsys-args are erroneous: " +
                                  str(e))
 
+            import objectmerge
             om = objectmerge.objectmerge(data,allowUpdates=True,allowListExtend=False)
             try:
                 om.merge_in(cmd_qd)
             except objectmerge.MergeException as e:
                 raise SystemExit("The explicitly provided --qsys-args and the other arguments conflict: " + e.args[0])
 
-    def build_script(self):
+    def build_script(self,consume_hooks=True):
         """
         use self.qsys to build the script and return string of its content
 
@@ -578,7 +1932,10 @@ class jobscript_builder:
         ready for the script to be written
 
         Note: This function empties both the list of error and the list of payload hooks, so 
-        if two scripts should be built new hooks need to be added beforehand
+        if two scripts should be built new hooks need to be added beforehand.
+        If consume_hooks is False, the hooks are kept instead, such that the
+        same hooks may be rendered for many scripts, e.g. after changing the
+        queuing_system_data in between.
         """
         qsys = self.__qsys
         data = self.__qsys_data
@@ -608,6 +1965,16 @@ class jobscript_builder:
             node.no_procs = 1
             data.add_node_type(node)
 
+        # Distribute the working directory to all nodes for multi-node jobs
+        payload_hooks = self.__payload_hooks
+        error_hooks = self.__error_hooks
+        if self.__stagein_all_nodes and data.no_nodes() > 1:
+            payload_hooks = payload_hooks.copy()
+            error_hooks = error_hooks.copy()
+            payload_hooks.add(multinode_stage_in_hook(),-850)
+            payload_hooks.add(multinode_cleanup_hook(),1100)
+            error_hooks.add(multinode_cleanup_hook(),1100)
+
         # check if data is ready:
         if not qsys.is_ready_for_submission(data):
             raise DataNotReady(qsys.why_not_ready_for_submission(data))
@@ -646,161 +2013,18 @@ class jobscript_builder:
         if self.queuing_system_data.virtual_memory is None:
             print("Warning: Virtual memory not set. Queuing systems default will be used.")
 
-        # build shebang:
-        string="#!/bin/bash\n#\n"
-
-        # build header
-        string += qsys.build_script_header(data)
-        string += "\n"
-
-        # separator
-        separator = "#\n###################################\n#\n"
-        string += separator
-
-        # Copy global vars from python part
-        string += 'SUBMIT_HOST=$' + params.submit_host + '\n'
-        string += 'SUBMIT_SERVER=$' + params.submit_server+ '\n'
-        string += 'SUBMIT_QUEUE=$' + params.submit_queue+ '\n'
-        string += 'SUBMIT_WORKDIR=$' + params.submit_workdir+ '\n'
-        string += 'JOBID=$' + params.jobid+ '\n'
-        string += 'JOBNAME=$' + params.jobname+ '\n'
-        string += 'QUEUE=$' + params.queue+ '\n'
-        string += 'O_PATH=$' + params.path+ '\n'
-        string += 'O_HOME=$' +params.home+ '\n'
-        string += 'NODES=$' + params.nodes + '\n'
-        string += 'NODES_UNIQUE=$(echo "$NODES" | sort -u)\n'
-
-        # Setup return / node / scratch environment:
-        environ.return_value = "RETURN_VALUE"
-        environ.node_work_dir = "NODE_WORKDIR"
-        environ.node_scratch_dir="NODE_SCRATCHDIR"
-        string += 'RETURN_VALUE=0\n'
-        string += 'NODE_WORKDIR=' + workdirexpr + '\n'
-        string += 'NODE_SCRATCHDIR=' + scratchdirexpr + '\n'
-
-        string += separator
-
-        # functions:
-        string += """ \
-print_info() {
-    echo ------------------------------------------------------
-    echo "Job is running on nodes"
-    echo "$NODES" | sed 's/^/    /g'
-    echo ------------------------------------------------------
-    echo qsys: job was submitted from $SUBMIT_HOST
-    echo qsys: originating queue is $SUBMIT_QUEUE
-    echo qsys: executing queue is $QUEUE
-    echo qsys: original working directory is $SUBMIT_WORKDIR
-    echo qsys: job identifier is $JOBID
-    echo qsys: job name is $JOBNAME
-    echo qsys: current home directory is $O_HOME
-    echo qsys: PATH = $O_PATH
-    echo ------------------------------------------------------
-    echo
-}
-
-stage_in() {
-    rm -f "$SUBMIT_WORKDIR/job_not_successful"
-
-    echo "Calculation working directory: $NODE_WORKDIR"
-    echo "            scratch directory: $NODE_SCRATCHDIR"
-
-    # create workdir and cd to it.
-    if ! mkdir -m700 -p $NODE_SCRATCHDIR $NODE_WORKDIR; then
-        echo "Could not create scratch($NODE_SCRATCHDIR) or workdir($NODE_WORKDIR)" >&2
-        exit 1
-    fi
-    cd $NODE_WORKDIR
-
-    echo
-    echo ------------------------------------------------------
-    echo
-}
-
-stage_out() {
-    if [ "$RETURN_VALUE" != "0" ]; then
-        touch "$SUBMIT_WORKDIR/job_not_successful"
-    fi
-
-    echo
-    echo ------------------------------------------------------
-    echo
-
-    echo "Final files in $SUBMIT_WORKDIR:"
-    (
-        cd $SUBMIT_WORKDIR
-        ls -l | sed 's/^/    /g'
-    )
-
-    echo
-    echo "More files can be found in $NODE_WORKDIR and $NODE_SCRATCHDIR on"
-    echo "$NODES_UNIQUE" | sed 's/^/    /g'
-    echo
-    echo "Sizes of these files:"
-
-    if echo "$NODE_SCRATCHDIR"/* | grep -q "$NODE_SCRATCHDIR/\*$"; then
-        # no files in scratchdir:
-        du -shc * | sed 's/^/    /g'
-    else
-        du -shc * "$NODE_SCRATCHDIR"/* | sed 's/^/    /g'
-    fi
-
-    echo
-    echo "If you want to delete these, run:"
-    for node in $NODES_UNIQUE; do
-        echo "    ssh $node rm -r \\"$NODE_WORKDIR\\" \\"$NODE_SCRATCHDIR\\""
-    done
-}
-
-handle_error() {
-    # Make sure this function is only called once
-    # and not once for each parallel process
-    trap ':' 2 9 15
-
-    echo
-    echo "#######################################"
-    echo "#-- Early termination signal caught --#"
-    echo "#######################################"
-    echo
-    error_hooks
-    stage_out
-}
-
-"""
-        # add stuff from hooks:
-        string+="payload_hooks() {\n:\n"
-
-        while not self.__payload_hooks.empty():
-            hook = self.__payload_hooks.get() [1]
-            string += hook.generate(data,params,environ)
-            string += "\n"
-        string += "}\n\n"
-
-        string+="error_hooks() {\n:\n"
-
-        while not self.__error_hooks.empty():
-            hook = self.__error_hooks.get() [1]
-            string += hook.generate(data,params,environ)
-            string += "\n"
-        string += "}\n"
-
-        string += separator
-
-        string += """\
-# Run the stuff:
-
-print_info
-stage_in
-
-# If catch signals 2 9 15, run this function:
-trap 'handle_error' 2 9 15
-
-payload_hooks
-stage_out
-exit $RETURN_VALUE\
+        # Assemble the script from the precompiled template
+        template = compiled_template(params)
+        environ.return_value = template.return_value
+        environ.node_work_dir = template.node_work_dir
+        environ.node_scratch_dir = template.node_scratch_dir
 
-"""
+        string = template.render(qsys.build_script_header(data), workdirexpr, scratchdirexpr,
+                                 payload_hooks.render(data,params,environ),
+                                 error_hooks.render(data,params,environ))
 
+        if consume_hooks:
+            self.clear_hooks()
         return string
 
 if __name__ == "__main__":
@@ -0,0 +1,268 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to index the job scripts lying around in directory trees
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system.queuing_system_base import UnknownDataFieldException
+import shared_config_lib as conf
+import fnmatch
+import json
+import os
+import shlex
+
+def default_indexfile():
+    """
+    Return the default file in which the index is cached
+    """
+    return os.path.join(conf.default_configdir(), "jobscript_index.json")
+
+def array_elements(f):
+    """
+    Return the list of the job scripts, which the job array driver
+    in the file object f runs (see jobscript_builder.build_array_script),
+    or an empty list if it is no such driver.
+    """
+    ret = []
+    inside = False
+    for line in f:
+        line = line.strip()
+        if line == "SCRIPTS=(":
+            inside = True
+        elif inside and line == ")":
+            break
+        elif inside:
+            ret.extend(shlex.split(line))
+    return ret
+
+def resources_of(data):
+    """
+    Return a dict with the resources of a queuing_system_data object,
+    which is stored in the index for each job script
+    """
+    return {
+        "job_name": data.job_name,
+        "queue_name": data.queue_name,
+        "walltime": data.walltime,
+        "physical_memory": data.physical_memory,
+        "virtual_memory": data.virtual_memory,
+        "no_nodes": data.no_nodes(),
+        "no_procs": data.no_procs(),
+        "priority": data.priority,
+        "array": data.array,
+    }
+
+class jobscript_index:
+    """
+    Index of job scripts for a queuing system, which maps the path
+    of each job script to its modification time, its size and the
+    resources requested in its header. For the drivers of job arrays
+    the job scripts of the array elements are remembered as well.
+
+    The index is cached in a json file, such that on an update only
+    scripts, which are new or have changed since the last update,
+    need to be read.
+    """
+
+    # Version of the format of the cache file
+    version = 2
+
+    def __init__(self, qsys, indexfile=None):
+        self.__qsys = qsys
+        self.__indexfile = indexfile if indexfile is not None else default_indexfile()
+        self.__entries = {} # path -> dict with "mtime", "size", "resources" and "elements"
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.__indexfile) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        # Only reuse entries of the same queuing system and format
+        if cache.get("qsys") == self.__qsys.name() and cache.get("version") == self.version:
+            self.__entries = cache.get("entries", {})
+
+    def save(self):
+        """
+        Write the index to the cache file
+        """
+        directory = os.path.dirname(self.__indexfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, such that concurrent
+        # readers never see an incomplete index
+        tmpfile = self.__indexfile + "." + str(os.getpid()) + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({ "qsys": self.__qsys.name(), "version": self.version,
+                        "entries": self.__entries }, f)
+        os.replace(tmpfile, self.__indexfile)
+
+    def __parse(self, path):
+        """
+        Return the tuple of the resources of the job script at path (None if
+        it does not contain a header for the queuing system) and the list of
+        absolute paths of the scripts it runs as a job array driver.
+        """
+        try:
+            with open(path, errors="replace") as f:
+                data = self.__qsys.parse_script_header(f)
+                elements = []
+                if data.array is not None:
+                    f.seek(0)
+                    directory = os.path.dirname(path)
+                    elements = [ os.path.join(directory, e) for e in array_elements(f) ]
+        except (OSError, ValueError, UnknownDataFieldException):
+            return None, []
+
+        if data.job_name is None and data.no_nodes() == 0:
+            return None, []
+        return resources_of(data), elements
+
+    def update(self, directories, pattern="*.sh"):
+        """
+        Scan the directories recursively for job scripts matching
+        the pattern and update the index. Entries of scripts, which
+        no longer exist below these directories, are removed.
+
+        Returns the number of scripts which had to be (re-)read.
+        """
+        n_read = 0
+        found = set()
+        roots = [ os.path.abspath(d) for d in directories ]
+        for root in roots:
+            for dirpath, dirnames, filenames in os.walk(root):
+                for filename in fnmatch.filter(filenames, pattern):
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    found.add(path)
+
+                    entry = self.__entries.get(path)
+                    if entry is not None and entry["mtime"] == st.st_mtime \
+                            and entry["size"] == st.st_size:
+                        continue
+
+                    n_read += 1
+                    resources, elements = self.__parse(path)
+                    self.__entries[path] = { "mtime": st.st_mtime, "size": st.st_size,
+                                             "resources": resources, "elements": elements }
+
+        # Remove entries of deleted scripts
+        for path in list(self.__entries):
+            if path in found:
+                continue
+            if any(path.startswith(os.path.join(root, "")) for root in roots):
+                del self.__entries[path]
+        return n_read
+
+    def select(self, directories=None, job_name=None, queue_name=None,
+               min_walltime=None, max_walltime=None,
+               min_memory=None, max_memory=None,
+               min_procs=None, max_procs=None):
+        """
+        Return the sorted list of (path, resources) of all indexed job
+        scripts below the directories (Default: all) matching the criteria.
+        The elements of indexed job arrays are skipped, since they are
+        run by the driver of the array.
+
+        job_name is a shell-style pattern, walltimes are in seconds
+        and memories in bytes. Criteria which are None are ignored.
+        """
+        def in_range(value, lower, upper):
+            if lower is not None and (value is None or value < lower):
+                return False
+            if upper is not None and (value is None or value > upper):
+                return False
+            return True
+
+        roots = None
+        if directories is not None:
+            roots = [ os.path.join(os.path.abspath(d), "") for d in directories ]
+
+        elements = set()
+        for entry in self.__entries.values():
+            if entry["resources"] is not None:
+                elements.update(entry["elements"])
+
+        ret = []
+        for path in sorted(self.__entries):
+            res = self.__entries[path]["resources"]
+            if res is None or path in elements:
+                continue
+            if roots is not None and not any(path.startswith(r) for r in roots):
+                continue
+            if job_name is not None and not fnmatch.fnmatchcase(res["job_name"] or "", job_name):
+                continue
+            if queue_name is not None and res["queue_name"] != queue_name:
+                continue
+            if not in_range(res["walltime"], min_walltime, max_walltime):
+                continue
+            if not in_range(res["physical_memory"], min_memory, max_memory):
+                continue
+            if not in_range(res["no_procs"], min_procs, max_procs):
+                continue
+            ret.append((path, res))
+        return ret
+
+if __name__ == "__main__":
+    import tempfile
+    from queuing_system.pbs import pbs
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        os.makedirs(os.path.join(tmpdir, "a", "b"))
+        os.makedirs(os.path.join(tmpdir, "c"))
+        scripts = {
+            "a/small.sh": "#!/bin/bash\n#PBS -N small\n#PBS -l walltime=3600\n#PBS -l nodes=1:ppn=2\necho\n",
+            "a/b/large.sh": "#!/bin/bash\n#PBS -N large\n#PBS -l walltime=86400,mem=10gb\n#PBS -l nodes=2:ppn=8\n",
+            "a/other.sh": "#!/bin/bash\necho no header\n",
+            "a/opts.sh": "#!/bin/bash\n#PBS -N opts -V -A project\n#PBS -W depend=afterok:1\n",
+            "c/arr.sh": "#!/bin/bash\n#PBS -N arr\n#PBS -t 0-1\nSCRIPTS=(\n    \"x.sh\"\n"
+                        "    \"y.sh\"\n)\n",
+            "c/x.sh": "#!/bin/bash\n#PBS -N x\n",
+            "c/y.sh": "#!/bin/bash\n#PBS -N y\n",
+        }
+        for name in scripts:
+            with open(os.path.join(tmpdir, name), "w") as f:
+                f.write(scripts[name])
+
+        indexfile = os.path.join(tmpdir, "index.json")
+        index = jobscript_index(pbs(), indexfile)
+        if index.update([ tmpdir ]) != len(scripts):
+            raise SystemExit("jobscript_index did not read all scripts")
+        index.save()
+
+        index = jobscript_index(pbs(), indexfile)
+        if index.update([ tmpdir ]) != 0:
+            raise SystemExit("jobscript_index did not use the cache")
+
+        if [ r["job_name"] for p, r in index.select() ] != [ "large", "opts", "small", "arr" ]:
+            raise SystemExit("jobscript_index.select failed")
+        if [ r["job_name"] for p, r in index.select(min_procs=4) ] != [ "large" ]:
+            raise SystemExit("jobscript_index.select by processors failed")
+        if [ r["job_name"] for p, r in index.select(job_name="sm*", max_walltime=7200) ] != [ "small" ]:
+            raise SystemExit("jobscript_index.select by name and walltime failed")
+
+        os.remove(os.path.join(tmpdir, "a/b/large.sh"))
+        index.update([ os.path.join(tmpdir, "a") ])
+        if [ r["job_name"] for p, r in index.select([ os.path.join(tmpdir, "a") ]) ] \
+                != [ "opts", "small" ]:
+            raise SystemExit("jobscript_index did not remove deleted scripts")
+
+    print("Unit Test passed")
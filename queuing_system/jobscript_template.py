@@ -0,0 +1,301 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module with a precompiled template for job scripts
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system import queuing_system_environment as qe
+import bisect
+import functools
+import itertools
+
+# Separator between the sections of the job script
+separator = "#\n###################################\n#\n"
+
+# The shell functions every job script contains
+functions = """ \
+print_info() {
+    echo ------------------------------------------------------
+    echo "Job is running on nodes"
+    echo "$NODES" | sed 's/^/    /g'
+    echo ------------------------------------------------------
+    echo qsys: job was submitted from $SUBMIT_HOST
+    echo qsys: originating queue is $SUBMIT_QUEUE
+    echo qsys: executing queue is $QUEUE
+    echo qsys: original working directory is $SUBMIT_WORKDIR
+    echo qsys: job identifier is $JOBID
+    echo qsys: job name is $JOBNAME
+    echo qsys: current home directory is $O_HOME
+    echo qsys: PATH = $O_PATH
+    echo ------------------------------------------------------
+    echo
+}
+
+stage_in() {
+    rm -f "$SUBMIT_WORKDIR/job_not_successful"
+
+    echo "Calculation working directory: $NODE_WORKDIR"
+    echo "            scratch directory: $NODE_SCRATCHDIR"
+
+    # create workdir and cd to it.
+    if ! mkdir -m700 -p $NODE_SCRATCHDIR $NODE_WORKDIR; then
+        echo "Could not create scratch($NODE_SCRATCHDIR) or workdir($NODE_WORKDIR)" >&2
+        exit 1
+    fi
+    cd $NODE_WORKDIR
+
+    echo
+    echo ------------------------------------------------------
+    echo
+}
+
+stage_out() {
+    if [ "$RETURN_VALUE" != "0" ]; then
+        touch "$SUBMIT_WORKDIR/job_not_successful"
+    fi
+
+    echo
+    echo ------------------------------------------------------
+    echo
+
+    echo "Final files in $SUBMIT_WORKDIR:"
+    (
+        cd $SUBMIT_WORKDIR
+        ls -l | sed 's/^/    /g'
+    )
+
+    echo
+    echo "More files can be found in $NODE_WORKDIR and $NODE_SCRATCHDIR on"
+    echo "$NODES_UNIQUE" | sed 's/^/    /g'
+    echo
+    echo "Sizes of these files:"
+
+    if echo "$NODE_SCRATCHDIR"/* | grep -q "$NODE_SCRATCHDIR/\*$"; then
+        # no files in scratchdir:
+        du -shc * | sed 's/^/    /g'
+    else
+        du -shc * "$NODE_SCRATCHDIR"/* | sed 's/^/    /g'
+    fi
+
+    echo
+    echo "If you want to delete these, run:"
+    for node in $NODES_UNIQUE; do
+        echo "    ssh $node rm -r \\"$NODE_WORKDIR\\" \\"$NODE_SCRATCHDIR\\""
+    done
+}
+
+handle_error() {
+    # Make sure this function is only called once
+    # and not once for each parallel process
+    trap ':' 2 9 15
+
+    echo
+    echo "#######################################"
+    echo "#-- Early termination signal caught --#"
+    echo "#######################################"
+    echo
+    error_hooks
+    stage_out
+}
+
+"""
+
+# The commands which run the job
+run_section = """\
+# Run the stuff:
+
+print_info
+stage_in
+
+# If catch signals 2 9 15, run this function:
+trap 'handle_error' 2 9 15
+
+payload_hooks
+stage_out
+exit $RETURN_VALUE\
+
+"""
+
+class hook_pipeline:
+    """
+    Ordered collection of hooks, which generate the code for one of the
+    hook functions of the job script.
+
+    Hooks are rendered in the order of their priority (lower values first)
+    and hooks of equal priority in the order they were added. In contrast
+    to a queue.PriorityQueue, rendering does not consume the hooks, so the
+    same pipeline may be rendered for many scripts.
+    """
+    def __init__(self):
+        self.__hooks = [] # sorted list of (priority, count, hook)
+        self.__counter = itertools.count()
+
+    def add(self,hook,priority=0):
+        """Add a hook with the given priority"""
+        bisect.insort(self.__hooks, (priority, next(self.__counter), hook))
+
+    def copy(self):
+        """Return a copy of this pipeline, which may be extended independently"""
+        ret = hook_pipeline()
+        ret.__hooks = list(self.__hooks)
+        ret.__counter = itertools.count(next(self.__counter))
+        return ret
+
+    def clear(self):
+        """Remove all hooks"""
+        self.__hooks = []
+
+    def empty(self):
+        return len(self.__hooks) == 0
+
+    def __len__(self):
+        return len(self.__hooks)
+
+    def __getstate__(self):
+        # itertools.count objects cannot be pickled
+        return { "hooks": self.__hooks }
+
+    def __setstate__(self, state):
+        self.__hooks = state["hooks"]
+        self.__counter = itertools.count(len(self.__hooks))
+
+    def render(self,data,params,calc_env):
+        """
+        Generate the shell script code of all hooks from the
+        queuing_system_data, the queuing_system_params and the
+        calculation_environment provided
+        """
+        return "".join([ h[2].generate(data,params,calc_env) + "\n" for h in self.__hooks ])
+
+class jobscript_template:
+    """
+    Precompiled job script for a queuing system environment.
+
+    All parts of the script which do not depend on the job, i.e. the
+    copying of the queuing system variables and the shell functions
+    for staging, are assembled once on construction. render only
+    substitutes the per-job fields.
+
+    The shell variables, which hold the return value, the working and
+    the scratch directory on the node, are given by the attributes
+    return_value, node_work_dir and node_scratch_dir.
+    """
+    return_value = "RETURN_VALUE"
+    node_work_dir = "NODE_WORKDIR"
+    node_scratch_dir = "NODE_SCRATCHDIR"
+
+    def __init__(self,params):
+        if not isinstance(params,qe.queuing_system_environment):
+            raise TypeError("params not of type qe.queuing_system_environment")
+
+        # Copy global vars from python part
+        variables = separator
+        variables += 'SUBMIT_HOST=$' + params.submit_host + '\n'
+        variables += 'SUBMIT_SERVER=$' + params.submit_server+ '\n'
+        variables += 'SUBMIT_QUEUE=$' + params.submit_queue+ '\n'
+        variables += 'SUBMIT_WORKDIR=$' + params.submit_workdir+ '\n'
+        variables += 'JOBID=$' + params.jobid+ '\n'
+        variables += 'JOBNAME=$' + params.jobname+ '\n'
+        variables += 'QUEUE=$' + params.queue+ '\n'
+        variables += 'O_PATH=$' + params.path+ '\n'
+        variables += 'O_HOME=$' +params.home+ '\n'
+        variables += 'NODES=$' + params.nodes + '\n'
+        variables += 'NODES_UNIQUE=$(echo "$NODES" | sort -u)\n'
+        variables += self.return_value + '=0\n'
+
+        self.__shebang = "#!/bin/bash\n#\n"
+        self.__variables = variables
+        self.__functions = separator + functions + "payload_hooks() {\n:\n"
+        self.__between_hooks = "}\n\nerror_hooks() {\n:\n"
+        self.__run = "}\n" + separator + run_section
+
+    def render(self,header,workdirexpr,scratchdirexpr,payload,error):
+        """
+        Return the job script for the queuing system header, the shell
+        expressions for the working and scratch directory on the node
+        and the code of the payload and error hooks.
+        """
+        return "".join([ self.__shebang, header, "\n", self.__variables,
+                         self.node_work_dir, "=", workdirexpr, "\n",
+                         self.node_scratch_dir, "=", scratchdirexpr, "\n",
+                         self.__functions, payload, self.__between_hooks,
+                         error, self.__run ])
+
+@functools.lru_cache(maxsize=None)
+def __compile(items):
+    params = qe.queuing_system_environment()
+    for key, value in items:
+        setattr(params, key, value)
+    return jobscript_template(params)
+
+def compiled_template(params):
+    """
+    Return the jobscript_template for the queuing system environment
+    params. Templates are only compiled once for each environment.
+    """
+    if not isinstance(params,qe.queuing_system_environment):
+        raise TypeError("params not of type qe.queuing_system_environment")
+    return __compile(tuple(sorted(vars(params).items())))
+
+if __name__ == "__main__":
+    # Benchmark: number of job scripts generated per second
+    import argparse
+    import sys
+    import time
+    from queuing_system import jobscript_builder as jsb
+    from queuing_system.pbs import pbs
+
+    n_scripts = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+
+    j = jsb.jobscript_builder(pbs())
+    parser = argparse.ArgumentParser()
+    j.add_entries_to_argparse(parser)
+    j.examine_args(parser.parse_args([ "--wt", "4h", "--mem", "1gb", "--np", "4",
+        "--workdir", "/tmp/work", "--scratchdir", "/tmp/scratch" ]))
+
+    def add_hooks():
+        j.add_payload_hook(jsb.copy_in_hook([ "input.in", "guess.xyz" ]),-1000)
+        j.add_payload_hook(jsb.copy_out_hook([ "input.out", "input.in.fchk" ]),900)
+        j.add_error_hook(jsb.copy_out_hook([ "input.out" ]),-1000)
+
+    def run(label, build):
+        start = time.perf_counter()
+        for i in range(n_scripts):
+            j.queuing_system_data.job_name = "job" + str(i)
+            build()
+        wall = time.perf_counter() - start
+        print("{0:40s} {1:10.0f} scripts per second".format(label, n_scripts/wall))
+
+    def rebuild():
+        add_hooks()
+        j.build_script()
+    run("build_script, hooks re-added", rebuild)
+
+    add_hooks()
+    run("build_script, hooks kept", lambda: j.build_script(consume_hooks=False))
+
+    params = j.qsys.get_environment()
+    env = jsb.calculation_environment()
+    template = compiled_template(params)
+    env.return_value = template.return_value
+    env.node_work_dir = template.node_work_dir
+    env.node_scratch_dir = template.node_scratch_dir
+    data = j.queuing_system_data
+    payload = hook_pipeline()
+    payload.add(jsb.copy_in_hook([ "input.in", "guess.xyz" ]),-1000)
+    error = hook_pipeline()
+    run("jobscript_template.render", lambda: template.render(
+        j.qsys.build_script_header(data), '"/tmp/work"', '"/tmp/scratch"',
+        payload.render(data,params,env), error.render(data,params,env)))
@@ -0,0 +1,200 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to run a command on many nodes in parallel via ssh
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+import os
+import tempfile
+import time
+
+# Default number of nodes contacted at the same time
+default_parallel = 16
+
+# Default number of seconds after which a node is given up
+default_timeout = 30
+
+# Default number of seconds an idle master connection is kept open
+default_persist = 60
+
+def default_control_dir():
+    """
+    Return the directory in which the sockets of the ssh master
+    connections are kept. This is the environment variable
+    QFANOUT_CONTROL_DIR if set or a directory of the user below
+    the temporary directory of the host otherwise.
+    """
+    control_dir = os.environ.get("QFANOUT_CONTROL_DIR")
+    if control_dir:
+        return control_dir
+    return os.path.join(tempfile.gettempdir(), "qfanout-" + str(os.getuid()))
+
+def default_persist_from_env():
+    """
+    Return the number of seconds an idle master connection is kept open
+    from the environment variable QFANOUT_PERSIST or default_persist
+    """
+    try:
+        return int(os.environ["QFANOUT_PERSIST"])
+    except (KeyError, ValueError):
+        return default_persist
+
+def ssh_options(control_dir=None, persist=None, connect_timeout=None):
+    """
+    Return the options for ssh to share one master connection per node
+    (ControlMaster) between all calls using the same control_dir and to
+    fail instead of prompting for a password.
+
+    If the control_dir cannot be used, no multiplexing is done.
+    An idle master connection is closed after persist seconds
+    (Default: from default_persist_from_env).
+    """
+    options = [ "-o", "BatchMode=yes" ]
+    if connect_timeout is not None:
+        options += [ "-o", "ConnectTimeout=" + str(int(connect_timeout)) ]
+
+    if control_dir is None:
+        control_dir = default_control_dir()
+    if persist is None:
+        persist = default_persist_from_env()
+    try:
+        os.makedirs(control_dir, mode=0o700, exist_ok=True)
+        st = os.stat(control_dir)
+        if st.st_uid != os.getuid() or st.st_mode & 0o077:
+            return options
+    except OSError:
+        return options
+    return options + [ "-o", "ControlMaster=auto",
+                       "-o", "ControlPath=" + os.path.join(control_dir, "%C"),
+                       "-o", "ControlPersist=" + str(int(persist)) ]
+
+class node_result:
+    """
+    The result of running a command on a node
+    """
+    def __init__(self, node):
+        self.node = node          #type: str   name of the node
+        self.returncode = None    #type: int   exit status of ssh (None if timed out)
+        self.stdout = ""          #type: str   output of the command
+        self.stderr = ""          #type: str   error output of the command or ssh
+        self.duration = 0.0       #type: float seconds until the node answered
+        self.timed_out = False    #type: bool  was the node given up
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    @property
+    def status(self):
+        """Short description of the outcome"""
+        if self.timed_out:
+            return "timeout"
+        if self.returncode == 0:
+            return "ok"
+        if self.returncode == 255:
+            # ssh uses 255 for its own errors
+            return "unreachable"
+        return "rc " + str(self.returncode)
+
+def run_on_node(node, command, timeout=default_timeout, options=[]):
+    """
+    Run the command on the node via ssh and return a node_result.
+    """
+    import subprocess
+
+    result = node_result(node)
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run([ "ssh" ] + options + [ node, command ],
+                              stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                              stderr=subprocess.PIPE, universal_newlines=True,
+                              timeout=timeout)
+        result.returncode = proc.returncode
+        result.stdout = proc.stdout
+        result.stderr = proc.stderr
+    except subprocess.TimeoutExpired as e:
+        result.timed_out = True
+        result.stdout = e.stdout or ""
+        if isinstance(result.stdout, bytes):
+            result.stdout = result.stdout.decode(errors="replace")
+    except OSError as e:
+        result.returncode = 255
+        result.stderr = "Could not run ssh: " + str(e)
+    result.duration = time.perf_counter() - start
+    return result
+
+def run_on_nodes(nodes, command, parallel=default_parallel, timeout=default_timeout,
+                 control_dir=None, on_result=None):
+    """
+    Run the command on all nodes via ssh, at most parallel nodes at a
+    time and each with the given timeout, and return the list of
+    node_results in the order of the nodes.
+
+    The function on_result is called with each node_result as soon as
+    the node has answered, e.g. to print the results as they arrive.
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    options = ssh_options(control_dir, connect_timeout=timeout)
+    results = {}
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = [ executor.submit(run_on_node, node, command, timeout, options)
+                    for node in nodes ]
+        for future in as_completed(futures):
+            result = future.result()
+            results[result.node] = result
+            if on_result is not None:
+                on_result(result)
+    return [ results[node] for node in nodes ]
+
+if __name__ == "__main__":
+    import stat
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        ssh = os.path.join(tmpdir, "ssh")
+        with open(ssh, "w") as f:
+            # The fake ssh skips the options and runs the command locally
+            f.write("#!/bin/sh\nwhile [ \"$1\" = -o ]; do shift 2; done\n"
+                    + "NODE=$1; shift\n"
+                    + "[ \"$NODE\" = hung ] && exec sleep 10\n"
+                    + "[ \"$NODE\" = down ] && { echo 'no route' >&2; exit 255; }\n"
+                    + "sleep 1; echo \"$NODE: $@\"\n")
+        os.chmod(ssh, stat.S_IRWXU)
+        os.environ["PATH"] = tmpdir + os.pathsep + os.environ["PATH"]
+
+        arrived = []
+        nodes = [ "node" + str(i) for i in range(4) ] + [ "hung", "down" ]
+        start = time.perf_counter()
+        results = run_on_nodes(nodes, "uptime", parallel=8, timeout=2,
+                               control_dir=os.path.join(tmpdir, "ctl"),
+                               on_result=lambda r: arrived.append(r.node))
+        if time.perf_counter() - start > 5:
+            raise SystemExit("run_on_nodes did not run in parallel or respect the timeout")
+        if [ r.node for r in results ] != nodes:
+            raise SystemExit("run_on_nodes did not return the results in order")
+        if arrived[0] != "down" or arrived[-1] != "hung":
+            raise SystemExit("run_on_nodes did not report the results as they arrived")
+        if results[0].stdout != "node0: uptime\n" or not results[0].ok:
+            raise SystemExit("run_on_nodes did not run the command")
+        if results[4].status != "timeout" or results[5].status != "unreachable":
+            raise SystemExit("run_on_nodes did not report failing nodes")
+
+        if not "ControlMaster=auto" in ssh_options(os.path.join(tmpdir, "ctl")):
+            raise SystemExit("ssh_options did not enable multiplexing")
+        os.chmod(os.path.join(tmpdir, "ctl"), 0o777)
+        if "ControlMaster=auto" in ssh_options(os.path.join(tmpdir, "ctl")):
+            raise SystemExit("ssh_options used a control directory writable by others")
+
+    print("Unit Test passed")
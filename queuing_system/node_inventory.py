@@ -0,0 +1,176 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to aggregate the resources of the nodes of a PBS server
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system import pbs_state
+import bisect
+
+class node_group:
+    """
+    The summed up resources of a group of nodes, e.g. all nodes with
+    a certain property or in a certain state
+    """
+    def __init__(self, name):
+        self.name = name            #type: str  name of the group
+        self.nodes = 0              #type: int  number of nodes
+        self.available_nodes = 0    #type: int  number of nodes neither offline nor down
+        self.procs = 0              #type: int  number of processors
+        self.free_procs = 0         #type: int  number of processors free for jobs
+        self.max_free_procs = 0     #type: int  largest number of free processors on one node
+        self.totmem = 0             #type: int  total memory in bytes
+        self.availmem = 0           #type: int  memory available on the available nodes in bytes
+        self.max_availmem = 0       #type: int  largest available memory on one node in bytes
+
+    def add(self, node):
+        """Add the resources of the pbs_node node"""
+        self.nodes += 1
+        self.procs += node.np or 0
+        self.totmem += node.totmem or 0
+        if not node.available:
+            return
+        self.available_nodes += 1
+        self.free_procs += node.free_procs
+        self.max_free_procs = max(self.max_free_procs, node.free_procs)
+        self.availmem += node.availmem or 0
+        self.max_availmem = max(self.max_availmem, node.availmem or 0)
+
+class node_inventory:
+    """
+    The nodes of a PBS server with their resources summed up per
+    property and per state.
+
+    For finding the nodes on which a job could start right now, an index
+    is built once per property: for each number of processors the list of
+    nodes with at least this many free processors sorted by available
+    memory. Building it takes time and space proportional to the largest
+    number of free processors times the number of nodes, a query is then
+    a lookup and a bisection plus copying the nodes which fit.
+    """
+
+    def __init__(self, nodes):
+        self.__nodes = list(nodes)
+        self.__total = node_group("all")
+        self.__by_property = {}
+        self.__by_state = {}
+        for node in self.__nodes:
+            self.__total.add(node)
+            for prop in node.properties:
+                self.__by_property.setdefault(prop, node_group(prop)).add(node)
+            state = ",".join(node.state) or "unknown"
+            self.__by_state.setdefault(state, node_group(state)).add(node)
+        self.__fit_index = {}
+
+    @property
+    def nodes(self):
+        """List of all pbs_node objects"""
+        return self.__nodes
+
+    @property
+    def total(self):
+        """The node_group of all nodes"""
+        return self.__total
+
+    @property
+    def by_property(self):
+        """Dict from each node property to the node_group of its nodes"""
+        return self.__by_property
+
+    @property
+    def by_state(self):
+        """Dict from each node state (e.g. free or job-exclusive) to its node_group"""
+        return self.__by_state
+
+    def __index(self, prop):
+        """
+        Return the index for the nodes with the property prop (all if None),
+        which is a list mapping a number of processors to the tuple
+        (negated availmem, names) of the nodes with at least this many free
+        processors, both sorted by descending available memory.
+        """
+        if prop in self.__fit_index:
+            return self.__fit_index[prop]
+
+        nodes = sorted(( (n.availmem or 0, n.name, n.free_procs) for n in self.__nodes
+                         if n.free_procs > 0 and (prop is None or prop in n.properties) ),
+                       reverse=True)
+        max_free = max([ 0 ] + [ free for mem, name, free in nodes ])
+        index = []
+        for procs in range(max_free + 1):
+            fitting = [ (mem, name) for mem, name, free in nodes if free >= procs ]
+            index.append(([ -mem for mem, name in fitting ], [ name for mem, name in fitting ]))
+        self.__fit_index[prop] = index
+        return index
+
+    def fit(self, procs, memory=None, prop=None):
+        """
+        Return the names of the nodes on which a job with procs processors
+        and memory bytes of memory (if not None) could start right now,
+        optionally only nodes with the property prop. The nodes with the
+        most available memory come first.
+        """
+        index = self.__index(prop)
+        if procs >= len(index):
+            return []
+        negmems, names = index[max(0, procs)]
+        if memory is None:
+            return list(names)
+        return names[:bisect.bisect_right(negmems, -memory)]
+
+def from_snapshot(snapshot=None, max_age=None):
+    """
+    Return the node_inventory from the output of qnodes kept in the
+    queue_snapshot snapshot (Default: the one shared on this host).
+
+    Raises a queue_snapshot.SnapshotError if qnodes fails.
+    """
+    return node_inventory(pbs_state.from_snapshot(snapshot, jobs=False,
+                                                  max_age=max_age).nodes)
+
+if __name__ == "__main__":
+    def node(name, state, np, props, jobs, availmem, totmem=128):
+        return pbs_state.pbs_node(name, {
+            "state": state, "np": str(np), "properties": props, "jobs": jobs,
+            "status": "availmem={0}gb,totmem={1}gb".format(availmem, totmem),
+        })
+
+    inventory = node_inventory([
+        node("n1", "job-exclusive", 4, "intel", "0-3/11.srv", 4),
+        node("n2", "free", 8, "intel", "0-1/12.srv", 30, 64),
+        node("n3", "offline", 16, "amd,big", "", 120),
+        node("n4", "free", 16, "amd,big", "", 120),
+        node("n5", "free", 16, "amd", "0-7/13.srv", 60),
+    ])
+
+    amd = inventory.by_property["amd"]
+    if (amd.nodes, amd.available_nodes, amd.procs, amd.free_procs, amd.max_free_procs) \
+            != (3, 2, 48, 24, 16):
+        raise SystemExit("node_inventory did not sum up the processors per property")
+    if amd.availmem != 180 * 1024**3 or amd.totmem != 3 * 128 * 1024**3:
+        raise SystemExit("node_inventory did not sum up the memory per property")
+    if inventory.by_state["free"].free_procs != 6 + 16 + 8 \
+            or inventory.by_state["job-exclusive"].free_procs != 0:
+        raise SystemExit("node_inventory did not sum up the processors per state")
+
+    if inventory.fit(16, 64 * 1024**3) != [ "n4" ]:
+        raise SystemExit("node_inventory.fit did not find the single fitting node")
+    if inventory.fit(4) != [ "n4", "n5", "n2" ] or inventory.fit(8, 100 * 1024**3) != [ "n4" ]:
+        raise SystemExit("node_inventory.fit did not sort by available memory")
+    if inventory.fit(32) != [] or inventory.fit(6, prop="intel") != [ "n2" ] \
+            or inventory.fit(16, prop="intel") != []:
+        raise SystemExit("node_inventory.fit did not respect the constraints")
+
+    print("Unit Test passed")
@@ -17,11 +17,12 @@
 # file LICENCE or at <http://www.gnu.org/licenses/>.
 
 from queuing_system.queuing_system_base import queuing_system_base
+from queuing_system.queuing_system_base import UnknownDataFieldException
 from queuing_system import queuing_system_data as qd
 from queuing_system import queuing_system_environment as qe
-import platform
 import re
-import argparse
+import shlex
+import struct
 
 class pbs_time:
     def __init__(self,time):
@@ -104,7 +105,7 @@ class pbs_size:
             self.__bytes = int(match.group())
 
             # now find multiplication factor
-            unit = size[match.end():]
+            unit = size[match.end():].lower()
             fac=1
             if unit == "b":
                 fac=1
@@ -150,12 +151,9 @@ class pbs_size:
         If set to None use the value for this system
         """
         if value == None:
-            (wordsize, dummy) = platform.architecture()
-            wordsize = wordsize.replace("bit","")
-            try:
-                self.__wordsize=int(wordsize)/8 # word size in bytes
-            except ValueError:
-                raise OSError("Could not parse word size")
+            # The size of a pointer of the running interpreter. Unlike
+            # platform.architecture this does not run the file command.
+            self.__wordsize=float(struct.calcsize("P")) # word size in bytes
         elif not isinstance(value,int):
             raise ValueError("Expected an integer value as the wordsize")
             self.__wordsize = value
@@ -176,6 +174,53 @@ class pbs(queuing_system_base):
         return "PBS"
 
 
+    # Options of qsub which are mapped to the queuing_system_data.
+    # All of them take an argument.
+    data_options = [ "-l", "-N", "-q", "-M", "-m", "-p", "-j", "-t" ]
+
+    # Options of qsub which take no argument
+    flag_options = [ "-f", "-h", "-I", "-n", "-V", "-X", "-z" ]
+
+    def __parse_nodes_into(self, value, data):
+        """Parse the value of a nodes resource, i.e. a string like
+           4:blue:ppn=2+2:red:ppn=3+12:ppn=1 and add the node types
+           to the data object.
+
+           Each part separated by "+" starts with the number of nodes
+           or a node name. Of the properties following it, the first one
+           before the ppn=# is taken as the name of the node type and
+           all others as extra features.
+        """
+        for spec in value.split("+"):
+            tokens = spec.split(":")
+            if "" in tokens:
+                raise ValueError("Invalid nodes specification: " + value)
+
+            node = qd.node_type()
+            try:
+                node.count = int(tokens[0])
+            except ValueError:
+                # A node name like nodes=node01:ppn=4
+                node.name = tokens[0]
+
+            after_ppn = False
+            for token in tokens[1:]:
+                if token.startswith("ppn="):
+                    try:
+                        node.no_procs = int(token[4:])
+                    except ValueError:
+                        raise ValueError("Invalid number of processors in nodes "
+                                         "specification: " + value)
+                    after_ppn = True
+                elif node.name is None and not after_ppn:
+                    node.name = token
+                else:
+                    node.extra_features.append(token)
+
+            if node.count < 1 or node.no_procs < 1:
+                raise ValueError("Invalid nodes specification: " + value)
+            data.add_node_type(node)
+
     def __parse_lstring_into(self, lstring, data):
         """Parse a single string following an -l and set the
            appropriate values in the data object.
@@ -183,7 +228,8 @@ class pbs(queuing_system_base):
 
         if "," in lstring:
             for lstr in lstring.split(","):
-                self.__parse_lstring_into(lstring, data)
+                self.__parse_lstring_into(lstr, data)
+            return
 
         # Get key and value
         if "=" not in lstring:
@@ -203,44 +249,89 @@ class pbs(queuing_system_base):
         elif key == "vmem":
             data.virtual_memory = pbs_size(value).bytes
         elif key == "nodes":
-            raise NotImplementedError("Parsing nodes on the commandline not "
-                                      "yet implemented.")
+            self.__parse_nodes_into(value, data)
         else:
             data.extra_resources[key] = value
 
+    def __parse_option_into(self, option, value, data):
+        """Parse a single option of data_options together with its
+           value and set the appropriate values in the data object.
+        """
+        if option == "-l":
+            self.__parse_lstring_into(value, data)
+        elif option == "-N":
+            data.job_name = value
+        elif option == "-q":
+            data.queue_name = value
+        elif option == "-M":
+            data.email = value
+        elif option == "-m":
+            if value != "n" and not set(value) <= set("abe"):
+                raise ValueError("Invalid mail options: " + value)
+            data.send_email_on.error = "a" in value
+            data.send_email_on.begin = "b" in value
+            data.send_email_on.end = "e" in value
+        elif option == "-p":
+            try:
+                data.priority = int(value)
+            except ValueError:
+                raise ValueError("Invalid priority: " + value)
+        elif option == "-j":
+            if not value in [ "oe", "eo", "n" ]:
+                raise ValueError("Invalid value for -j: " + value)
+            data.merge_stdout_stderr = (value != "n")
+        elif option == "-t":
+            data.array = value
+
+    def __parse_args_into(self, args, data, keep_unknown=False):
+        """Parse a list of qsub arguments and set the appropriate
+           values in the data object.
+
+           Raises UnknownDataFieldException for options, which are not
+           in data_options, and ValueError for invalid values. If
+           keep_unknown is True, such options are kept in the
+           extra_options of the data object instead.
+        """
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            if arg[:2] in self.data_options and len(arg) > 2:
+                # Value attached like -lwalltime=3600
+                option, value = arg[:2], arg[2:]
+                i += 1
+            elif arg in self.data_options:
+                if i + 1 >= len(args):
+                    raise ValueError("The option " + arg + " requires an argument.")
+                option, value = arg, args[i+1]
+                i += 2
+            elif keep_unknown and arg.startswith("-"):
+                if arg in self.flag_options or len(arg) > 2 or i + 1 >= len(args):
+                    data.extra_options.append([ arg ])
+                    i += 1
+                else:
+                    data.extra_options.append([ arg, args[i+1] ])
+                    i += 2
+                continue
+            else:
+                raise UnknownDataFieldException("Unknown or unsupported qsub "
+                                                "argument: " + arg)
+            self.__parse_option_into(option, value, data)
+
     def parse_commandline_args(self, cmdline):
         """
         Parse a commandline string and return a queuing_system_data object
 
         No check towards consistency like is_ready_for_submission is made
         """
-        parser = argparse.ArgumentParser()
-        parser.add_argument("-l", default=[], action="append")
-
-        args, rest = parser.parse_known_args(cmdline.split())
-
-        if len(rest) > 0:
-            raise NotImplementedError("TODO: Not yet implemented parsing these "
-                                      "arguments: " + " ".join(rest))
         data = qd.queuing_system_data()
-
-        # Deal with -l flag:
-        if args.l:
-            for lstring in args.l:
-                self.__parse_lstring_into(lstring, data)
+        self.__parse_args_into(shlex.split(cmdline), data)
         return data
 
-
-        #TODO
-        # use pbs_size and pbs_time above
-        # throw UnknownDataFieldException
-        raise NotImplementedError("TODO: Not yet implemented")
-
     def build_commandline_args(self,data):
         """
-        Build a commandline string from the data object and return it
-
-        No check towards consistency like is_ready_for_submission is made
+        Build a commandline string from the data object and return it.
+        The string contains the same options as the script header and
+        can be read back by parse_commandline_args.
         """
         if not isinstance(data,qd.queuing_system_data):
             raise TypeError("data is not of type queuing_system_data")
@@ -249,10 +340,13 @@ class pbs(queuing_system_base):
         if ret != "":
             raise ValueError("data is not ready for submission: " + ret)
 
-        ret=str()
-
-        #TODO do in a similar fashion to build_script_header
-        raise NotImplementedError("TODO: Not yet implemented")
+        # Use the same options as in the script header, such that
+        # both ways to submit the job request identical resources
+        args = []
+        for line in self.build_script_header(data).splitlines():
+            if line.startswith("#PBS"):
+                args.extend(shlex.split(line[len("#PBS"):]))
+        return " ".join(shlex.quote(arg) for arg in args)
 
 
     def parse_script_header(self,f):
@@ -260,13 +354,24 @@ class pbs(queuing_system_base):
         Read a file object and extract queuing_system_data from the header
         for the queuing system
 
+        Like qsub the file is only read up to the first line, which is
+        neither empty nor a comment, since all #PBS directives after
+        it are ignored by PBS. Directives, which are not understood,
+        are kept in the extra_options of the result.
+
         No check towards consistency like is_ready_for_submission is made
         """
-        #TODO
-        # note pbs ignores all #PBS directives after the first non-comment or whitespace line!
-        # use pbs_size and pbs_time above
-        # throw UnknownDataFieldException
-        raise NotImplementedError("TODO: Not yet implemented")
+        data = qd.queuing_system_data()
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if not line.startswith("#"):
+                break
+            if line.startswith("#PBS") and (len(line) == 4 or line[4].isspace()):
+                self.__parse_args_into(shlex.split(line[4:], comments=True), data,
+                                       keep_unknown=True)
+        return data
 
     def build_script_header(self,data):
         """
@@ -339,6 +444,14 @@ class pbs(queuing_system_base):
         if data.priority is not None:
             ret += ("#PBS -p " + str(data.priority) + "\n")
 
+        # index range of a job array
+        if data.array is not None:
+            ret += ("#PBS -t " + data.array + "\n")
+
+        # further options passed on as they are
+        for option in data.extra_options:
+            ret += ("#PBS " + " ".join(shlex.quote(arg) for arg in option) + "\n")
+
         # nodes speciffication
         ret += "#PBS -l nodes="
         first=True
@@ -369,6 +482,35 @@ class pbs(queuing_system_base):
         """return the command for the queuing system with which jobs can be aborted"""
         return "qdel"
 
+    def parse_job_id(self,output):
+        """
+        Extract the job id from the output of qsub
+        """
+        lines = output.strip().splitlines()
+        if len(lines) == 0:
+            return ""
+        return lines[-1].strip()
+
+    def is_transient_submit_error(self,returncode,stderr):
+        """
+        return True if a failed submission with the given returncode and
+        error output is due to a transient problem of the pbs_server
+
+        Only errors occurring before the server could have accepted the job
+        count. After a "request timed out" or an "end of file" the job may
+        well be queued already and submitting it again would run it twice.
+        """
+        transient_messages = [
+            "cannot connect to server",
+            "connection refused",
+            "connection timed out",
+            "server is currently too busy",
+            "pbs_server daemon may not be running",
+            "temporarily unavailable",
+        ]
+        stderr = stderr.lower()
+        return any(msg in stderr for msg in transient_messages)
+
     def why_not_ready_for_submission(self,data):
         """
         return "" if all fine, else return message with the error
@@ -402,6 +544,7 @@ class pbs(queuing_system_base):
         env.path="PBS_O_PATH"
         env.home="PBS_O_HOME"
         env.nodes="(< $PBS_NODEFILE)"
+        env.array_index="PBS_ARRAYID"
 
         return env
 
@@ -480,5 +623,77 @@ if __name__ == "__main__":
     if (pbs.build_script_header(data) != strcmp):
         raise SystemExit("build_script_header failed")
 
+    ###########################
+    #-- parsing pbs headers --#
+    ###########################
+    import io
+
+    data = pbs.parse_commandline_args("-l nodes=4:blue:ppn=2+2:red:ppn=3:fast+12 -l walltime=1:00:00,mem=2gb -N job")
+    if [ (n.count, n.name, n.no_procs, n.extra_features) for n in data.nodes ] \
+            != [ (4, "blue", 2, []), (2, "red", 3, ["fast"]), (12, None, 1, []) ]:
+        raise SystemExit("parse_commandline_args failed to parse nodes")
+    if data.walltime != 3600 or data.physical_memory != 2*1024**3 or data.job_name != "job":
+        raise SystemExit("parse_commandline_args failed")
+
+    for invalid in [ "-l nodes=0", "-l nodes=2:ppn=x", "-l walltime", "-p", "-p high" ]:
+        try:
+            pbs.parse_commandline_args(invalid)
+            raise SystemExit("parse_commandline_args accepted " + invalid)
+        except ValueError:
+            pass
+
+    try:
+        pbs.parse_commandline_args("-W depend=afterok:1")
+        raise SystemExit("parse_commandline_args accepted unknown argument")
+    except UnknownDataFieldException:
+        pass
+
+    # Parse a generated header and compare the result
+    data = pbs.parse_script_header(io.StringIO("#!/bin/bash\n#\n" + strcmp + "\n"))
+    if pbs.build_script_header(data) != strcmp:
+        raise SystemExit("parse_script_header does not reproduce build_script_header")
+
+    script  = "#!/bin/bash\n"
+    script += "#PBS -N test -q batch@server\n"
+    script += "\n"
+    script += "#PBS -l walltime=45285 -p 5 # comment\n"
+    script += "#PBS -m ae\n"
+    script += "#PBS -j n\n"
+    script += "#PBS -l nodes=2:ppn=4\n"
+    script += "echo hi\n"
+    script += "#PBS -l nodes=100\n"
+    data = pbs.parse_script_header(io.StringIO(script))
+    if data.job_name != "test" or data.queue_name != "batch@server" \
+            or data.walltime != 45285 or data.priority != 5 \
+            or data.merge_stdout_stderr != False \
+            or (data.send_email_on.error, data.send_email_on.begin, data.send_email_on.end) \
+            != (True, False, True) \
+            or data.no_nodes() != 2 or data.no_procs() != 8:
+        raise SystemExit("parse_script_header failed")
+
+    # Options, which are not understood, are passed on as they are
+    opts = pbs.parse_script_header(io.StringIO("#PBS -N opts -V -W depend=afterok:1 -Aproj\n"
+                                               "#PBS -l nodes=1:ppn=1\n"))
+    if opts.job_name != "opts" or opts.extra_options \
+            != [ [ "-V" ], [ "-W", "depend=afterok:1" ], [ "-Aproj" ] ]:
+        raise SystemExit("parse_script_header did not keep unknown options")
+    if pbs.parse_script_header(io.StringIO(pbs.build_script_header(opts))).extra_options \
+            != opts.extra_options:
+        raise SystemExit("build_script_header did not pass on unknown options")
+
+    # The commandline arguments request the same as the header
+    data.job_name = "test_2"
+    data.array = "0-3"
+    cmdline = pbs.build_commandline_args(data)
+    if pbs.build_script_header(pbs.parse_commandline_args(cmdline)) \
+            != pbs.build_script_header(data):
+        raise SystemExit("parse_commandline_args does not reproduce build_commandline_args")
+
+    # Only retry if the server certainly did not get the job
+    if not pbs.is_transient_submit_error(1, "qsub: cannot connect to server srv (errno=111)") \
+            or pbs.is_transient_submit_error(1, "qsub: End of File") \
+            or pbs.is_transient_submit_error(1, "qsub: Request timed out"):
+        raise SystemExit("is_transient_submit_error failed")
+
     print("Unit Test passed")
    
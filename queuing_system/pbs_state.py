@@ -0,0 +1,459 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to parse the state of the jobs and nodes of a PBS server
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system.pbs import pbs_time, pbs_size
+import functools
+import re
+import time
+
+def _time_or_none(value):
+    try:
+        return pbs_time(value).seconds if value else None
+    except ValueError:
+        return None
+
+def _size_or_none(value):
+    try:
+        return pbs_size(value).bytes if value else None
+    except ValueError:
+        return None
+
+def _epoch_or_none(value):
+    """Parse a time given as epoch (qstat -x) or as by ctime (qstat -f)"""
+    if not value:
+        return None
+    if value.isdigit():
+        return int(value)
+    try:
+        return int(time.mktime(time.strptime(value, "%a %b %d %H:%M:%S %Y")))
+    except (ValueError, OverflowError):
+        return None
+
+def _count_slots(slots):
+    """
+    Return the number of processor slots in a string like 0, 0-3 or 0*4
+    """
+    count = 0
+    for part in slots.split(","):
+        try:
+            if "-" in part:
+                first, last = part.split("-", 1)
+                count += int(last) - int(first) + 1
+            elif "*" in part:
+                count += int(part.split("*", 1)[1])
+            else:
+                int(part)
+                count += 1
+        except ValueError:
+            count += 1
+    return count
+
+class pbs_job:
+    """
+    A job as reported by qstat -f
+    """
+    def __init__(self, job_id, attributes):
+        self.id=job_id #str: the full job id, e.g. 1234.server
+        self.attributes=attributes #dict: all attributes, nested ones as "Resource_List.walltime"
+
+        self.name=attributes.get("Job_Name") #str or None
+        self.user=attributes.get("Job_Owner", "").split("@")[0] or None #str or None
+        self.state=attributes.get("job_state") #str or None: single letter state, e.g. Q or R
+        self.queue=attributes.get("queue") #str or None
+
+        self.walltime=_time_or_none(attributes.get("Resource_List.walltime")) #int or None: requested seconds
+        self.used_walltime=_time_or_none(attributes.get("resources_used.walltime")) #int or None
+        self.memory=_size_or_none(attributes.get("Resource_List.mem")) #int or None: requested bytes
+        self.used_memory=_size_or_none(attributes.get("resources_used.mem")) #int or None
+        self.start_time=_epoch_or_none(attributes.get("start_time")) #int or None: epoch the job started
+
+        self.nodes=[] #list of str: the nodes the job runs on in order of the exec_host
+        self.no_procs=None #int or None: number of processors used or requested
+
+        exec_host = attributes.get("exec_host")
+        if exec_host:
+            self.no_procs = 0
+            for entry in exec_host.split("+"):
+                node, sep, slots = entry.partition("/")
+                if not node in self.nodes:
+                    self.nodes.append(node)
+                self.no_procs += _count_slots(slots) if slots else 1
+        else:
+            self.no_procs = self.__requested_procs()
+
+    def __requested_procs(self):
+        """Number of processors requested by Resource_List or None"""
+        for key in [ "Resource_List.ncpus", "Resource_List.procs" ]:
+            try:
+                return int(self.attributes[key])
+            except (KeyError, ValueError):
+                pass
+
+        nodes = self.attributes.get("Resource_List.nodes")
+        if nodes is None:
+            return None
+        total = 0
+        for spec in nodes.split("+"):
+            fields = spec.split(":")
+            count = int(fields[0]) if fields[0].isdigit() else 1
+            ppn = 1
+            for field in fields[1:]:
+                if field.startswith("ppn="):
+                    try:
+                        ppn = int(field[4:])
+                    except ValueError:
+                        pass
+            total += count * ppn
+        return total
+
+    @property
+    def short_id(self):
+        """The job id without the server, e.g. 1234"""
+        return self.id.split(".", 1)[0]
+
+class pbs_node:
+    """
+    A node as reported by qnodes or pbsnodes
+    """
+    def __init__(self, name, attributes):
+        self.name=name #str
+        self.attributes=attributes #dict: all attributes as strings
+
+        self.state=[ s for s in attributes.get("state", "").split(",") if s ] #list of str
+        self.np=None #int or None: number of processors
+        try:
+            self.np=int(attributes.get("np", attributes.get("resources_available.ncpus")))
+        except (TypeError, ValueError):
+            pass
+        self.properties=[ p for p in attributes.get("properties", "").split(",") if p ] #list of str
+
+        # The jobs are given as slots/jobid (Torque) or jobid/slot (PBS Pro)
+        self.jobs=[] #list of str: ids of the jobs running on the node
+        self.used_procs=0 #int: number of processors occupied by jobs
+        for entry in attributes.get("jobs", "").split(","):
+            entry = entry.strip()
+            if not entry:
+                continue
+            first, sep, second = entry.partition("/")
+            if first and first[0].isdigit() and "." in second:
+                slots, job_id = first, second
+            else:
+                job_id, slots = first, second
+            self.used_procs += _count_slots(slots) if slots else 1
+            if not job_id in self.jobs:
+                self.jobs.append(job_id)
+
+        self.status={} #dict: the key=value pairs of the status attribute
+        for item in attributes.get("status", "").split(","):
+            key, sep, value = item.partition("=")
+            if sep:
+                self.status[key.strip()] = value.strip()
+        self.availmem=_size_or_none(self.status.get("availmem")) #int or None: bytes
+        self.totmem=_size_or_none(self.status.get("totmem")) #int or None: bytes
+        self.physmem=_size_or_none(self.status.get("physmem")) #int or None: bytes
+
+    @property
+    def available(self):
+        """Is the node up, i.e. neither offline nor down"""
+        return not any(s in [ "offline", "down", "unknown" ] for s in self.state)
+
+    @property
+    def free_procs(self):
+        """Number of processors not occupied by jobs (0 if the node is not available)"""
+        if not self.available or self.np is None:
+            return 0
+        return max(0, self.np - self.used_procs)
+
+def _flatten_xml(element, prefix=""):
+    """Return the dict of the text of all leaves below element"""
+    ret = {}
+    for child in element:
+        key = prefix + child.tag
+        if len(child):
+            ret.update(_flatten_xml(child, key + "."))
+        else:
+            ret[key] = (child.text or "").strip()
+    return ret
+
+def parse_qstat_full(output):
+    """
+    Parse the output of qstat -f (with or without -1) or
+    of qstat -f -x (xml) and return the list of pbs_job objects.
+    """
+    if output.lstrip().startswith("<"):
+        import xml.etree.ElementTree as ET
+        ret = []
+        for element in ET.fromstring(output.strip()).iter("Job"):
+            attributes = _flatten_xml(element)
+            ret.append(pbs_job(attributes.pop("Job_Id", ""), attributes))
+        return ret
+
+    ret = []
+    job_id = None
+    attributes = {}
+    key = None
+    for line in output.splitlines():
+        if line.startswith("Job Id:"):
+            if job_id is not None:
+                ret.append(pbs_job(job_id, attributes))
+            job_id = line[len("Job Id:"):].strip()
+            attributes = {}
+            key = None
+        elif job_id is None or not line.strip():
+            continue
+        elif line.startswith("\t") and key is not None:
+            # Continuation of a long value
+            attributes[key] += line.strip()
+        elif " = " in line:
+            key, sep, value = line.strip().partition(" = ")
+            attributes[key] = value
+    if job_id is not None:
+        ret.append(pbs_job(job_id, attributes))
+    return ret
+
+def parse_qnodes(output):
+    """
+    Parse the output of qnodes / pbsnodes (with or without -x)
+    and return the list of pbs_node objects.
+    """
+    if output.lstrip().startswith("<"):
+        import xml.etree.ElementTree as ET
+        ret = []
+        for element in ET.fromstring(output.strip()).iter("Node"):
+            attributes = _flatten_xml(element)
+            ret.append(pbs_node(attributes.pop("name", ""), attributes))
+        return ret
+
+    ret = []
+    name = None
+    attributes = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            if name is not None:
+                ret.append(pbs_node(name, attributes))
+            name = line.strip()
+            attributes = {}
+        elif name is not None and " = " in line:
+            key, sep, value = line.strip().partition(" = ")
+            attributes[key] = value
+    if name is not None:
+        ret.append(pbs_node(name, attributes))
+    return ret
+
+@functools.lru_cache(maxsize=128)
+def _compile(pattern):
+    return re.compile(pattern)
+
+class pbs_state:
+    """
+    The jobs and nodes of a PBS server, indexed by job id,
+    job name, user, state and node for fast queries.
+    """
+
+    def __init__(self, jobs=[], nodes=[]):
+        self.__jobs = list(jobs)
+        self.__nodes = list(nodes)
+
+        self.__job_by_id = {}
+        self.__job_by_short_id = {}
+        self.__jobs_by_name = {}
+        self.__jobs_by_user = {}
+        self.__jobs_by_state = {}
+        self.__jobs_by_node = {}
+        for job in self.__jobs:
+            self.__job_by_id[job.id] = job
+            self.__job_by_short_id.setdefault(job.short_id, job)
+            self.__jobs_by_name.setdefault(job.name, []).append(job)
+            self.__jobs_by_user.setdefault(job.user, []).append(job)
+            self.__jobs_by_state.setdefault(job.state, []).append(job)
+            for node in job.nodes:
+                self.__jobs_by_node.setdefault(node, []).append(job)
+        self.__node_by_name = { node.name: node for node in self.__nodes }
+
+    @property
+    def jobs(self):
+        """The list of all jobs in the order reported by the server"""
+        return self.__jobs
+
+    @property
+    def nodes(self):
+        """The list of all nodes in the order reported by the server"""
+        return self.__nodes
+
+    def job(self, job_id):
+        """
+        Return the job with the given full or short id (without
+        the server) or None if there is no such job. Ids with a
+        truncated server part, like those printed by qstat -a,
+        are matched by their short id.
+        """
+        job = self.__job_by_id.get(job_id)
+        if job is None:
+            job = self.__job_by_short_id.get(job_id.split(".")[0])
+        return job
+
+    def node(self, name):
+        """Return the node with the given name or None"""
+        return self.__node_by_name.get(name)
+
+    def jobs_named(self, name):
+        return list(self.__jobs_by_name.get(name, []))
+
+    def jobs_of_user(self, user):
+        return list(self.__jobs_by_user.get(user, []))
+
+    def jobs_in_state(self, state):
+        return list(self.__jobs_by_state.get(state, []))
+
+    def jobs_on_node(self, node):
+        return list(self.__jobs_by_node.get(node, []))
+
+    def find_jobs(self, pattern=None, user=None, state=None, node=None):
+        """
+        Return the list of jobs (in the order reported by the server)
+        matching all given criteria. pattern is a regular expression
+        searched in the job id and the job name, the others are
+        compared exactly. Criteria which are None are ignored.
+        """
+        candidates = None
+        for index, key in [ (self.__jobs_by_user, user), (self.__jobs_by_state, state),
+                            (self.__jobs_by_node, node) ]:
+            if key is None:
+                continue
+            jobs = index.get(key, [])
+            if candidates is None or len(jobs) < len(candidates):
+                candidates = jobs
+        if candidates is None:
+            candidates = self.__jobs
+
+        ret = []
+        regex = _compile(pattern) if pattern is not None else None
+        for job in candidates:
+            if user is not None and job.user != user:
+                continue
+            if state is not None and job.state != state:
+                continue
+            if node is not None and not node in job.nodes:
+                continue
+            if regex is not None and regex.search(job.id) is None \
+                    and regex.search(job.name or "") is None:
+                continue
+            ret.append(job)
+        return ret
+
+def from_snapshot(snapshot=None, jobs=True, nodes=True, max_age=None):
+    """
+    Return the pbs_state from the output of qstat -f and qnodes kept in
+    the queue_snapshot snapshot (Default: the one shared on this host).
+    If jobs or nodes is False, the respective source is not queried.
+
+    Raises a queue_snapshot.SnapshotError if a command fails.
+    """
+    from queuing_system import queue_snapshot as qs
+    if snapshot is None:
+        snapshot = qs.queue_snapshot()
+
+    job_list = parse_qstat_full(snapshot.get("qstat_full", max_age)) if jobs else []
+    node_list = parse_qnodes(snapshot.get("qnodes", max_age)) if nodes else []
+    return pbs_state(job_list, node_list)
+
+if __name__ == "__main__":
+    qstat_output = (
+        "Job Id: 101.server\n"
+        "    Job_Name = water_opt\n"
+        "    Job_Owner = alice@login\n"
+        "    resources_used.walltime = 01:02:03\n"
+        "    job_state = R\n"
+        "    queue = batch\n"
+        "    exec_host = node01/0-1+node02/0+node02/1\n"
+        "    Resource_List.walltime = 24:00:00\n"
+        "    Resource_List.mem = 2gb\n"
+        "    start_time = Thu Oct 15 10:00:00 2026\n"
+        "    Variable_List = PBS_O_HOME=/home/alice,\n"
+        "\tPBS_O_LANG=C\n"
+        "\n"
+        "Job Id: 102.server\n"
+        "    Job_Name = a very long job name\n"
+        "    Job_Owner = bob@login\n"
+        "    job_state = Q\n"
+        "    queue = batch\n"
+        "    Resource_List.nodes = 2:ppn=8\n"
+    )
+    qstat_xml = ("<Data><Job><Job_Id>103.server</Job_Id><Job_Name>water_md</Job_Name>"
+                 "<Job_Owner>alice@login</Job_Owner><job_state>R</job_state>"
+                 "<Resource_List><walltime>01:00:00</walltime><ncpus>4</ncpus></Resource_List>"
+                 "<exec_host>node02/2*4</exec_host><start_time>1792000000</start_time>"
+                 "</Job></Data>")
+    qnodes_output = (
+        "node01\n"
+        "     state = job-exclusive\n"
+        "     np = 2\n"
+        "     properties = intel,fast\n"
+        "     jobs = 0-1/101.server\n"
+        "     status = availmem=1000kb,totmem=4000kb\n"
+        "\n"
+        "node02\n"
+        "     state = free\n"
+        "     np = 8\n"
+        "     jobs = 0/101.server,1/101.server, 2/103.server\n"
+        "\n"
+        "node03\n"
+        "     state = down,offline\n"
+        "     np = 8\n"
+    )
+
+    jobs = parse_qstat_full(qstat_output) + parse_qstat_full(qstat_xml)
+    nodes = parse_qnodes(qnodes_output)
+    state = pbs_state(jobs, nodes)
+
+    job = state.job("101")
+    if job is None or job.nodes != [ "node01", "node02" ] or job.no_procs != 4:
+        raise SystemExit("pbs_job did not parse exec_host")
+    if job.walltime != 86400 or job.used_walltime != 3723 or job.memory != 2*1024**3:
+        raise SystemExit("pbs_job did not parse the resources")
+    if job.start_time != time.mktime((2026, 10, 15, 10, 0, 0, 0, 0, -1)) \
+            or state.job("103").start_time != 1792000000:
+        raise SystemExit("pbs_job did not parse the start time")
+    if job.attributes["Variable_List"] != "PBS_O_HOME=/home/alice,PBS_O_LANG=C":
+        raise SystemExit("parse_qstat_full did not join continuation lines")
+    if state.job("102.server").no_procs != 16 or state.job("102").name != "a very long job name":
+        raise SystemExit("pbs_job did not parse the requested nodes")
+    if state.job("103").no_procs != 4 or state.job("103").walltime != 3600:
+        raise SystemExit("parse_qstat_full failed for xml")
+
+    if [ j.id for j in state.find_jobs(user="alice") ] != [ "101.server", "103.server" ]:
+        raise SystemExit("pbs_state.find_jobs by user failed")
+    if [ j.id for j in state.find_jobs("water", state="R", node="node02") ] \
+            != [ "101.server", "103.server" ]:
+        raise SystemExit("pbs_state.find_jobs by pattern and node failed")
+    if [ j.id for j in state.find_jobs("^10[23]", user="bob") ] != [ "102.server" ]:
+        raise SystemExit("pbs_state.find_jobs by id pattern failed")
+    if state.jobs_named("water_md")[0].id != "103.server" or len(state.jobs_on_node("node01")) != 1:
+        raise SystemExit("pbs_state indexes failed")
+
+    node = state.node("node02")
+    if node.jobs != [ "101.server", "103.server" ] or node.free_procs != 5:
+        raise SystemExit("pbs_node did not parse the jobs")
+    if state.node("node01").properties != [ "intel", "fast" ] or state.node("node01").totmem != 4000*1024:
+        raise SystemExit("pbs_node did not parse properties or status")
+    if state.node("node03").available or state.node("node03").free_procs != 0:
+        raise SystemExit("pbs_node did not parse the state")
+
+    print("Unit Test passed")
@@ -0,0 +1,308 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to share snapshots of the queue state between the tools of a host
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+import fcntl
+import os
+import tempfile
+import time
+
+# The commands whose output is kept in a snapshot
+sources = {
+    # Table of all jobs with the nodes they run on, one line per job
+    "qstat": [ "qstat", "-a", "-1", "-n" ],
+    # All attributes of all jobs, one line per attribute
+    "qstat_full": [ "qstat", "-f", "-1" ],
+    "qnodes": [ "qnodes" ],
+    "diagnose": [ "diagnose", "-f" ],
+}
+
+# The sources which change once a job is submitted or deleted
+job_sources = [ "qstat", "qstat_full" ]
+
+# Default time in seconds for which a snapshot is used
+default_ttl = 30
+
+class SnapshotError(Exception):
+    """
+    Exception thrown when the command of a source fails
+    """
+    def __init__(self,message):
+        super(SnapshotError, self).__init__(message)
+
+def default_cachedir():
+    """
+    Return the directory in which the snapshots are kept. This is
+    the environment variable QSNAPSHOT_DIR if set or a directory
+    of the user below the temporary directory of the host otherwise.
+
+    The snapshots are kept on the local disk of each host on purpose,
+    since a home shared over the network would mix up the queue states
+    seen on different hosts and file locks are not reliable there.
+    """
+    cachedir = os.environ.get("QSNAPSHOT_DIR")
+    if cachedir:
+        return cachedir
+    return os.path.join(tempfile.gettempdir(), "qsnapshot-" + str(os.getuid()))
+
+def default_ttl_from_env():
+    """
+    Return the ttl from the environment variable QSNAPSHOT_TTL or default_ttl
+    """
+    try:
+        return float(os.environ["QSNAPSHOT_TTL"])
+    except (KeyError, ValueError):
+        return default_ttl
+
+def filter_jobs_by_user(output, user):
+    """
+    Remove the lines of all jobs, which do not belong to user,
+    from the output of the "qstat" source, i.e. the table printed
+    by qstat -a. The header is kept.
+    """
+    ret = []
+    for line in output.splitlines(True):
+        fields = line.split()
+        if len(fields) >= 2 and fields[0][0].isdigit() and fields[1] != user:
+            continue
+        ret.append(line)
+    return "".join(ret)
+
+class queue_snapshot:
+    """
+    Cache for the output of the commands in sources, which query
+    the queue state from the PBS server and the scheduler.
+
+    The output of each source is kept in a file, which is shared
+    by all processes using the same cache directory (e.g. all
+    qinvestigate shells and tab completions of a user on a host)
+    and used as long as it is younger than the ttl. If the
+    snapshot is too old, only one process runs the command, while
+    the others wait for it and then use its result.
+
+    If the cache directory cannot be used, the commands are run
+    each time.
+    """
+
+    def __init__(self, cachedir=None, ttl=None):
+        self.__cachedir = cachedir if cachedir is not None else default_cachedir()
+        self.__ttl = ttl if ttl is not None else default_ttl_from_env()
+        self.__usable = None # Is the cache directory usable
+
+    @property
+    def cachedir(self):
+        """The directory the snapshots are kept in"""
+        return self.__cachedir
+
+    @property
+    def ttl(self):
+        """The number of seconds for which a snapshot is used"""
+        return self.__ttl
+
+    def __check_cachedir(self):
+        """
+        Create the cache directory if needed and return whether it can be used.
+        Only a directory owned by the user is used, unless it was explicitly
+        configured by QSNAPSHOT_DIR (e.g. to share snapshots within a group).
+        """
+        if self.__usable is not None:
+            return self.__usable
+
+        try:
+            os.makedirs(self.__cachedir, mode=0o700, exist_ok=True)
+            st = os.stat(self.__cachedir)
+            self.__usable = os.access(self.__cachedir, os.W_OK) and \
+                (st.st_uid == os.getuid() or "QSNAPSHOT_DIR" in os.environ)
+        except OSError:
+            self.__usable = False
+        return self.__usable
+
+    def __path(self, source):
+        return os.path.join(self.__cachedir, source)
+
+    def cachefile(self, name):
+        """
+        Return the path of a file in the cache directory, in which other
+        data derived from the queue state may be cached, or None if the
+        cache directory cannot be used.
+        """
+        if not self.__check_cachedir():
+            return None
+        return os.path.join(self.__cachedir, name)
+
+    def age(self, source):
+        """
+        Return the age of the snapshot of source in seconds
+        or None if there is none.
+        """
+        try:
+            return time.time() - os.path.getmtime(self.__path(source))
+        except OSError:
+            return None
+
+    def __read_if_fresh(self, source, max_age):
+        age = self.age(source)
+        if age is None or age > max_age:
+            return None
+        try:
+            with open(self.__path(source)) as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def fetch(self, source):
+        """
+        Run the command of source and return its output without
+        using or updating the snapshot.
+
+        Raises a SnapshotError if the command fails.
+        """
+        import subprocess
+
+        argv = sources[source]
+        try:
+            proc = subprocess.run(argv, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  universal_newlines=True)
+        except OSError as e:
+            raise SnapshotError("Could not run " + argv[0] + ": " + str(e))
+        if proc.returncode != 0:
+            raise SnapshotError(" ".join(argv) + " failed with return code "
+                                + str(proc.returncode) + ": " + proc.stderr.strip())
+        if source == "diagnose":
+            self.__record_fairshare(proc.stdout)
+        return proc.stdout
+
+    def __record_fairshare(self, output):
+        """
+        Remember the fairshare each time it is queried from the scheduler,
+        such that its trend can be shown without querying it again.
+        """
+        from queuing_system import fairshare_history
+        try:
+            fairshare_history.record_diagnose(output)
+        except OSError:
+            # The history is only an add-on
+            pass
+
+    def get(self, source, max_age=None):
+        """
+        Return the output of the command of source from a snapshot
+        not older than max_age seconds (Default: the ttl). If there
+        is none, the command is run and a new snapshot is taken.
+
+        Raises a SnapshotError if the command fails.
+        """
+        if not source in sources:
+            raise KeyError("Unknown source: " + source)
+        if max_age is None:
+            max_age = self.__ttl
+
+        if not self.__check_cachedir():
+            return self.fetch(source)
+
+        output = self.__read_if_fresh(source, max_age)
+        if output is not None:
+            return output
+
+        path = self.__path(source)
+        with open(path + ".lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Another process might have taken the snapshot
+                # while we were waiting for the lock.
+                output = self.__read_if_fresh(source, max_age)
+                if output is not None:
+                    return output
+
+                output = self.fetch(source)
+                tmpfile = path + "." + str(os.getpid()) + ".tmp"
+                with open(tmpfile, "w") as f:
+                    f.write(output)
+                os.replace(tmpfile, path)
+                return output
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def invalidate(self, which=None):
+        """
+        Drop the snapshots of the sources in which (Default: all),
+        such that they are taken afresh when needed next.
+        """
+        for source in (which if which is not None else sources):
+            try:
+                os.remove(self.__path(source))
+            except OSError:
+                pass
+
+def invalidate(which=None):
+    """
+    Drop the snapshots of the sources in which (Default: all)
+    from the default cache directory, e.g. after a job was submitted.
+    """
+    queue_snapshot().invalidate(which)
+
+if __name__ == "__main__":
+    import stat
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bindir = os.path.join(tmpdir, "bin")
+        os.makedirs(bindir)
+        qstat = os.path.join(bindir, "qstat")
+        counter = os.path.join(tmpdir, "counter")
+        with open(qstat, "w") as f:
+            f.write("#!/bin/sh\necho x >> " + counter + "\n"
+                    + "echo 'Job ID  Username Queue'\n"
+                    + "echo '12.srv  alice    batch'\n"
+                    + "echo '13.srv  bob      batch'\n")
+        os.chmod(qstat, stat.S_IRWXU)
+        with open(os.path.join(bindir, "qnodes"), "w") as f:
+            f.write("#!/bin/sh\necho broken >&2\nexit 3\n")
+        os.chmod(os.path.join(bindir, "qnodes"), stat.S_IRWXU)
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+
+        def n_calls():
+            with open(counter) as f:
+                return len(f.readlines())
+
+        snap = queue_snapshot(os.path.join(tmpdir, "cache"), ttl=60)
+        first = snap.get("qstat")
+        if snap.get("qstat") != first or n_calls() != 1:
+            raise SystemExit("queue_snapshot did not use the snapshot")
+        if queue_snapshot(os.path.join(tmpdir, "cache"), ttl=60).get("qstat") != first \
+                or n_calls() != 1:
+            raise SystemExit("queue_snapshot did not share the snapshot")
+
+        snap.get("qstat", max_age=0)
+        if n_calls() != 2:
+            raise SystemExit("queue_snapshot did not respect max_age")
+        snap.invalidate(job_sources)
+        snap.get("qstat")
+        if n_calls() != 3:
+            raise SystemExit("queue_snapshot.invalidate failed")
+
+        if filter_jobs_by_user(first, "bob") != "Job ID  Username Queue\n13.srv  bob      batch\n":
+            raise SystemExit("filter_jobs_by_user failed")
+
+        try:
+            snap.get("qnodes")
+            raise SystemExit("queue_snapshot did not raise on a failing command")
+        except SnapshotError:
+            pass
+        if snap.age("qnodes") is not None:
+            raise SystemExit("queue_snapshot kept the output of a failing command")
+
+    print("Unit Test passed")
@@ -18,7 +18,9 @@
 
 from abc import ABCMeta, abstractmethod
 from queuing_system.queuing_system_data import queuing_system_data
-import subprocess
+import os
+import shlex
+import time
 
 class UnknownDataFieldException(Exception):
     """
@@ -26,7 +28,40 @@ class UnknownDataFieldException(Exception):
     finds an unknown field
     """
     def __init__(self,message):
-        super(UnknownDataField, self).__init__(message)
+        super(UnknownDataFieldException, self).__init__(message)
+
+class SubmissionError(Exception):
+    """
+    Exception thrown when a job could not be submitted
+    to the queuing system
+    """
+    def __init__(self,message):
+        super(SubmissionError, self).__init__(message)
+
+class submission_summary:
+    """
+    Result of submitting many jobscripts via submit_scripts
+    """
+    def __init__(self):
+        self.job_ids={} #dict: filename -> job id of all successful submissions
+        self.errors={} #dict: filename -> error message of all failed submissions
+        self.wall_time=None #float: seconds all submissions took
+
+    @property
+    def rate(self):
+        """Number of successful submissions per second"""
+        if not self.wall_time:
+            return 0.
+        return len(self.job_ids) / self.wall_time
+
+    def __str__(self):
+        ret = ("Submitted " + str(len(self.job_ids)) + " jobs in {0:.2f}s "
+                "({1:.1f} submissions per second).").format(self.wall_time or 0., self.rate)
+        if self.errors:
+            ret += "\n" + str(len(self.errors)) + " submissions failed:"
+            for filename in sorted(self.errors):
+                ret += "\n    " + filename + ": " + self.errors[filename]
+        return ret
 
 class queuing_system_base(metaclass=ABCMeta):
     @abstractmethod
@@ -69,8 +104,152 @@ class queuing_system_base(metaclass=ABCMeta):
         """
         pass
 
-    def submit_script(self,filename):
-        subprocess.check_call([ self.submit_command(), filename ])
+    def submit_script(self,filename,retries=5,backoff=1.,workdir=None):
+        """
+        Submit the jobscript filename and return the job id.
+
+        If the submission fails due to a transient error of the server
+        (see is_transient_submit_error) it is retried up to retries times,
+        waiting roughly backoff, 2*backoff, 4*backoff, ... seconds in between.
+
+        If workdir is not None, the submit_command is run in this directory
+        (and filename is relative to it), such that the job starts from there.
+
+        Raises a SubmissionError if the job could not be submitted.
+        """
+        return self._run_submit(self.submit_argv() + [ filename ],
+                                retries=retries, backoff=backoff, cwd=workdir)
+
+    def submit_scripts(self,filenames,max_parallel=4,retries=5,backoff=1.,
+                       in_script_dir=False):
+        """
+        Submit many jobscripts, at most max_parallel at the same time,
+        each of them with the retry logic of submit_script.
+        A failed submission does not stop the remaining ones.
+
+        If in_script_dir is True, each script is submitted from the
+        directory it is located in instead of the current one.
+
+        Returns a submission_summary object.
+        """
+        def submit(filename):
+            workdir = None
+            script = filename
+            if in_script_dir:
+                workdir, script = os.path.split(os.path.abspath(filename))
+            return self.submit_script(script, retries=retries, backoff=backoff,
+                                      workdir=workdir)
+        return self.__submit_many(filenames, submit, max_parallel)
+
+    def submit_script_stdin(self,script,data=None,retries=5,backoff=1.):
+        """
+        Submit a jobscript by piping its content script to the submit_command
+        on stdin, such that no file needs to be written, and return the job id.
+        If the queuing_system_data data is given, the resources are passed on
+        the commandline as well (see build_commandline_args).
+
+        Retries and errors are dealt with like in submit_script.
+        """
+        argv = self.submit_argv()
+        if data is not None:
+            argv.extend(shlex.split(self.build_commandline_args(data)))
+        return self._run_submit(argv, input=script, retries=retries, backoff=backoff)
+
+    def submit_scripts_stdin(self,scripts,max_parallel=4,retries=5,backoff=1.):
+        """
+        Submit many jobscripts via stdin like submit_script_stdin, at most
+        max_parallel at the same time. scripts is a dict from a name
+        identifying the job to a tuple (script, data).
+
+        Returns a submission_summary object, which uses the names as keys.
+        """
+        def submit(name):
+            script, data = scripts[name]
+            return self.submit_script_stdin(script, data, retries=retries, backoff=backoff)
+        return self.__submit_many(list(scripts), submit, max_parallel)
+
+    def __submit_many(self,names,submit,max_parallel):
+        """
+        Run submit(name) for all names using at most max_parallel threads
+        and collect the results in a submission_summary object.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        summary = submission_summary()
+        start = time.perf_counter()
+
+        def run(name):
+            try:
+                return name, submit(name), None
+            except SubmissionError as e:
+                return name, None, e.args[0]
+
+        with ThreadPoolExecutor(max_workers=max(1, max_parallel)) as executor:
+            for name, job_id, error in executor.map(run, names):
+                if error is None:
+                    summary.job_ids[name] = job_id
+                else:
+                    summary.errors[name] = error
+
+        summary.wall_time = time.perf_counter() - start
+        return summary
+
+    def _run_submit(self,argv,input=None,retries=5,backoff=1.,cwd=None):
+        """
+        Run the submission command argv (with input on stdin) in the directory
+        cwd and return the job id, retrying with exponential backoff on
+        transient errors.
+        """
+        # Only needed for submission, so keep them out of the startup
+        import random
+        import subprocess
+
+        for attempt in range(retries+1):
+            try:
+                proc = subprocess.run(argv, input=input, stdout=subprocess.PIPE,
+                                      stderr=subprocess.PIPE, universal_newlines=True,
+                                      cwd=cwd)
+            except OSError as e:
+                raise SubmissionError("Could not run " + argv[0] + ": " + str(e))
+
+            if proc.returncode == 0:
+                # The snapshots of the queue state are outdated now
+                from queuing_system import queue_snapshot
+                queue_snapshot.invalidate(queue_snapshot.job_sources)
+                return self.parse_job_id(proc.stdout)
+
+            stderr = proc.stderr.strip()
+            if attempt < retries and self.is_transient_submit_error(proc.returncode, stderr):
+                # Add some jitter, such that parallel submissions
+                # do not hit the server at the very same time again.
+                time.sleep(backoff * 2**attempt * random.uniform(0.75, 1.25))
+                continue
+
+            raise SubmissionError(argv[0] + " failed with return code "
+                    + str(proc.returncode) + ": " + stderr)
+
+    def submit_argv(self):
+        """
+        Return the list of the submit_command and the arguments
+        it is always invoked with in order to submit a job
+        """
+        return [ self.submit_command() ]
+
+    def parse_job_id(self,output):
+        """
+        Extract the job id from the output of the submit_command
+        """
+        return output.strip()
+
+    def is_transient_submit_error(self,returncode,stderr):
+        """
+        return True if a failed submission with the given returncode and
+        error output is due to a transient problem of the queuing system
+        server, i.e. if it makes sense to retry the submission later.
+        This must only be the case if the server certainly did not accept
+        the job, since otherwise it would be submitted twice.
+        """
+        return False
 
 
     @abstractmethod
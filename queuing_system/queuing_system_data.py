@@ -35,7 +35,6 @@ class send_email_on:
             self.__begin = None
             return 
 
-        print(type(val))
         if (type(val) != bool):
             raise TypeError("begin is a bool or None")
         self.__begin = val
@@ -110,6 +109,8 @@ class queuing_system_data:
         self.send_email_on=send_email_on()
         self.priority=None #int: between -1024 and +1023
         self.extra_resources={}  # Extra resources as a dict name: value
+        self.extra_options=[] #list of list of str: further options passed to the queuing system as they are
+        self.array=None #str: index range of a job array (e.g. "0-99"), None if no job array
 
     def no_procs(self):
         """Return the total number of processors on all nodes"""
@@ -29,6 +29,7 @@ class queuing_system_environment:
         self.path=None #str; shell environment var giving the content of the original PATH variable
         self.home=None #str; shell environment var giving the content of the original HOME variable
         self.nodes=None #str; shell environment var giving the nodes on which this job is executed
+        self.array_index=None #str; shell environment var giving the index of this job inside a job array
 #TODO properties
 
 
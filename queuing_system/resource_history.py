@@ -0,0 +1,445 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to learn the resources jobs need from the ones they used in the past
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+import shared_config_lib as conf
+import functools
+import json
+import math
+import os
+import re
+import time
+
+def default_historyfile(program):
+    """
+    Return the default file in which the resource history of
+    the jobs of a program is kept
+    """
+    return os.path.join(conf.default_configdir(), program + "_resource_history.json")
+
+def _parse_time(string):
+    """Parse [[hours:]minutes:]seconds[.fraction] into seconds"""
+    seconds = 0.
+    for part in string.split(":"):
+        seconds = 60*seconds + float(part)
+    return seconds
+
+def _parse_kb(string):
+    """Parse a PBS size like 1234kb into bytes"""
+    match = re.match(r"^([0-9]+)([kmgt]?)b$", string.strip().lower())
+    if match is None:
+        raise ValueError("Invalid size: " + string)
+    return int(match.group(1)) * 1024**" kmgt".index(match.group(2) or " ")
+
+def parse_job_output(f):
+    """
+    Extract the resources a job used from the file object f of its
+    output, i.e. the statistics of /usr/bin/time -v (see the --perf flag
+    of the send scripts) and the resources_used of PBS (as printed by
+    qstat -f or the epilogue). If the output contains several of them,
+    the maximum is taken.
+
+    Returns a dict with the keys "walltime" (seconds) and "memory"
+    (bytes), the values are None if nothing was found.
+    """
+    walltime = memory = None
+
+    def maximum(old, new):
+        return new if old is None else max(old, new)
+
+    for line in f:
+        line = line.strip()
+        try:
+            if line.startswith("Elapsed (wall clock) time"):
+                walltime = maximum(walltime, _parse_time(line.rsplit(" ", 1)[1]))
+            elif line.startswith("Maximum resident set size (kbytes):"):
+                memory = maximum(memory, 1024 * int(line.rsplit(" ", 1)[1]))
+            elif line.startswith("resources_used.walltime"):
+                walltime = maximum(walltime, _parse_time(line.split("=", 1)[1]))
+            elif line.startswith("resources_used.mem"):
+                memory = maximum(memory, _parse_kb(line.split("=", 1)[1]))
+            elif line.startswith("Resources Used:"):
+                # Epilogue output: Resources Used: cput=...,mem=...kb,vmem=...,walltime=...
+                for item in line[len("Resources Used:"):].split(","):
+                    key, sep, value = item.strip().partition("=")
+                    if key == "walltime":
+                        walltime = maximum(walltime, _parse_time(value))
+                    elif key == "mem":
+                        memory = maximum(memory, _parse_kb(value))
+        except (ValueError, IndexError):
+            continue
+
+    if walltime is not None:
+        walltime = int(math.ceil(walltime))
+    return { "walltime": walltime, "memory": memory }
+
+def _least_squares(xs, ys, ridge=1e-6):
+    """
+    Fit ys by a linear function of the feature vectors xs and return the
+    coefficients. A small ridge term keeps the normal equations solvable
+    if some feature does not vary.
+    """
+    n = len(xs[0])
+    a = [ [ sum(x[i]*x[j] for x in xs) + (ridge if i == j else 0.) for j in range(n) ]
+          + [ sum(x[i]*y for x, y in zip(xs, ys)) ] for i in range(n) ]
+
+    # Gaussian elimination with partial pivoting
+    for col in range(n):
+        pivot = max(range(col, n), key=lambda r: abs(a[r][col]))
+        a[col], a[pivot] = a[pivot], a[col]
+        for r in range(col+1, n):
+            fac = a[r][col] / a[col][col]
+            for c in range(col, n+1):
+                a[r][c] -= fac * a[col][c]
+
+    coeff = [0.] * n
+    for r in reversed(range(n)):
+        coeff[r] = (a[r][n] - sum(a[r][c]*coeff[c] for c in range(r+1, n))) / a[r][r]
+    return coeff
+
+class resource_prediction:
+    """
+    Resources predicted for a job from the resource history
+    """
+    def __init__(self):
+        self.walltime=None #int: predicted walltime including the margin in seconds or None
+        self.memory=None #int: predicted memory including the margin in bytes or None
+        self.n_samples=0 #int: number of past jobs the prediction is based on
+
+    def __str__(self):
+        ret = []
+        if self.walltime is not None:
+            ret.append("walltime {0}:{1:02d}:{2:02d}".format(self.walltime // 3600,
+                       (self.walltime // 60) % 60, self.walltime % 60))
+        if self.memory is not None:
+            ret.append("memory " + str(self.memory // (1024*1024)) + "mb")
+        return " and ".join(ret) + " (from " + str(self.n_samples) + " similar jobs)"
+
+class resource_history:
+    """
+    History of the resources, which the jobs of a program used, together
+    with features describing each job (see add_pending).
+
+    When a jobscript is built, its features are remembered as pending
+    with the directory and the name of the job. collect later reads
+    the resources actually used from the output files of the jobs
+    (jobname.o<id> and jobname.e<id>, or jobname.o<id>-<index> for
+    the elements of a job array) and turns them into records, from
+    which predict estimates the resources of new jobs.
+
+    The history is kept in a json file.
+    """
+
+    def __init__(self, program, historyfile=None, max_records=5000,
+                 max_pending_age=30*86400, max_output_size=16*1024*1024):
+        self.__historyfile = historyfile if historyfile is not None \
+                else default_historyfile(program)
+        self.__max_records = max_records
+        self.__max_pending_age = max_pending_age
+        self.__max_output_size = max_output_size
+        self.__records = [] # list of dicts with "features", "walltime" and "memory"
+        self.__pending = {} # "directory/jobname[index]" -> dict with "features" and "time"
+        self.__collected = None # time of the last collect
+        self.__changed = False
+        self.__load()
+
+    def __load(self):
+        try:
+            with open(self.__historyfile) as f:
+                history = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.__records = history.get("records", [])
+        self.__pending = history.get("pending", {})
+        self.__collected = history.get("collected")
+
+    @property
+    def records(self):
+        """The list of records of finished jobs"""
+        return self.__records
+
+    @property
+    def collected(self):
+        """The time of the last collect or None"""
+        return self.__collected
+
+    @property
+    def n_pending(self):
+        """The number of jobs whose resources have not been collected yet"""
+        return len(self.__pending)
+
+    def save(self):
+        """
+        Write the history to its file if it has changed
+        """
+        if not self.__changed:
+            return
+
+        directory = os.path.dirname(self.__historyfile)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # Write to a temporary file first, such that concurrent
+        # readers never see an incomplete history
+        tmpfile = self.__historyfile + "." + str(os.getpid()) + ".tmp"
+        with open(tmpfile, "w") as f:
+            json.dump({ "records": self.__records, "pending": self.__pending,
+                        "collected": self.__collected }, f)
+        os.replace(tmpfile, self.__historyfile)
+        self.__changed = False
+
+    def add_pending(self, directory, job_name, features, array_index=None, member=None):
+        """
+        Remember the features of the job job_name, which is run from
+        directory, until its resources can be collected.
+
+        features is a dict with the key "group" (list of strings, only
+        jobs with the same group are compared) and the numeric keys
+        "atoms" and "threads" (positive numbers the resources
+        depend on).
+
+        If the job is the element array_index of the job array job_name,
+        only the output of this element is considered. If the job is the
+        member-th of several jobs sharing the scheduler job job_name (e.g.
+        when packed), only its walltime is recorded, since it ran at most
+        as long as the scheduler job, whereas the memory reported is the
+        one of all jobs together.
+        """
+        key = os.path.join(os.path.abspath(directory), job_name)
+        if array_index is not None:
+            key += "[" + str(array_index) + "]"
+        if member is not None:
+            key += "#" + str(member)
+        self.__pending[key] = { "features": features, "time": time.time(),
+                                "directory": os.path.abspath(directory), "job_name": job_name,
+                                "array_index": array_index, "shared": member is not None }
+        self.__changed = True
+
+    def forget_pending(self):
+        """
+        Forget all pending jobs
+        """
+        if self.__pending:
+            self.__pending = {}
+            self.__changed = True
+
+    def collect(self):
+        """
+        Look for the output files of the pending jobs and add the resources
+        they used as records. Pending jobs, which did not produce output for
+        too long, are forgotten.
+
+        Returns the number of new records.
+        """
+        n_new = 0
+        listings = {}
+        now = time.time()
+        self.__collected = now
+        self.__changed = True
+        for key in list(self.__pending):
+            entry = self.__pending[key]
+            directory = entry.get("directory")
+            job_name = entry.get("job_name")
+            if directory is None or job_name is None:
+                directory, job_name = os.path.split(key)
+            if directory not in listings:
+                try:
+                    listings[directory] = os.listdir(directory)
+                except OSError:
+                    listings[directory] = []
+
+            # The output files the scheduler writes, e.g. job.o1234 or job.e1234-5,
+            # but not job.out, which is the output of the program itself
+            index = entry.get("array_index")
+            pattern = re.compile(re.escape(job_name) + r"\.[oe][0-9]+"
+                                 + ("" if index is None else "-" + str(index)) + "$")
+
+            usage = { "walltime": None, "memory": None }
+            for filename in listings[directory]:
+                if not pattern.match(filename):
+                    continue
+                path = os.path.join(directory, filename)
+                try:
+                    stat = os.stat(path)
+                    if stat.st_mtime < entry["time"]:
+                        continue # output of an earlier run
+                    if stat.st_size > self.__max_output_size:
+                        continue # too large for the statistics of a job
+                    with open(path, errors="replace") as f:
+                        used = parse_job_output(f)
+                except OSError:
+                    continue
+                for k in usage:
+                    if used[k] is not None:
+                        usage[k] = max(usage[k] or 0, used[k])
+            if entry.get("shared"):
+                usage["memory"] = None
+
+            if usage["walltime"] is not None or usage["memory"] is not None:
+                record = { "features": entry["features"] }
+                record.update(usage)
+                self.__records.append(record)
+                del self.__pending[key]
+                n_new += 1
+            elif now - entry["time"] > self.__max_pending_age:
+                del self.__pending[key]
+            else:
+                continue
+            self.__changed = True
+
+        del self.__records[:-self.__max_records]
+        return n_new
+
+    def predict(self, features, margin=2., min_samples=5):
+        """
+        Predict the resources of a job with the given features
+        (see add_pending) from the records of the same group.
+
+        The logarithm of the walltime and the memory is fitted linearly in
+        the logarithm of the numeric features. The margin is the number of
+        standard deviations of the residuals added on top of the fit (on
+        the logarithmic scale), such that e.g. a margin of 2 is enough for
+        about 97% of similar jobs.
+
+        Returns a resource_prediction or None if less than min_samples
+        records are available.
+        """
+        records = [ r for r in self.__records
+                    if r["features"].get("group") == features.get("group") ]
+        if len(records) < min_samples:
+            return None
+
+        keys = [ "atoms", "threads" ]
+        def x_of(feat):
+            return [ 1. ] + [ math.log(max(1., feat.get(k) or 1.)) for k in keys ]
+
+        ret = resource_prediction()
+        for kind in [ "walltime", "memory" ]:
+            samples = [ (x_of(r["features"]), math.log(max(1, r[kind])))
+                        for r in records if r.get(kind) ]
+            if len(samples) < min_samples:
+                continue
+
+            xs = [ s[0] for s in samples ]
+            ys = [ s[1] for s in samples ]
+            coeff = _least_squares(xs, ys)
+            residuals = [ y - sum(c*xi for c, xi in zip(coeff, x)) for x, y in samples ]
+            dof = max(1, len(samples) - len(coeff))
+            sigma = math.sqrt(sum(r*r for r in residuals) / dof)
+
+            value = math.exp(sum(c*xi for c, xi in zip(coeff, x_of(features))) + margin*sigma)
+            if kind == "walltime":
+                # Round up to full minutes
+                ret.walltime = 60 * int(math.ceil(value / 60.))
+            else:
+                # Round up to full megabytes
+                ret.memory = 1024*1024 * int(math.ceil(value / (1024*1024)))
+            ret.n_samples = max(ret.n_samples, len(samples))
+
+        if ret.walltime is None and ret.memory is None:
+            return None
+        return ret
+
+@functools.lru_cache(maxsize=None)
+def load(program, historyfile=None, collect_interval=3600):
+    """
+    Return the resource_history of the program. The output of finished
+    jobs is only collected if this was last done more than collect_interval
+    seconds ago, such that starting a send script usually only reads the
+    history (qchem_resource_history always collects). The result is cached,
+    such that the history is only read once per process, even if many jobs
+    are built.
+    """
+    history = resource_history(program, historyfile)
+    if history.collected is None or time.time() - history.collected > collect_interval:
+        history.collect()
+    return history
+
+if __name__ == "__main__":
+    import io
+    import tempfile
+
+    output  = "Thank you very much for using Q-Chem.  Have a nice day.\n"
+    output += "\tElapsed (wall clock) time (h:mm:ss or m:ss): 1:02:03.50\n"
+    output += "\tMaximum resident set size (kbytes): 2048\n"
+    output += "resources_used.mem = 1mb\n"
+    output += "Resources Used: cput=00:00:10,mem=4000kb,vmem=9000kb,walltime=00:10:00\n"
+    if parse_job_output(io.StringIO(output)) != { "walltime": 3724, "memory": 4000*1024 }:
+        raise SystemExit("parse_job_output failed")
+    if parse_job_output(io.StringIO("nothing\n")) != { "walltime": None, "memory": None }:
+        raise SystemExit("parse_job_output found something in nothing")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        historyfile = os.path.join(tmpdir, "history.json")
+        history = resource_history("test", historyfile)
+
+        # Jobs whose walltime grows quadratically with the number of atoms
+        # and whose memory is constant with a little noise
+        for i, atoms in enumerate([ 2, 4, 8, 16, 32, 64 ]):
+            name = "job" + str(i)
+            history.add_pending(tmpdir, name, { "group": [ "hf", "sto-3g" ],
+                                                "atoms": atoms, "threads": 1 })
+            with open(os.path.join(tmpdir, name + ".o" + str(100+i)), "w") as f:
+                f.write("Elapsed (wall clock) time (h:mm:ss or m:ss): "
+                        + str(atoms*atoms) + ":00\n")
+                f.write("Maximum resident set size (kbytes): "
+                        + str(1024*(1000 + 10*(i % 2))) + "\n")
+        history.add_pending(tmpdir, "running", { "group": [ "hf", "sto-3g" ],
+                                                 "atoms": 1, "threads": 1 })
+
+        # The output of the program is no output of the scheduler
+        other = { "group": [ "other" ], "atoms": 1, "threads": 1 }
+        history.add_pending(tmpdir, "water", other)
+        with open(os.path.join(tmpdir, "water.out"), "w") as f:
+            f.write("Elapsed (wall clock) time (h:mm:ss or m:ss): 1:00\n")
+
+        # Elements of a job array and jobs packed into a single job
+        history.add_pending(tmpdir, "array", other, array_index=1)
+        for i in range(2):
+            with open(os.path.join(tmpdir, "array.o7-" + str(i)), "w") as f:
+                f.write("resources_used.walltime = 0" + str(i+1) + ":00:00\n")
+        for i in range(2):
+            history.add_pending(tmpdir, "water_pack", other, member=i)
+        with open(os.path.join(tmpdir, "water_pack.o8"), "w") as f:
+            f.write("Resources Used: cput=00:00:10,mem=4000kb,walltime=00:10:00\n")
+
+        if history.collect() != 9 or history.n_pending != 2:
+            raise SystemExit("resource_history.collect failed")
+        if [ (r["walltime"], r["memory"]) for r in history.records[6:] ] \
+                != [ (7200, None), (600, None), (600, None) ]:
+            raise SystemExit("resource_history.collect did not collect arrays and packs")
+        history.save()
+
+        history = resource_history("test", historyfile)
+        if len(history.records) != 9 or history.collected is None:
+            raise SystemExit("resource_history was not saved")
+
+        pred = history.predict({ "group": [ "hf", "sto-3g" ], "atoms": 10, "threads": 1 },
+                               margin=0.)
+        if pred is None or abs(pred.walltime - 100*60) > 60:
+            raise SystemExit("resource_history.predict of the walltime failed")
+        if not (1000*1024**2 <= pred.memory <= 1011*1024**2):
+            raise SystemExit("resource_history.predict of the memory failed")
+
+        margin = history.predict({ "group": [ "hf", "sto-3g" ], "atoms": 10, "threads": 1 })
+        if margin.memory <= pred.memory:
+            raise SystemExit("resource_history.predict does not add a margin")
+
+        if history.predict({ "group": [ "mp2", "sto-3g" ], "atoms": 10, "threads": 1 }) is not None:
+            raise SystemExit("resource_history.predict used a different group")
+
+    print("Unit Test passed")
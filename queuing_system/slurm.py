@@ -0,0 +1,738 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Python class to interact with a Slurm queuing system
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+from queuing_system.queuing_system_base import queuing_system_base
+from queuing_system.queuing_system_base import UnknownDataFieldException
+from queuing_system import queuing_system_data as qd
+from queuing_system import queuing_system_environment as qe
+import re
+import shlex
+
+class slurm_time:
+    def __init__(self,time):
+        """
+        initialise a slurm_time object either from the number of seconds
+        or a slurm time string of one of the forms
+
+        minutes
+        minutes:seconds
+        hours:minutes:seconds
+        days-hours
+        days-hours:minutes
+        days-hours:minutes:seconds
+        """
+        if isinstance(time,int):
+            self.__seconds = time
+            return
+
+        if isinstance(time,str):
+            days, sep, timestr = time.rpartition("-")
+            try:
+                li = [ int(v) for v in timestr.split(":") ]
+                if sep:
+                    # days-hours[:minutes[:seconds]]
+                    if len(li) > 3:
+                        raise ValueError
+                    li += [0] * (3 - len(li))
+                    self.__seconds = 86400*int(days) + 3600*li[0] + 60*li[1] + li[2]
+                elif len(li) == 1:
+                    self.__seconds = 60*li[0]
+                elif len(li) == 2:
+                    self.__seconds = 60*li[0] + li[1]
+                elif len(li) == 3:
+                    self.__seconds = 3600*li[0] + 60*li[1] + li[2]
+                else:
+                    raise ValueError
+            except ValueError:
+                raise ValueError("Invalid time string: " + time)
+            return
+
+        raise TypeError("Cannot parse type " + str(type(time)))
+
+    @property
+    def seconds(self):
+        """return number of seconds represented by this object"""
+        return self.__seconds
+
+    def __str__(self):
+        """return the time as a string understood by slurm"""
+        days, rest = divmod(self.__seconds, 86400)
+        ret = "{0}:{1:02d}:{2:02d}".format(rest // 3600, (rest // 60) % 60, rest % 60)
+        if days > 0:
+            ret = str(days) + "-" + ret
+        return ret
+
+class slurm_size:
+    # Units understood by slurm, the default is megabytes
+    units = { "k": 1024, "m": 1024**2, "g": 1024**3, "t": 1024**4 }
+
+    def __init__(self,size):
+        """
+        initialise a slurm_size object either from the number of bytes
+        or a slurm size string of the form
+
+        integer[suffix]
+
+        where suffix is one of K, M, G or T for kilo-, mega-, giga- or
+        terabytes (powers of 1024). If no suffix is given, the size is
+        in megabytes.
+        """
+        if isinstance(size,int):
+            self.__bytes = size
+            return
+
+        if isinstance(size,str):
+            match = re.match("^([0-9]+)([a-zA-Z]?)$",size)
+            if match is None:
+                raise ValueError("Invalid size string: " + size)
+
+            unit = match.group(2).lower() or "m"
+            if unit not in self.units:
+                raise ValueError("Unknown size unit: " + size)
+            self.__bytes = int(match.group(1)) * self.units[unit]
+            return
+
+        raise TypeError("Cannot parse type " + str(type(size)))
+
+    @property
+    def bytes(self):
+        """return number of bytes represented by this object"""
+        return self.__bytes
+
+    def __str__(self):
+        """
+        return the size as a string understood by slurm, rounded
+        up to the next kilobyte if necessary
+        """
+        for unit in [ "t", "g", "m" ]:
+            if self.__bytes > 0 and self.__bytes % self.units[unit] == 0:
+                return str(self.__bytes // self.units[unit]) + unit.upper()
+        return str(-(-self.__bytes // 1024)) + "K"
+
+
+class slurm(queuing_system_base):
+    """class to manage the queue of a slurm queuing system"""
+    # Slurm documentation manpages:
+    #    sbatch
+    # and https://slurm.schedmd.com/heterogeneous_jobs.html
+
+    def name(self):
+        return "Slurm"
+
+    # Short options of sbatch and the long options they stand for
+    short_options = { "-J": "--job-name", "-t": "--time", "-p": "--partition",
+                      "-M": "--clusters", "-N": "--nodes", "-n": "--ntasks",
+                      "-c": "--cpus-per-task", "-C": "--constraint", "-a": "--array",
+                      "-o": "--output", "-e": "--error", "-A": "--account",
+                      "-q": "--qos" }
+
+    # Options of sbatch which are mapped to the queuing_system_data.
+    # All of them take an argument.
+    data_options = [ "--job-name", "--time", "--partition", "--clusters",
+                     "--output", "--error", "--mail-user", "--mail-type",
+                     "--nice", "--array", "--nodes", "--ntasks",
+                     "--ntasks-per-node", "--cpus-per-task", "--constraint",
+                     "--mem", "--mem-per-cpu" ]
+
+    # Options of sbatch which only apply to a component of a heterogeneous job
+    component_options = [ "--nodes", "--ntasks", "--ntasks-per-node",
+                          "--cpus-per-task", "--constraint", "--mem",
+                          "--mem-per-cpu" ]
+
+    # Options of sbatch which are stored verbatim in the extra_resources
+    # of the queuing_system_data, mapped to whether they take an argument.
+    extra_options = { "--account": True, "--qos": True, "--reservation": True,
+                      "--gres": True, "--licenses": True, "--tmp": True,
+                      "--exclusive": False }
+
+    # Output files named like the ones of PBS, i.e. jobname.oJOBID
+    stdout_file = "%x.o%j"
+    stderr_file = "%x.e%j"
+
+    def __split_args(self, args, keep_unknown=False):
+        """Split a list of sbatch arguments into the components of
+           a heterogeneous job (separated by ":" on the commandline or
+           by "hetjob" in the script header) and return a list which
+           contains the list of (option, value) pairs of each component.
+           Short options are replaced by their long form and the value
+           of options without argument is None.
+
+           Raises UnknownDataFieldException for options, which are neither
+           in data_options nor in extra_options, and ValueError if an
+           argument is missing. If keep_unknown is True, such options are
+           returned with the list of their arguments as the value instead.
+        """
+        components = [ [] ]
+        i = 0
+        while i < len(args):
+            arg = args[i]
+            i += 1
+            if arg in [ ":", "hetjob", "packjob" ]:
+                components.append([])
+                continue
+
+            value = None
+            if arg[:2] in self.short_options and not arg.startswith("--"):
+                option = self.short_options[arg[:2]]
+                if len(arg) > 2:
+                    value = arg[2:]
+            else:
+                option, eq, value = arg.partition("=")
+                if not eq:
+                    value = None
+
+            if option == "--nice" and value is None:
+                # The argument of --nice is optional
+                value = "100"
+            elif option in self.extra_options and not self.extra_options[option]:
+                if value is not None:
+                    raise ValueError("The option " + option + " takes no argument.")
+            elif option in self.data_options or option in self.extra_options:
+                if value is None:
+                    if i >= len(args):
+                        raise ValueError("The option " + option + " requires an argument.")
+                    value = args[i]
+                    i += 1
+            elif keep_unknown and arg.startswith("-"):
+                # Options without "=" take the next argument unless it is an option
+                value = [ arg ]
+                if (arg.startswith("--") and not eq or len(arg) == 2) and i < len(args) \
+                        and not args[i].startswith("-") \
+                        and not args[i] in [ ":", "hetjob", "packjob" ]:
+                    value.append(args[i])
+                    i += 1
+            else:
+                raise UnknownDataFieldException("Unknown or unsupported sbatch "
+                                                "argument: " + arg)
+            components[-1].append((option, value))
+        return components
+
+    def __parse_int(self, option, value):
+        try:
+            ret = int(value)
+        except ValueError:
+            raise ValueError("Invalid value for " + option + ": " + value)
+        if ret < 1:
+            raise ValueError("Invalid value for " + option + ": " + value)
+        return ret
+
+    def __parse_components(self, components):
+        """Build a queuing_system_data object from the list of components
+           returned by __split_args. Each component, which requests any
+           resources, results in a node type.
+        """
+        data = qd.queuing_system_data()
+        has_output = has_error = False
+        memory = None
+
+        for component in components:
+            res = {}
+            for option, value in component:
+                if option in self.component_options:
+                    res[option] = value
+                elif option in self.extra_options:
+                    data.extra_resources[option[2:]] = value if value is not None else ""
+                elif option == "--job-name":
+                    data.job_name = value
+                elif option == "--time":
+                    data.walltime = slurm_time(value).seconds
+                elif option == "--partition":
+                    if data.queue_name is None or "@" not in data.queue_name:
+                        data.queue_name = value
+                    else:
+                        data.queue_name = value + "@" + data.queue_name.split("@")[1]
+                elif option == "--clusters":
+                    data.queue_name = (data.queue_name or "").split("@")[0] + "@" + value
+                elif option == "--output":
+                    has_output = True
+                elif option == "--error":
+                    has_error = True
+                elif option == "--mail-user":
+                    data.email = value
+                elif option == "--mail-type":
+                    types = set(value.upper().split(","))
+                    if types == { "NONE" }:
+                        types = set()
+                    if "ALL" in types:
+                        types |= { "BEGIN", "END", "FAIL" }
+                    data.send_email_on.error = "FAIL" in types
+                    data.send_email_on.begin = "BEGIN" in types
+                    data.send_email_on.end = "END" in types
+                elif option == "--nice":
+                    try:
+                        data.priority = -int(value)
+                    except ValueError:
+                        raise ValueError("Invalid value for --nice: " + value)
+                elif option == "--array":
+                    data.array = value
+                elif not option in self.data_options:
+                    # Unknown option kept by __split_args
+                    data.extra_options.append(value)
+
+            if not res:
+                continue
+
+            node = qd.node_type()
+            if "--nodes" in res:
+                # For a range min-max take the minimum
+                node.count = self.__parse_int("--nodes", res["--nodes"].split("-")[0])
+            ntasks = 1
+            if "--ntasks-per-node" in res:
+                ntasks = self.__parse_int("--ntasks-per-node", res["--ntasks-per-node"])
+            elif "--ntasks" in res:
+                ntasks = -(-self.__parse_int("--ntasks", res["--ntasks"]) // node.count)
+            cpus = 1
+            if "--cpus-per-task" in res:
+                cpus = self.__parse_int("--cpus-per-task", res["--cpus-per-task"])
+            node.no_procs = ntasks * cpus
+
+            if "--constraint" in res:
+                features = res["--constraint"].split("&")
+                if "" in features:
+                    raise ValueError("Invalid constraint: " + res["--constraint"])
+                node.name = features[0]
+                node.extra_features.extend(features[1:])
+            data.add_node_type(node)
+
+            # --mem is per node, --mem-per-cpu per processor
+            if "--mem" in res:
+                memory = (memory or 0) + slurm_size(res["--mem"]).bytes * node.count
+            elif "--mem-per-cpu" in res:
+                memory = (memory or 0) + slurm_size(res["--mem-per-cpu"]).bytes \
+                        * node.count * node.no_procs
+
+        data.physical_memory = memory
+        if has_output or has_error:
+            data.merge_stdout_stderr = not has_error
+        return data
+
+    def parse_commandline_args(self, cmdline):
+        """
+        Parse a commandline string and return a queuing_system_data object.
+        The components of a heterogeneous job are separated by " : ".
+
+        No check towards consistency like is_ready_for_submission is made
+        """
+        return self.__parse_components(self.__split_args(shlex.split(cmdline)))
+
+    def build_commandline_args(self,data):
+        """
+        Build a commandline string from the data object and return it.
+        The string contains the same options as the script header and
+        can be read back by parse_commandline_args.
+        """
+        args = []
+        for line in self.build_script_header(data).splitlines():
+            directive = shlex.split(line[len("#SBATCH"):])
+            if directive == [ "hetjob" ]:
+                args.append(":")
+            else:
+                args.extend(directive)
+        return " ".join(shlex.quote(arg) for arg in args)
+
+    def parse_script_header(self,f):
+        """
+        Read a file object and extract queuing_system_data from the header
+        for the queuing system
+
+        Like sbatch the file is only read up to the first line, which is
+        neither empty nor a comment, since all #SBATCH directives after
+        it are ignored by Slurm. Directives, which are not understood,
+        are kept in the extra_options of the result.
+
+        No check towards consistency like is_ready_for_submission is made
+        """
+        args = []
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            if not line.startswith("#"):
+                break
+            if line.startswith("#SBATCH") and (len(line) == 7 or line[7].isspace()):
+                args.extend(shlex.split(line[7:], comments=True))
+        return self.__parse_components(self.__split_args(args, keep_unknown=True))
+
+    def build_script_header(self,data):
+        """
+        Build a script header for a queuing system script from the data object
+        and return the resulting strint (does not contain any shebang or so, just
+        the plain queuing system directives)
+
+        If more than one node type is requested, a heterogeneous job
+        with one component per node type is built.
+        """
+        if not isinstance(data,qd.queuing_system_data):
+            raise TypeError("data is not of type queuing_system_data")
+
+        ret = self.why_not_ready_for_submission(data)
+        if ret != "":
+            raise ValueError("data is not ready for submission: " + ret)
+
+        partition = clusters = None
+        if data.queue_name is not None:
+            partition, sep, clusters = data.queue_name.partition("@")
+
+        # Options for the job as a whole, which go into the first component
+        job = []
+        if data.job_name is not None:
+            job.append("--job-name=" + data.job_name)
+
+        # combine stderr and stdout?
+        if data.merge_stdout_stderr is not None:
+            job.append("--output=" + self.stdout_file)
+            if not data.merge_stdout_stderr:
+                job.append("--error=" + self.stderr_file)
+
+        if clusters:
+            job.append("--clusters=" + clusters)
+
+        # when and whom to send emails
+        if data.email is not None:
+            job.append("--mail-user=" + data.email)
+
+            types = []
+            if data.send_email_on.error:
+                types.append("FAIL")
+            if data.send_email_on.begin:
+                types.append("BEGIN")
+            if data.send_email_on.end:
+                types.append("END")
+            job.append("--mail-type=" + (",".join(types) or "NONE"))
+        else:
+            job.append("--mail-type=NONE")
+
+        # priority of job (a positive nice value lowers the priority). Only
+        # privileged users may raise it with a negative nice value and sbatch
+        # rejects the job otherwise, so positive priorities are dropped.
+        if data.priority is not None and data.priority < 0:
+            job.append("--nice=" + str(-data.priority))
+
+        # index range of a job array
+        if data.array is not None:
+            job.append("--array=" + data.array)
+
+        # Extra resources (as key-value pairs)
+        for k, v in data.extra_resources.items():
+            if len(v) > 0:
+                job.append("--" + k + "=" + str(v))
+            else:
+                job.append("--" + k)
+
+        # further options passed on as they are
+        for option in data.extra_options:
+            job.append(" ".join(shlex.quote(arg) for arg in option))
+
+        # Slurm has no limit for the virtual memory of a job,
+        # such that data.virtual_memory cannot be requested.
+        memory = None
+        if data.physical_memory is not None:
+            if data.no_nodes() == 1:
+                memory = "--mem=" + str(slurm_size(data.physical_memory))
+            else:
+                memory = "--mem-per-cpu=" + str(slurm_size(-(-data.physical_memory
+                                                               // data.no_procs())))
+
+        # One component per node type. The walltime and the partition
+        # are repeated for each of them, since they may differ in general.
+        components = []
+        for node_type in data.nodes:
+            component = []
+            if data.walltime is not None:
+                component.append("--time=" + str(slurm_time(data.walltime)))
+            if partition:
+                component.append("--partition=" + partition)
+            component.append("--nodes=" + str(node_type.count))
+            component.append("--ntasks-per-node=" + str(node_type.no_procs))
+            if node_type.name is not None:
+                features = [ node_type.name ] + node_type.extra_features
+                component.append("--constraint=" + "&".join(features))
+            if memory is not None:
+                component.append(memory)
+            components.append(component)
+
+        lines = [ "#SBATCH " + opt for opt in job + components[0] ]
+        for component in components[1:]:
+            lines.append("#SBATCH hetjob")
+            lines.extend("#SBATCH " + opt for opt in component)
+        return "\n".join(lines)
+
+    def submit_command(self):
+        """return the command for the queuing system with which new jobs can be started"""
+        return "sbatch"
+
+    def abort_command(self):
+        """return the command for the queuing system with which jobs can be aborted"""
+        return "scancel"
+
+    def submit_argv(self):
+        """
+        Return the list of the submit_command and the arguments
+        it is always invoked with in order to submit a job
+        """
+        return [ "sbatch", "--parsable" ]
+
+    def parse_job_id(self,output):
+        """
+        Extract the job id from the output of sbatch --parsable,
+        i.e. "jobid" or "jobid;cluster". The plain output
+        "Submitted batch job jobid" is understood as well.
+        """
+        lines = output.strip().splitlines()
+        if len(lines) == 0:
+            return ""
+        last = lines[-1].strip()
+        if last.startswith("Submitted batch job"):
+            last = last.split()[3]
+        return last.split(";")[0]
+
+    def is_transient_submit_error(self,returncode,stderr):
+        """
+        return True if a failed submission with the given returncode and
+        error output is due to a transient problem of the slurmctld
+        """
+        transient_messages = [
+            "socket timed out",
+            "unable to contact slurm controller",
+            "temporarily unable to accept job",
+            "temporarily unavailable",
+            "connection refused",
+            "zero bytes were transmitted or received",
+            "slurm_persist_conn_open",
+        ]
+        stderr = stderr.lower()
+        return any(msg in stderr for msg in transient_messages)
+
+    def why_not_ready_for_submission(self,data):
+        """
+        return "" if all fine, else return message with the error
+        """
+        if not isinstance(data,qd.queuing_system_data):
+            return "data is not of type queuing_system_data"
+
+        if (data.no_nodes()==0):
+            return "No nodes found in nodes list"
+
+        if data.array is not None and len(data.nodes) > 1:
+            return "Slurm does not support job arrays of heterogeneous jobs"
+
+        # priority of  job
+        if data.priority is not None:
+            if not (-1024 <= data.priority <= 1023):
+                return "data.priority has the wrong range (expected between -1024 and 1023)"
+
+        return ""
+
+    def get_environment(self):
+        """
+        return a queuing_system_environment object with the values set appropriately for
+        this queuing_system
+        """
+        env = qe.queuing_system_environment()
+        env.submit_host="SLURM_SUBMIT_HOST"
+        env.submit_server="SLURM_CLUSTER_NAME"
+        env.submit_queue="SLURM_JOB_PARTITION"
+        env.submit_workdir="SLURM_SUBMIT_DIR"
+        env.jobid="SLURM_JOB_ID"
+        env.jobname="SLURM_JOB_NAME"
+        env.queue="SLURM_JOB_PARTITION"
+        # sbatch propagates the environment of the submission
+        env.path="PATH"
+        env.home="HOME"
+        # One line per node, in a heterogeneous job the nodes of all
+        # components, starting with the one the script runs on
+        env.nodes="(for v in $(compgen -v SLURM_JOB_NODELIST_HET_GROUP_ " \
+                + "|| echo SLURM_JOB_NODELIST); do scontrol show hostnames \"${!v}\"; done)"
+        env.array_index="SLURM_ARRAY_TASK_ID"
+
+        return env
+
+if __name__ == "__main__":
+    import io
+
+    ##################
+    #-- slurm_time --#
+    ##################
+    for string, seconds in [ ("15", 900), ("2:30", 150), ("1:00:05", 3605),
+                             ("2-3", 183600), ("1-0:30", 88200), ("1-1:1:1", 90061) ]:
+        if slurm_time(string).seconds != seconds:
+            raise SystemExit("slurm_time from string " + string + " failed")
+    if str(slurm_time(90061)) != "1-1:01:01" or str(slurm_time(3605)) != "1:00:05":
+        raise SystemExit("slurm_time to string failed")
+    for invalid in [ "", "1:2:3:4", "a", "1-2:3:4:5" ]:
+        try:
+            slurm_time(invalid)
+            raise SystemExit("slurm_time accepted " + invalid)
+        except ValueError:
+            pass
+
+    ##################
+    #-- slurm_size --#
+    ##################
+    if slurm_size("100").bytes != 100*1024**2 or slurm_size("3G").bytes != 3*1024**3 \
+            or slurm_size("5k").bytes != 5*1024:
+        raise SystemExit("slurm_size from string failed")
+    if str(slurm_size(2*1024**3)) != "2G" or str(slurm_size(1000)) != "1K":
+        raise SystemExit("slurm_size to string failed")
+
+    #############
+    #-- slurm --#
+    #############
+    slurm = slurm()
+
+    data = qd.queuing_system_data()
+    data.job_name = "test"
+    data.merge_stdout_stderr = True
+    data.walltime = 3600
+    data.physical_memory = 3*1024**3
+    node = qd.node_type()
+    node.no_procs = 4
+    data.add_node_type(node)
+
+    strcmp  = "#SBATCH --job-name=test\n#SBATCH --output=%x.o%j\n#SBATCH --mail-type=NONE\n"
+    strcmp += "#SBATCH --time=1:00:00\n#SBATCH --nodes=1\n#SBATCH --ntasks-per-node=4\n"
+    strcmp += "#SBATCH --mem=3G"
+    if slurm.build_script_header(data) != strcmp:
+        raise SystemExit("build_script_header failed")
+
+    # Heterogeneous job: one component per node type
+    node = qd.node_type()
+    node.count = 2
+    node.no_procs = 8
+    node.name = "blue"
+    node.extra_features.append("fast")
+    data.add_node_type(node)
+    data.queue_name = "short@cluster"
+    data.merge_stdout_stderr = False
+    header = slurm.build_script_header(data)
+    if header.count("#SBATCH hetjob") != 1 or "#SBATCH --constraint=blue&fast" not in header \
+            or "#SBATCH --mem-per-cpu=157287K" not in header \
+            or "#SBATCH --clusters=cluster" not in header:
+        raise SystemExit("build_script_header for heterogeneous job failed")
+
+    # Parsing the header and the commandline reproduces it
+    parsed = slurm.parse_script_header(io.StringIO("#!/bin/bash\n#\n" + header + "\necho\n"))
+    if slurm.build_script_header(parsed) != header:
+        raise SystemExit("parse_script_header does not reproduce build_script_header")
+    parsed = slurm.parse_commandline_args(slurm.build_commandline_args(data))
+    if slurm.build_script_header(parsed) != header:
+        raise SystemExit("parse_commandline_args does not reproduce build_commandline_args")
+
+    data.array = "0-9"
+    if slurm.is_ready_for_submission(data):
+        raise SystemExit("job array of heterogeneous job is ready for submission")
+
+    script  = "#!/bin/bash\n"
+    script += "#SBATCH -J job -p batch\n"
+    script += "\n"
+    script += "#SBATCH -t 2-0 -n 16 -N 2 -c 2 # comment\n"
+    script += "#SBATCH --mem 2000 --mail-type=ALL --mail-user=a@b.c\n"
+    script += "#SBATCH --exclusive --account=proj -a 0-4%2\n"
+    script += "srun hostname\n"
+    script += "#SBATCH -N 100\n"
+    data = slurm.parse_script_header(io.StringIO(script))
+    if data.job_name != "job" or data.queue_name != "batch" \
+            or data.walltime != 2*86400 or data.no_nodes() != 2 or data.no_procs() != 32 \
+            or data.physical_memory != 2*2000*1024**2 or data.email != "a@b.c" \
+            or (data.send_email_on.error, data.send_email_on.begin, data.send_email_on.end) \
+            != (True, True, True) or data.array != "0-4%2" \
+            or data.extra_resources != { "exclusive": "", "account": "proj" }:
+        raise SystemExit("parse_script_header failed")
+
+    # Options, which are not understood, are passed on as they are
+    opts = slurm.parse_script_header(io.StringIO("#SBATCH -J opts --export=NONE -N 1\n"
+                                                 "#SBATCH --requeue -d afterok:1\n"))
+    if opts.job_name != "opts" or opts.no_nodes() != 1 or opts.extra_options \
+            != [ [ "--export=NONE" ], [ "--requeue" ], [ "-d", "afterok:1" ] ]:
+        raise SystemExit("parse_script_header did not keep unknown options")
+    if slurm.parse_script_header(io.StringIO(slurm.build_script_header(opts))).extra_options \
+            != opts.extra_options:
+        raise SystemExit("build_script_header did not pass on unknown options")
+
+    for invalid in [ "-N 0", "--ntasks-per-node=x", "--time", "-t 1:2:3:4" ]:
+        try:
+            slurm.parse_commandline_args(invalid)
+            raise SystemExit("parse_commandline_args accepted " + invalid)
+        except ValueError:
+            pass
+
+    try:
+        slurm.parse_commandline_args("--dependency=afterok:1")
+        raise SystemExit("parse_commandline_args accepted unknown argument")
+    except UnknownDataFieldException:
+        pass
+
+    if slurm.parse_job_id("1234;cluster\n") != "1234" \
+            or slurm.parse_job_id("Submitted batch job 42\n") != "42":
+        raise SystemExit("parse_job_id failed")
+
+    data = slurm.parse_commandline_args("-J nice -N 1")
+    data.priority = 5
+    if "--nice" in slurm.build_script_header(data):
+        raise SystemExit("build_script_header requested a negative nice value")
+    data.priority = -5
+    if "#SBATCH --nice=5" not in slurm.build_script_header(data):
+        raise SystemExit("build_script_header did not lower the priority")
+
+    #########################
+    #-- submission (stub) --#
+    #########################
+    import os
+    import stat
+    import tempfile
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        bindir = os.path.join(tmpdir, "bin")
+        os.makedirs(bindir)
+        calls = os.path.join(tmpdir, "calls")
+        sbatch = os.path.join(bindir, "sbatch")
+        with open(sbatch, "w") as f:
+            f.write("#!/bin/sh\n"
+                    + 'echo "$*" >> ' + calls + "\n"
+                    # Fail transiently on the first call only
+                    + "if [ ! -e " + calls + ".failed ]; then\n"
+                    + "    touch " + calls + ".failed\n"
+                    + "    echo 'sbatch: error: Socket timed out on send/recv operation' >&2\n"
+                    + "    exit 1\n"
+                    + "fi\n"
+                    # Read the script from stdin unless a file is given
+                    + 'for LAST; do :; done\n'
+                    + '[ -f "$LAST" ] || cat > ' + os.path.join(tmpdir, "stdin") + "\n"
+                    + "echo \"$(wc -l < " + calls + ");cluster\"\n")
+        os.chmod(sbatch, stat.S_IRWXU)
+        os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+        os.environ["QSNAPSHOT_DIR"] = os.path.join(tmpdir, "snapshots")
+
+        script = os.path.join(tmpdir, "job.sh")
+        with open(script, "w") as f:
+            f.write("#!/bin/bash\n" + slurm.build_script_header(data) + "\necho\n")
+
+        if slurm.submit_script(script, backoff=0.01) != "2":
+            raise SystemExit("submit_script did not retry or capture the job id")
+        if slurm.submit_script_stdin("echo stdin\n", data, backoff=0.01) != "3":
+            raise SystemExit("submit_script_stdin did not capture the job id")
+        with open(calls) as f:
+            argvs = f.read().splitlines()
+        with open(os.path.join(tmpdir, "stdin")) as f:
+            if f.read() != "echo stdin\n":
+                raise SystemExit("submit_script_stdin did not pass the script on stdin")
+        if argvs[1] != "--parsable " + script or not argvs[2].startswith("--parsable ") \
+                or "--job-name=nice" not in argvs[2] or "--nice=5" not in argvs[2]:
+            raise SystemExit("sbatch was not invoked as expected: " + str(argvs))
+
+    print("Unit Test passed")
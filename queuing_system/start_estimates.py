@@ -0,0 +1,194 @@
+# vi: set et ts=4 sw=4 sts=4:
+
+# Module to estimate when PBS jobs start and complete
+# Copyright (C) 2017 Michael F. Herbst
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# A copy of the GNU General Public License can be found in the
+# file LICENCE or at <http://www.gnu.org/licenses/>.
+
+import json
+import os
+import time
+
+# Printed instead of an estimate if showstart does not know the job
+UNKNOWN = "-- unknown job --"
+
+# Printed instead of an estimate if showstart did not answer in time
+TIMEOUT = "-- timeout --"
+
+def format_time(epoch):
+    """Format an epoch like showstart does"""
+    return time.strftime("%a %b %d %H:%M:%S", time.localtime(epoch))
+
+def parse_showstart(output):
+    """
+    Parse the output of showstart and return the tuple (start, completion)
+    of the estimated times as printed by showstart (None if not found).
+    """
+    start = completion = None
+    for line in output.splitlines():
+        if not " on " in line:
+            continue
+        when = line.split(" on ", 1)[1].strip()
+        if start is None and "start" in line:
+            start = when
+        elif completion is None and "completion" in line:
+            completion = when
+    return start, completion
+
+def run_showstart(job_id, timeout=10):
+    """
+    Run showstart for the job and return (start, completion).
+    Unknown values are replaced by UNKNOWN or TIMEOUT.
+    """
+    import subprocess
+    try:
+        proc = subprocess.run([ "showstart", job_id ], stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, universal_newlines=True,
+                              timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return TIMEOUT, TIMEOUT
+    except OSError:
+        return UNKNOWN, UNKNOWN
+    start, completion = parse_showstart(proc.stdout)
+    return start or UNKNOWN, completion or UNKNOWN
+
+class start_estimates:
+    """
+    Estimates for the start and completion of jobs.
+
+    For running jobs, whose start time and walltime are known from
+    qstat -f, the completion is computed right away, since this is
+    what the scheduler would report anyway. For all other jobs showstart
+    is run, at most max_parallel at a time and each with a timeout,
+    since the scheduler has no command to query many jobs at once.
+
+    The estimates are cached in the file cachefile for ttl seconds,
+    such that repeated queries (e.g. summary in qinvestigate) are instant.
+    """
+
+    def __init__(self, cachefile=None, ttl=60, max_parallel=8, timeout=10):
+        self.__cachefile = cachefile
+        self.__ttl = ttl
+        self.__max_parallel = max_parallel
+        self.__timeout = timeout
+
+    def __load_cache(self):
+        if self.__cachefile is None:
+            return {}
+        try:
+            with open(self.__cachefile) as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        now = time.time()
+        return { k: v for k, v in cache.items() if now - v["time"] <= self.__ttl }
+
+    def __save_cache(self, cache):
+        if self.__cachefile is None:
+            return
+        try:
+            tmpfile = self.__cachefile + "." + str(os.getpid()) + ".tmp"
+            with open(tmpfile, "w") as f:
+                json.dump(cache, f)
+            os.replace(tmpfile, self.__cachefile)
+        except OSError:
+            # The cache is only an optimisation
+            pass
+
+    def get(self, job_ids, state=None):
+        """
+        Return a dict from each of the job_ids to the tuple (start, completion)
+        of strings. If the pbs_state state is given, the completion of running
+        jobs is computed from their start time and walltime.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        ret = {}
+        for job_id in job_ids:
+            job = state.job(job_id) if state is not None else None
+            if job is not None and job.state == "R" and job.start_time is not None \
+                    and job.walltime is not None:
+                ret[job_id] = (format_time(job.start_time),
+                               format_time(job.start_time + job.walltime))
+
+        cache = self.__load_cache()
+        missing = []
+        for job_id in job_ids:
+            if job_id in ret or job_id in missing:
+                continue
+            if job_id in cache:
+                ret[job_id] = tuple(cache[job_id]["estimate"])
+            else:
+                missing.append(job_id)
+
+        if missing:
+            def run(job_id):
+                return job_id, run_showstart(job_id, timeout=self.__timeout)
+
+            now = time.time()
+            with ThreadPoolExecutor(max_workers=max(1, self.__max_parallel)) as executor:
+                for job_id, estimate in executor.map(run, missing):
+                    ret[job_id] = estimate
+                    if estimate[0] != TIMEOUT:
+                        cache[job_id] = { "time": now, "estimate": estimate }
+            self.__save_cache(cache)
+        return ret
+
+if __name__ == "__main__":
+    import stat
+    import tempfile
+    from queuing_system.pbs_state import pbs_state, pbs_job
+
+    output = ("job 12 requires 4 procs for 1:00:00\n"
+              "Estimated Rsv based start in 2:00:00 on Fri Oct 16 12:00:00\n"
+              "Estimated Rsv based completion in 3:00:00 on Fri Oct 16 13:00:00\n")
+    if parse_showstart(output) != ("Fri Oct 16 12:00:00", "Fri Oct 16 13:00:00"):
+        raise SystemExit("parse_showstart failed")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        counter = os.path.join(tmpdir, "counter")
+        showstart = os.path.join(tmpdir, "showstart")
+        with open(showstart, "w") as f:
+            f.write("#!/bin/sh\necho $1 >> " + counter + "\n"
+                    + "[ \"$1\" = 13 ] && sleep 5\n"
+                    + "[ \"$1\" = 14 ] && exit 1\n"
+                    + "echo 'Estimated Rsv based start in 1:00 on Fri Oct 16 12:00:00'\n"
+                    + "echo 'Estimated Rsv based completion in 2:00 on Fri Oct 16 13:00:00'\n")
+        os.chmod(showstart, stat.S_IRWXU)
+        os.environ["PATH"] = tmpdir + os.pathsep + os.environ["PATH"]
+
+        running = pbs_job("11.server", { "job_state": "R", "start_time": "1000",
+                                         "Resource_List.walltime": "01:00:00" })
+        state = pbs_state([ running ])
+        estimates = start_estimates(os.path.join(tmpdir, "cache.json"), timeout=1)
+
+        start = time.perf_counter()
+        ret = estimates.get([ "11", "12", "13", "14" ], state)
+        if time.perf_counter() - start > 4:
+            raise SystemExit("start_estimates did not respect the timeout")
+        if ret["11"] != (format_time(1000), format_time(4600)):
+            raise SystemExit("start_estimates did not compute the completion of a running job")
+        if ret["12"] != ("Fri Oct 16 12:00:00", "Fri Oct 16 13:00:00"):
+            raise SystemExit("start_estimates did not use showstart")
+        if ret["13"] != (TIMEOUT, TIMEOUT) or ret["14"] != (UNKNOWN, UNKNOWN):
+            raise SystemExit("start_estimates did not deal with failing showstart")
+
+        with open(counter) as f:
+            n_calls = len(f.readlines())
+        estimates.get([ "12", "14" ])
+        with open(counter) as f:
+            if len(f.readlines()) != n_calls:
+                raise SystemExit("start_estimates did not use the cache")
+
+    print("Unit Test passed")
@@ -19,12 +19,15 @@
 import os
 import os.path
 
-def which(exectuable,path=os.environ["PATH"]):
+def which(exectuable,path=None):
     """Perform a lookup like the which function and return the
-    full path to the executable
+    full path to the executable. If path is None, the current
+    value of the PATH environment variable is used.
 
     Return the path if found, else None
     """
+    if path is None:
+        path = os.environ.get("PATH", "")
     for p in path.split(":"):
         full = p + os.path.sep + exectuable
         if os.path.exists(full) and os.access(full,os.X_OK):